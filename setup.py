@@ -67,12 +67,12 @@ the security provided by the Slack environment.''',
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
 
         'Operating System :: OS Independent',
 
@@ -83,12 +83,22 @@ the security provided by the Slack environment.''',
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
+    # asyncio.run (the Events API receiver) needs Python 3.7
+    python_requires='>=3.7',
+
     install_requires=[
         'slackclient',
         'python-daemon',
-        'configparser'
+        'configparser',
+        'numpy',
+        'requests'
     ],
 
+    # Optional run-time dependencies
+    extras_require={
+        'images': ['Pillow'],
+    },
+
     test_suite='nose2.collector.collector',
 
     # To provide executable scripts, use entry points in preference to the
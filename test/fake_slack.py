@@ -0,0 +1,133 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A small, local, stand in for the Slack Web API that enforces a rate limit.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSlack(object):
+    """
+    Accepts up to `limit` calls of each method every `period` seconds, and answers any
+    more with 429 and a `Retry-After` header. `calls` holds the arguments of every
+    accepted call, `limited` counts the refused calls and `connections` the number of
+    connections opened. `outage` (a status code and body) is the answer to every call
+    while set, and `stall` delays every answer by that many seconds.
+    """
+
+    def __init__(self, limit=10, period=1.0, retry_after=1):
+        self.limit = limit
+        self.period = period
+        self.retry_after = retry_after
+
+        self.calls = []
+        self.limited = Counter()
+        self.connections = 0
+        self.outage = None
+        self.stall = 0
+        self.lock = threading.Lock()
+        self._windows = {}
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with fake.lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                fake._dispatch(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/api'.format(self.server.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def methods(self):
+        return [x[0] for x in self.calls]
+
+    def _dispatch(self, handler):
+        method = handler.path.split('/')[-1]
+        length = int(handler.headers.get('Content-Length', 0))
+        body = handler.rfile.read(length) if length else b''
+
+        if self.stall:
+            time.sleep(self.stall)
+
+        if self.outage:
+            status, text = self.outage
+            handler.send_response(status)
+            handler.send_header('Content-Type', 'text/html')
+            handler.send_header('Content-Length', str(len(text)))
+            handler.end_headers()
+            handler.wfile.write(text)
+            return
+
+        with self.lock:
+            now = time.time()
+            start, count = self._windows.get(method, (now, 0))
+            if now - start >= self.period:
+                start, count = now, 0
+
+            if count >= self.limit:
+                self.limited[method] += 1
+                status, data = 429, {'ok': False, 'error': 'ratelimited'}
+            else:
+                self._windows[method] = (start, count + 1)
+                arguments = {}
+                if handler.headers.get('Content-Type', '').startswith(
+                        'application/x-www-form-urlencoded'):
+                    arguments = dict((k, v[0]) for k, v in
+                                     parse_qs(body.decode('utf-8')).items())
+                self.calls.append((method, arguments))
+                status, data = 200, {'ok': True, 'ts': str(now),
+                                     'file': {'permalink': 'https://files/1'}}
+
+        text = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(text)))
+        if 429 == status:
+            handler.send_header('Retry-After', str(self.retry_after))
+        handler.end_headers()
+        handler.wfile.write(text)
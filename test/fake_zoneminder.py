@@ -0,0 +1,240 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A small, local, stand in for the parts of the ZoneMinder API the bot uses.
+"""
+
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, unquote
+
+from configparser import ConfigParser
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeZoneMinder(object):
+    """
+    Serves events and monitors from memory. `requests` counts the requests made to
+    each path. With `etags` set JSON answers have an ETag, and a matching
+    If-None-Match is answered with a 304.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.monitors = []
+        self.etags = False
+        # What the host reports about itself
+        self.load = [0.5, 0.4, 0.3]
+        self.daemon = 1
+        self.disk = 12.5
+
+        # Capture rate by monitor ID, and monitors whose snapshots fail
+        self.fps = {}
+        self.dead = set()
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake._dispatch(self, 'GET')
+
+            def do_POST(self):
+                fake._dispatch(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/zm'.format(self.server.server_address[1])
+
+    def config(self):
+        config = ConfigParser()
+        config.read_dict({
+            'Slack': {'api_token': 'xoxb-test', 'bot_id': 'UBOT', 'channels': 'alerts'},
+            'ZoneMinder': {'url': self.url, 'username': 'admin', 'password': 'admin'}
+        })
+        return config
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_events(self, count, monitor_id='1', closed=True):
+        with self.lock:
+            first = len(self.events) + 1
+            for event_id in range(first, first + count):
+                self.events.append({
+                    'Id': str(event_id),
+                    'MonitorId': monitor_id,
+                    'Name': 'Event-{0}'.format(event_id),
+                    'Cause': 'Motion',
+                    'StartTime': '2016-10-01 14:05:59',
+                    'EndTime': '2016-10-01 14:06:09' if closed else None,
+                    'Length': '10.00' if closed else '1.00',
+                    'MaxScore': str(event_id % 100) if closed else '1'
+                })
+
+    def close_event(self, event_id, max_score):
+        with self.lock:
+            event = self.events[int(event_id) - 1]
+            event.update({'EndTime': '2016-10-01 14:06:09', 'Length': '10.00',
+                          'MaxScore': str(max_score)})
+
+    def add_monitor(self, monitor_id, name, function='Modect', enabled='1'):
+        self.monitors.append({
+            'Id': str(monitor_id),
+            'Name': name,
+            'Function': function,
+            'Enabled': enabled
+        })
+
+    def _dispatch(self, handler, method):
+        parsed = urlparse(handler.path)
+        path = unquote(parsed.path)
+        query = dict((k, v[0]) for k, v in parse_qs(parsed.query).items())
+
+        length = int(handler.headers.get('Content-Length', 0))
+        body = handler.rfile.read(length) if length else b''
+
+        with self.lock:
+            self.requests[path] += 1
+            status, data = self._respond(method, path, query, body)
+
+        if isinstance(data, bytes):
+            text, content_type = data, 'image/jpeg'
+        else:
+            text, content_type = json.dumps(data).encode('utf-8'), 'application/json'
+
+        etag = None
+        if self.etags and content_type == 'application/json' and status == 200:
+            etag = '"{0}"'.format(hashlib.md5(text).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                status, text = 304, b''
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        if etag:
+            handler.send_header('ETag', etag)
+        handler.send_header('Content-Length', str(len(text)))
+        handler.end_headers()
+        handler.wfile.write(text)
+
+    def _respond(self, method, path, query, body):
+        if method == 'POST' and path == '/zm/':
+            return 200, {}
+
+        if path == '/zm/api/events/index.json':
+            events = sorted(self.events, key=lambda x: int(x['Id']),
+                            reverse=query.get('direction') == 'desc')
+            return 200, self._page(events, query)
+
+        match = re.match(r'^/zm/api/events/index/Id >:(\d+)\.json$', path)
+        if match:
+            events = [x for x in self.events if int(x['Id']) > int(match.group(1))]
+            return 200, self._page(events, query)
+
+        match = re.match(r'^/zm/api/events/(\d+)\.json$', path)
+        if match:
+            events = [x for x in self.events if x['Id'] == match.group(1)]
+            if not events:
+                return 404, {}
+            frame = {'Id': events[0]['Id'], 'FrameId': '1', 'Delta': '0.00',
+                     'Score': str(max(1, int(events[0]['MaxScore'])))}
+            return 200, {'event': {'Event': events[0], 'Monitor': {'Name': 'Front'},
+                                   'Frame': [frame]}}
+
+        if path == '/zm/index.php' and query.get('view') == 'image':
+            return 200, b'jpeg'
+
+        match = re.match(r'^/zm/api/monitors/(\d+)\.json$', path)
+        if match and method == 'POST':
+            monitors = [x for x in self.monitors if x['Id'] == match.group(1)]
+            if not monitors:
+                return 404, {}
+            form = dict((k, v[0]) for k, v in parse_qs(body.decode('utf-8')).items())
+            monitors[0]['Enabled'] = form.get('Monitor[Enabled]', monitors[0]['Enabled'])
+            return 200, {'message': 'Saved'}
+
+        if path == '/zm/api/host/getVersion.json':
+            return 200, {'version': '1.30.0', 'apiversion': '1.0'}
+
+        if path == '/zm/api/host/getLoad.json':
+            return 200, {'load': self.load}
+
+        if path == '/zm/api/host/daemonCheck.json':
+            return 200, {'result': self.daemon}
+
+        if path == '/zm/api/host/getDiskPercent.json':
+            return 200, {'usage': {'Front': {'space': self.disk}, 'Total': {'space': self.disk}}}
+
+        if path == '/zm/cgi-bin/nph-zms':
+            if query.get('monitor') in self.dead:
+                return 500, {}
+            return 200, b'jpeg'
+
+        if path == '/zm/api/monitors.json':
+            monitors = []
+            for monitor in self.monitors:
+                item = {'Monitor': dict(monitor)}
+                if monitor['Id'] in self.fps:
+                    item['Monitor_Status'] = {'MonitorId': monitor['Id'], 'Status': 'Connected',
+                                              'CaptureFPS': '{0:.2f}'.format(self.fps[monitor['Id']])}
+                monitors.append(item)
+            return 200, {'monitors': monitors}
+
+        return 404, {}
+
+    @staticmethod
+    def _page(events, query):
+        limit = int(query.get('limit', 25))
+        page = int(query.get('page', 1))
+        page_count = max(1, int(math.ceil(len(events) / float(limit))))
+
+        return {
+            'events': [{'Event': x} for x in events[(page - 1) * limit:page * limit]],
+            'pagination': {
+                'page': page,
+                'current': len(events[(page - 1) * limit:page * limit]),
+                'count': len(events),
+                'prevPage': page > 1,
+                'nextPage': page < page_count,
+                'pageCount': page_count,
+                'limit': limit
+            }
+        }
@@ -0,0 +1,91 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+from io import BytesIO
+
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from zonebot.alerts import AlertPipeline
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+class FakeSlack(object):
+    def __init__(self):
+        self.calls = []
+
+    def api_call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        return {'ok': True, 'file': {'permalink': 'https://files/{0}'.format(len(self.calls))}}
+
+
+def __pipeline(slack):
+    config = ConfigParser()
+    config.read_dict({'Slack': {'api_token': 'token', 'channels': 'security'},
+                      'ZoneMinder': {'url': 'http://zm'},
+                      'Monitor Front': {'channels': 'front, security'},
+                      'Monitor Garage': {'channels': 'garage'},
+                      'Alerts': {'multiple frames': 'message'}})
+
+    return AlertPipeline(config, zone_minder=object(), slack=slack)
+
+
+def __event(event_id, monitor):
+    return {'id': event_id, 'monitor': monitor, 'comment': 'Event {0}'.format(event_id),
+            'images': [BytesIO(b'jpeg')]}
+
+
+def test_routing():
+    slack = FakeSlack()
+    pipeline = __pipeline(slack)
+
+    # A single upload, shared to every channel of the monitor
+    assert pipeline.post_events([__event(1, 'Front')])
+    assert_equal(['files.upload'], [x[0] for x in slack.calls])
+    assert_equal('front,security', slack.calls[0][1]['channels'])
+
+    slack.calls = []
+    assert pipeline.post_events([__event(2, 'Back Yard')])
+    assert_equal('security', slack.calls[0][1]['channels'])
+
+
+def test_routing_merged():
+    slack = FakeSlack()
+    pipeline = __pipeline(slack)
+
+    # Monitors with the same channels share one message, each image uploaded once
+    # and linked from every channel
+    assert pipeline.post_events([__event(1, 'Front'), __event(2, 'Front')])
+    assert_equal(['files.upload', 'files.upload', 'chat.postMessage', 'chat.postMessage'],
+                 [x[0] for x in slack.calls])
+    assert_equal(['front', 'security'], [x[1]['channel'] for x in slack.calls[2:]])
+    assert 'https://files/2' in slack.calls[2][1]['text']
+
+    # The images are shared to the channels, so the links work for their members
+    assert_equal(['front,security'] * 2, [x[1]['channels'] for x in slack.calls[:2]])
+
+
+def test_routing_private():
+    slack = FakeSlack()
+    pipeline = __pipeline(slack)
+
+    # Events merged across monitors still only go to each monitor's own channels
+    assert pipeline.post_events([__event(1, 'Front'), __event(2, 'Garage')])
+    assert_equal([('files.upload', 'front,security', 'Event 1'),
+                  ('files.upload', 'garage', 'Event 2')],
+                 [(x[0], x[1]['channels'], x[1]['initial_comment']) for x in slack.calls])
@@ -0,0 +1,140 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from zonebot.coalesce import EventSpool, get_monitor_group
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+def test_monitor_group():
+    config = ConfigParser()
+    config.read_dict({'Monitor Groups': {'outside': 'Front Door, Driveway'}})
+
+    assert_equal('outside', get_monitor_group(config, 'driveway'))
+    assert_equal('Garage', get_monitor_group(config, 'Garage'))
+
+
+def test_burst():
+    directory = tempfile.mkdtemp()
+
+    try:
+        sent = []
+        saved = []
+
+        def send(events):
+            sent.append(events)
+            saved.extend(os.path.isfile(x['images'][0]) for x in events)
+            return True
+
+        def submit(event_id):
+            spool = EventSpool(directory, 0.3, 5)
+            spool.submit({'id': event_id, 'images': [BytesIO(b'jpeg')]}, send)
+
+        # Six monitors, one after another, as if from six zonebot-alert processes
+        threads = []
+        for event_id in range(1, 7):
+            thread = threading.Thread(target=submit, args=(event_id,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+
+        for thread in threads:
+            thread.join()
+
+        assert_equal(1, len(sent))
+        assert_equal([1, 2, 3, 4, 5, 6], [x['id'] for x in sent[0]])
+        assert_equal([True] * 6, saved)
+
+        # Sent events, and their images, are removed from the spool
+        assert_equal(['lock'], os.listdir(directory))
+
+        # An event after the window is a new message
+        submit(7)
+        assert_equal([7], [x['id'] for x in sent[1]])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_max_delay():
+    directory = tempfile.mkdtemp()
+
+    try:
+        sent = []
+
+        def send(events):
+            sent.append(events)
+            return True
+
+        spool = EventSpool(directory, 0.2, 0.5)
+
+        # An event every 50ms for a second, never a gap as long as the window
+        count = 0
+        start = time.time()
+        while time.time() - start < 1:
+            count += 1
+            spool.submit({'id': count}, send, background=True)
+            time.sleep(0.05)
+
+        deadline = time.time() + 5
+        while spool.entries() and time.time() < deadline:
+            time.sleep(0.05)
+
+        # The stream is still sent, a message about every max delay
+        assert_equal(list(range(1, count + 1)), [x['id'] for y in sent for x in y])
+        assert 2 <= len(sent) <= 3
+        assert 0.4 < sent[0][-1]['queued'] - sent[0][0]['queued'] < 0.6
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_failed_send():
+    directory = tempfile.mkdtemp()
+
+    try:
+        attempts = []
+        spool = EventSpool(directory, 0, 0)
+
+        # Kept in the spool when sending fails ...
+        spool.submit({'id': 1}, lambda events: attempts.append(len(events)))
+        assert_equal([1], attempts)
+        assert_equal([1], [x['attempts'] for x in spool.entries()])
+
+        # ... sent with the next event ...
+        spool.submit({'id': 2}, lambda events: attempts.append(len(events)))
+        assert_equal([1, 2], attempts)
+
+        # ... and given up on after too many attempts
+        spool.flush(lambda events: attempts.append(len(events)))
+        assert_equal([1, 2, 2], attempts)
+        assert_equal([2], [x['id'] for x in spool.entries()])
+
+        sent = []
+        spool.flush(lambda events: sent.extend(events) or True)
+        assert_equal([2], [x['id'] for x in sent])
+        assert_equal([], spool.entries())
+    finally:
+        shutil.rmtree(directory)
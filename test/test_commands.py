@@ -15,10 +15,17 @@
 #
 
 import logging
+import shutil
+import tempfile
+import threading
 
 import zonebot
 from configparser import ConfigParser
+from fake_zoneminder import FakeZoneMinder
+from nose.tools import assert_equal
+from zonebot.counters import read_counters
 from zonebot.commands import *
+from zonebot.zoneminder.zoneminder import ZoneMinder
 
 logging.basicConfig(level=logging.CRITICAL)
 logging.getLogger("zonebot").disabled = True
@@ -234,3 +241,128 @@ def test_humansize():
     assert '1 Tb' == humansize(scale + 1)
     assert '2.17 Tb' == humansize(scale * 2.17)
     assert '1024 Tb' == humansize((scale * 1024) - 1)
+
+
+def test_toggle_group():
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_monitor(1, 'Front')
+        fake.add_monitor(2, 'Drive', enabled='0')
+        fake.add_monitor(3, 'Kitchen', enabled='0')
+        config = fake.config()
+        config.read_dict({'Monitor Groups': {'outside': 'Front, Drive, Shed'}})
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+
+        cmd = ToggleMonitor(config=config)
+        cmd.perform('me', ['enable', 'monitor', 'outside'], zoneminder)
+        assert_equal('*outside* monitors enabled: 1 changed, 1 already enabled, 1 failed\n'
+                     'Drive changed to enabled\n'
+                     'Front already enabled\n'
+                     'shed not found', cmd.result)
+
+        cmd = ToggleMonitor(config=config)
+        cmd.perform('me', ['disable', 'monitor', 'all'], zoneminder)
+        assert cmd.result.startswith('*All* monitors disabled: 2 changed, 1 already disabled')
+
+        cmd = ToggleMonitor(config=config)
+        cmd.perform('me', ['enable', 'monitor', 'kitchen'], zoneminder)
+        assert_equal('Monitor kitchen state changed to enabled', cmd.result)
+    finally:
+        fake.stop()
+
+
+class CountingCommand(Command):
+    cacheable = True
+    cache_ttl = 10
+    performed = 0
+
+    def perform(self, user_name, commands, zoneminder):
+        CountingCommand.performed += 1
+        self.result = 'answer {0}'.format(CountingCommand.performed)
+
+
+def test_command_cache():
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Permissions': {'alice': 'read', 'bob': 'read', 'carol': 'any'}})
+        cache = CommandCache(config)
+        CountingCommand.performed = 0
+
+        # The same permissions share the answer, whatever the case of the command
+        first = cache.perform(CountingCommand(), 'alice', ['status'], None)
+        second = cache.perform(CountingCommand(), 'bob', ['Status'], None)
+        assert_equal('answer 1', second.result)
+        assert first is second
+        assert_equal({'command cache hits': 1}, read_counters(config))
+
+        # Other permissions, or another command, ask again
+        assert_equal('answer 2', cache.perform(CountingCommand(), 'carol', ['status'], None).result)
+        assert_equal('answer 3', cache.perform(CountingCommand(), 'alice', ['list'], None).result)
+
+        # Expired answers are not used
+        for entry in cache._entries.values():
+            entry.expires = 0
+        assert_equal('answer 4', cache.perform(CountingCommand(), 'bob', ['status'], None).result)
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def test_command_cache_single_flight():
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowCommand(CountingCommand):
+        def perform(self, user_name, commands, zoneminder):
+            started.set()
+            release.wait(5)
+            super(SlowCommand, self).perform(user_name, commands, zoneminder)
+
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir}})
+        cache = CommandCache(config)
+        CountingCommand.performed = 0
+        results = []
+        first = threading.Thread(target=lambda: results.append(
+            cache.perform(SlowCommand(), 'alice', ['status'], None)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(
+            cache.perform(SlowCommand(), 'bob', ['status'], None)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        # The second caller waited for the first rather than asking again
+        assert_equal(1, CountingCommand.performed)
+        assert_equal(['answer 1', 'answer 1'], [x.result for x in results])
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def test_status_progress():
+    fake = FakeZoneMinder().start()
+    try:
+        zoneminder = ZoneMinder(fake.config())
+        zoneminder.login()
+
+        cmd = Status(config=fake.config())
+        assert cmd.placeholder
+        partial = []
+        cmd.progress = partial.append
+        cmd.perform('me', ['status'], zoneminder)
+
+        # The version, then the daemon state, are shown before the whole status
+        assert_equal(2, len(partial))
+        assert partial[0].startswith('• _ZoneMinder version_')
+        assert '_ZoneMinder daemon_' in partial[1]
+        assert '_Load average_' not in partial[1]
+    finally:
+        fake.stop()
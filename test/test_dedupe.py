@@ -0,0 +1,120 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+import numpy
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from PIL import Image
+from zonebot.alerts import AlertPipeline
+from zonebot.dedupe import FrameHistory
+from zonebot.images import difference_hash
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+def __frame(seed, brightness=0):
+    pixels = numpy.random.RandomState(seed).randint(0, 200, (9, 16)).astype(numpy.uint8)
+    picture = Image.fromarray(pixels + brightness).resize((1280, 720), Image.BILINEAR)
+
+    result = BytesIO()
+    picture.save(result, format='JPEG', quality=85)
+    return result
+
+
+def test_difference_hash():
+    scene = difference_hash(__frame(1))
+
+    # The same scene a little brighter looks the same, another scene does not
+    assert bin(scene ^ difference_hash(__frame(1, brightness=40))).count('1') < 4
+    assert bin(scene ^ difference_hash(__frame(2))).count('1') > 16
+
+    frame = __frame(3)
+    start = time.time()
+    for _ in range(10):
+        difference_hash(frame)
+    assert (time.time() - start) / 10 < 0.02
+
+
+def test_frame_history():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'frames.bin')
+        scenes = [difference_hash(__frame(x)) for x in range(4)]
+
+        # Nothing is remembered until it is recorded as posted
+        assert_equal([False, False], FrameHistory(path, 2).check(scenes[:2], 5, 60))
+        assert_equal([False, False], FrameHistory(path, 2).check(scenes[:2], 5, 60))
+        FrameHistory(path, 2).record(scenes[:2])
+
+        # Remembered between processes
+        assert_equal([True, False], FrameHistory(path, 2).check(scenes[1:3], 5, 60))
+        FrameHistory(path, 2).record(scenes[2:3])
+
+        # Only the newest are kept ...
+        assert_equal([False], FrameHistory(path, 2).check(scenes[:1], 5, 60))
+        FrameHistory(path, 2).record(scenes[:1])
+
+        # ... and only for so long
+        time.sleep(0.1)
+        assert_equal([False], FrameHistory(path, 2).check(scenes[2:3], 5, 0.05))
+
+        # The same scene twice in one event is a duplicate too
+        assert_equal([False, True], FrameHistory(path, 2).check([scenes[3]] * 2, 5, 60))
+    finally:
+        shutil.rmtree(directory)
+
+
+class DownSlack(object):
+    def __init__(self):
+        self.ok = False
+
+    def api_call(self, method, **kwargs):
+        return {'ok': self.ok, 'error': 'service_unavailable'}
+
+
+def test_only_posted_frames_are_remembered():
+    directory = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': directory},
+                          'Slack': {'api_token': 'token', 'channels': 'alerts'},
+                          'Alerts': {'duplicate distance': '5'}})
+        slack = DownSlack()
+        pipeline = AlertPipeline(config, zone_minder=object(), slack=slack)
+
+        def event():
+            images, hashes = pipeline._drop_duplicates('Front', 1, [__frame(1)])
+            return {'id': 1, 'monitor': 'Front', 'comment': 'Event', 'images': images,
+                    'hashes': hashes}
+
+        # Slack is down, so the frame is not remembered and the retry posts it
+        assert not pipeline.post_events([event()])
+        retry = event()
+        assert_equal(1, len(retry['images']))
+
+        slack.ok = True
+        assert pipeline.post_events([retry])
+        assert_equal([], event()['images'])
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,126 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import shutil
+import tempfile
+import time
+
+from nose.tools import assert_equal
+from zonebot.commands import ListEvents, parse_since
+from zonebot.zoneminder.zoneminder import ZoneMinder
+from fake_zoneminder import FakeZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+INDEX = '/zm/api/events/index/Id >:{0}.json'
+
+
+def test_parse_since():
+    # 2016-10-05 14:30:00 local time
+    now = time.mktime((2016, 10, 5, 14, 30, 0, 0, 0, -1))
+
+    assert_equal('2016-10-05 00:00:00', parse_since('today', now))
+    assert_equal('2016-10-04 00:00:00', parse_since('Yesterday', now))
+    assert_equal('2016-10-05 14:00:00', parse_since('30m', now))
+    assert_equal('2016-10-05 08:30:00', parse_since('6h', now))
+    assert_equal('2016-09-28 14:30:00', parse_since('1w', now))
+    assert_equal(None, parse_since('garage', now))
+
+
+def test_event_index():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_monitor('1', 'Front')
+        fake.add_monitor('2', 'Garage')
+        fake.add_events(150, monitor_id='1')
+        fake.add_events(50, monitor_id='2')
+
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir}})
+
+        zone_minder = ZoneMinder(config)
+        zone_minder.login()
+
+        index = zone_minder.get_event_index()
+        assert_equal(200, index.refresh(zone_minder))
+        assert_equal(200, index.last_id())
+
+        # Only the new events are asked for
+        fake.add_events(5, monitor_id='2')
+        assert_equal(5, index.refresh(zone_minder))
+        assert_equal(1, fake.requests[INDEX.format(200)])
+
+        recent = index.recent(monitor='garage', limit=3)
+        assert_equal([205, 204, 203], [x['id'] for x in recent])
+        assert_equal('Garage', recent[0]['monitor'])
+
+        top = index.top(monitor='front', since='2016-10-01', limit=2)
+        assert_equal([(99, 99), (98, 98)], [(x['id'], x['max_score']) for x in top])
+
+        # Answered from the index, ZoneMinder is not asked again
+        command = ListEvents(config)
+        command.perform('user', ['events', 'top', 'garage'], zone_minder)
+        assert_equal(10, len(command.text.split('\n')))
+        assert_equal(0, fake.requests[INDEX.format(205)])
+
+        command.perform('user', ['events', 'front', 'later'], zone_minder)
+        assert command.text.startswith('*Error*')
+
+        # Events still being recorded are fetched again until they close
+        fake.add_events(2, monitor_id='1', closed=False)
+        assert_equal(2, index.refresh(zone_minder))
+        assert_equal([1, 1], [x['max_score'] for x in index.recent(monitor='front', limit=2)])
+
+        fake.close_event(206, 500)
+        fake.add_events(1, monitor_id='1')
+        assert_equal(3, index.refresh(zone_minder))
+        assert_equal(206, index.top(monitor='front', limit=1)[0]['id'])
+
+        # 206 is closed, only 207 is asked for again
+        assert_equal(2, index.refresh(zone_minder))
+        assert_equal(1, fake.requests[INDEX.format(206)])
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
+
+
+def test_history():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_monitor('1', 'Front')
+        fake.add_events(5000)
+
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Events': {'history': '300'}})
+
+        zone_minder = ZoneMinder(config)
+        zone_minder.login()
+
+        # A new index only starts with recent history
+        index = zone_minder.get_event_index()
+        assert_equal(300, index.refresh(zone_minder))
+        assert_equal(4701, index.recent(limit=300)[-1]['id'])
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
@@ -0,0 +1,93 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import datetime
+import logging
+import shutil
+import tempfile
+
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from zonebot.alerts import AlertPipeline
+from zonebot.counters import read_counters
+from zonebot.filters import filtering_enabled, in_period, suppression_reason
+from fake_zoneminder import FakeZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+
+def test_rules():
+    config = ConfigParser()
+    config.read_dict({'Alerts': {'min score': '20', 'causes': 'Motion, Signal'},
+                      'Monitor Garage': {'min length': '5', 'quiet hours': '08:00-17:30'}})
+
+    assert filtering_enabled(config)
+    assert_equal(None, suppression_reason(config, 'Front', score=20, cause='Motion'))
+    assert suppression_reason(config, 'Front', score=19)
+    assert suppression_reason(config, 'Front', cause='Forced Web')
+
+    # Per monitor rules
+    assert_equal(None, suppression_reason(config, 'Front', length=1))
+    assert suppression_reason(config, 'garage', length=1)
+    assert suppression_reason(config, 'Garage', start_time='2016-10-01 12:00:00')
+    assert_equal(None, suppression_reason(config, 'Garage', start_time='2016-10-01 17:30:00'))
+
+    # Unknown values are not filtered on
+    assert_equal(None, suppression_reason(config, 'Garage'))
+
+    assert not filtering_enabled(ConfigParser())
+
+
+def test_periods():
+    assert in_period(datetime.time(23, 0), '22:00-06:00')
+    assert in_period(datetime.time(5, 59), '22:00-06:00')
+    assert not in_period(datetime.time(6, 0), '22:00-06:00')
+    assert not in_period(datetime.time(12, 0), 'noon-night')
+
+
+class NullSlack(object):
+    def api_call(self, method, **kwargs):
+        return {'ok': True}
+
+
+def test_filter_before_loading():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_monitor('1', 'Front')
+        fake.add_events(80)
+
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Slack': {'api_token': 'token', 'channels': 'alerts'},
+                          'Alerts': {'min score': '50'}})
+
+        pipeline = AlertPipeline(config, slack=NullSlack())
+
+        # Low scores are filtered out from the summary, the event is never loaded
+        assert pipeline.send_event_summary(fake.events[29])
+        assert_equal(0, fake.requests['/zm/api/events/30.json'])
+        assert_equal({'events filtered': 1}, read_counters(config))
+
+        assert pipeline.send_event_summary(fake.events[69])
+        assert_equal(1, fake.requests['/zm/api/events/70.json'])
+        assert_equal({'events filtered': 1}, read_counters(config))
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
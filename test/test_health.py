@@ -0,0 +1,117 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import logging
+import shutil
+import tempfile
+
+from fake_zoneminder import FakeZoneMinder
+from nose.tools import assert_equal
+from zonebot.commands import Health
+from zonebot.health import DEGRADED, OK, HealthMonitor
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+
+class Recorder(object):
+    def __init__(self):
+        self.ok = True
+        self.posts = []
+
+    def api_call(self, method, **kwargs):
+        if not self.ok:
+            return {'ok': False, 'error': 'ratelimited'}
+        self.posts.append(kwargs['text'])
+        return {'ok': True}
+
+
+def test_health():
+    state_dir = tempfile.mkdtemp()
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_monitor(1, 'Front')
+        fake.add_monitor(2, 'Back')
+        fake.add_monitor(3, 'Off', function='None')
+        fake.fps = {'1': 10, '2': 10, '3': 10}
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'ZoneMinder': {'cache seconds': 'monitors.json: 0',
+                                         'OPT_USE_AUTH': 'false',
+                                         'PATH_ZMS': '/zm/cgi-bin/nph-zms'},
+                          'Health': {'window': '3', 'samples': '10', 'min fps': '2',
+                                     'probe snapshots': 'true', 'channel': 'ops'},
+                          'Monitor Back': {'min fps': '0.5'}})
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+        slack = Recorder()
+
+        monitor = HealthMonitor(config, slack, zone_minder=zoneminder)
+        for _ in range(3):
+            monitor.run_once()
+        assert_equal([], slack.posts)
+
+        # Front drops to 1 fps, Back stops answering but is allowed a low rate
+        fake.fps = {'1': 1, '2': 1}
+        fake.dead = {'2'}
+        for _ in range(2):
+            monitor.run_once()
+        assert_equal([], slack.posts)
+
+        slack.ok = False
+        monitor.run_once()
+        slack.ok = True
+        monitor.run_once()
+        monitor.run_once()
+        assert_equal([':warning: Monitor Back is degraded: 1.0 fps over the last 3 samples, '
+                      'and no snapshot could be fetched',
+                      ':warning: Monitor Front is degraded: 1.0 fps over the last 3 samples'],
+                     sorted(slack.posts))
+
+        # Both recover as soon as the average is back over the limit
+        fake.fps = {'1': 10, '2': 10}
+        fake.dead = set()
+        monitor.run_once()
+        monitor.run_once()
+        assert_equal(['Monitor Back has recovered: 4.0 fps',
+                      'Monitor Front has recovered: 4.0 fps'], sorted(slack.posts[2:]))
+        monitor.run_once()
+
+        # The table comes from memory
+        requests = sum(fake.requests.values())
+        rows = monitor.table()
+        assert_equal(['Back', 'Front'], [x['name'] for x in rows])
+        assert_equal(OK, rows[1]['state'])
+        assert_equal(10.0, rows[1]['fps'])
+        assert_equal(10, len(rows[1]['sparkline']))
+        assert rows[1]['latency'] >= 0
+        assert_equal(requests, sum(fake.requests.values()))
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
+
+
+def test_health_command():
+    class Slack(object):
+        def api_call(self, method, **kwargs):
+            return kwargs['text']
+
+    command = Health()
+    command.perform('me', ['health'], None)
+    assert 'not being watched' in command.report(Slack(), 'me', 'C1')
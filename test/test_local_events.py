@@ -0,0 +1,122 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import logging
+
+from nose.tools import assert_equal
+from zonebot.alerts import AlertPipeline
+from zonebot.zoneminder.local import load_local_event
+from zonebot.zoneminder.zoneminder import ZoneMinder
+from fake_zoneminder import FakeZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+
+def __make_event(root, alarmed, frames=6):
+    event_dir = os.path.join(root, '3', '16', '10', '01', '14', '05', '59')
+    os.makedirs(event_dir)
+
+    for frame in range(1, frames + 1):
+        with open(os.path.join(event_dir, '{0:05d}-capture.jpg'.format(frame)), 'wb') as f:
+            f.write(b'jpeg')
+        if frame in alarmed:
+            with open(os.path.join(event_dir, '{0:05d}-analyse.jpg'.format(frame)), 'wb') as f:
+                f.write(b'jpeg')
+
+    return event_dir
+
+
+def test_local_event():
+    root = tempfile.mkdtemp()
+    try:
+        event_dir = __make_event(root, [3, 4])
+        os.symlink('14/05/59', os.path.join(root, '3', '16', '10', '01', '.1234'))
+        os.symlink('3', os.path.join(root, 'Front Door'))
+
+        data = load_local_event(event_dir, '3')
+
+        assert data['local']
+        assert_equal('1234', data['event']['Event']['Id'])
+        assert_equal('Front Door', data['event']['Monitor']['Name'])
+        assert_equal(6, len(data['event']['Frame']))
+
+        parsed = ZoneMinder.parse_event(data, count=2, spacing=2)
+        assert_equal(['00003-capture.jpg'], [x['image_filename'] for x in parsed['key_frames']])
+        assert parsed['local']
+    finally:
+        shutil.rmtree(root)
+
+
+def test_local_event_marker_file():
+    root = tempfile.mkdtemp()
+    try:
+        event_dir = __make_event(root, [2])
+        open(os.path.join(event_dir, '.987'), 'w').close()
+
+        data = load_local_event(event_dir + '/', '3')
+
+        assert_equal('987', data['event']['Event']['Id'])
+        assert_equal(None, data['event']['Monitor']['Name'])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_local_event_incomplete():
+    root = tempfile.mkdtemp()
+    try:
+        # No event ID
+        event_dir = __make_event(root, [2])
+        assert_equal(None, load_local_event(event_dir, '3'))
+
+        # No directory at all
+        assert_equal(None, load_local_event(os.path.join(root, 'missing'), '3'))
+    finally:
+        shutil.rmtree(root)
+
+
+def test_local_alert_without_zoneminder():
+    fake = FakeZoneMinder().start()
+    root = tempfile.mkdtemp()
+    try:
+        event_dir = __make_event(root, [3])
+        os.symlink('14/05/59', os.path.join(root, '3', '16', '10', '01', '.1234'))
+        os.symlink('3', os.path.join(root, 'Front Door'))
+
+        config = fake.config()
+        config.read_dict({'Slack': {'api_token': 'token', 'channels': 'alerts'},
+                          'Alerts': {'local events': 'true'}})
+
+        calls = []
+
+        class Slack(object):
+            def api_call(self, method, **kwargs):
+                calls.append((method, kwargs['initial_comment']))
+                return {'ok': True, 'file': {'permalink': 'link'}}
+
+        assert AlertPipeline(config, slack=Slack()).send_event_dir(event_dir)
+
+        # Posted straight from disk, not a single request to ZoneMinder
+        assert_equal(0, sum(fake.requests.values()))
+        assert_equal('files.upload', calls[0][0])
+        assert 'Front Door' in calls[0][1]
+    finally:
+        fake.stop()
+        shutil.rmtree(root)
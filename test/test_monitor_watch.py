@@ -0,0 +1,98 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import logging
+import shutil
+import tempfile
+
+from fake_zoneminder import FakeZoneMinder
+from nose.tools import assert_equal
+from zonebot.monitor_watch import MonitorWatcher, describe_changes
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+
+class Recorder(object):
+    def __init__(self):
+        self.ok = True
+        self.posts = []
+
+    def api_call(self, method, **kwargs):
+        if not self.ok:
+            return {'ok': False, 'error': 'ratelimited'}
+        self.posts.append((kwargs['channel'], kwargs['text']))
+        return {'ok': True}
+
+
+def test_describe_changes():
+    old = {1: ('Front', 'Modect', True), 2: ('Back', 'Modect', True), 3: ('Shed', 'None', False)}
+    new = {1: ('Front', 'Record', False), 2: ('Yard', 'Modect', True), 4: ('Drive', 'Modect', True)}
+
+    assert_equal(['Monitor Front was disabled',
+                  'Monitor Front changed from Modect to Record',
+                  'Monitor Back (ID: 2) was renamed to Yard',
+                  'Monitor Shed (ID: 3) was removed',
+                  'Monitor Drive (ID: 4) was added, Modect and enabled'],
+                 describe_changes(old, new))
+    assert_equal([], describe_changes(new, dict(new)))
+
+
+def test_watcher():
+    state_dir = tempfile.mkdtemp()
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_monitor(1, 'Front')
+        fake.add_monitor(2, 'Back')
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'ZoneMinder': {'cache seconds': 'monitors.json: 0'},
+                          'Monitor Changes': {'channel': 'ops'}})
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+        slack = Recorder()
+
+        watcher = MonitorWatcher(config, slack, zone_minder=zoneminder)
+        watcher.run_once()
+        watcher.run_once()
+        assert_equal([], slack.posts)
+
+        # Only the changes are posted, once
+        fake.monitors[1]['Enabled'] = '0'
+        watcher.run_once()
+        watcher.run_once()
+        assert_equal([('ops', 'Monitor Back was disabled')], slack.posts)
+        assert_equal(4, fake.requests['/zm/api/monitors.json'])
+
+        # Changes that could not be posted are posted later, as are changes made
+        # while the bot was not running
+        slack.ok = False
+        fake.monitors[0]['Function'] = 'Record'
+        watcher.run_once()
+        slack.ok = True
+        fake.add_monitor(3, 'Shed', function='None', enabled='0')
+
+        watcher = MonitorWatcher(config, slack, zone_minder=zoneminder)
+        watcher.run_once()
+        assert_equal(('ops', 'Monitor Front changed from Modect to Record\n'
+                             'Monitor Shed (ID: 3) was added, None and disabled'),
+                     slack.posts[-1])
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
@@ -0,0 +1,157 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from nose.tools import assert_equal
+from zonebot.outbound import ALERT, BULK, REPLY, Dispatcher
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+class FakeApi(object):
+    """
+    Records the calls made, each taking `delay` seconds, until `release` is set.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.most_active = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def call(self, method, urgent, **kwargs):
+        self.release.wait()
+        with self._lock:
+            self.calls.append((kwargs['text'], urgent))
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return {'ok': True}
+
+
+def _send(client, text):
+    thread = threading.Thread(target=client.api_call, args=('chat.postMessage',),
+                              kwargs={'channel': 'C1', 'text': text})
+    thread.start()
+    return thread
+
+
+def test_priority():
+    api = FakeApi()
+    dispatcher = Dispatcher(api, workers=1, limits={ALERT: 1, REPLY: 1, BULK: 1})
+
+    # The first bulk message holds the only worker while the rest are queued
+    threads = [_send(dispatcher.client(BULK), 'bulk 1')]
+    time.sleep(0.1)
+    threads += [_send(dispatcher.client(BULK), 'bulk 2'),
+                _send(dispatcher.client(REPLY), 'reply'),
+                _send(dispatcher.client(ALERT), 'alert')]
+    time.sleep(0.1)
+
+    api.release.set()
+    for thread in threads:
+        thread.join()
+    dispatcher.stop()
+
+    assert_equal(['bulk 1', 'alert', 'reply', 'bulk 2'], [x[0] for x in api.calls])
+
+    # Only alerts skip the rate limit
+    assert_equal([('alert', True)], [x for x in api.calls if x[1]])
+
+    ages = dispatcher.queue_ages()
+    assert_equal(1, ages[ALERT]['count'])
+    assert_equal(2, ages[BULK]['count'])
+    assert ages[BULK]['max'] >= 0.1
+
+
+def test_class_limits():
+    api = FakeApi()
+    api.release.set()
+    dispatcher = Dispatcher(api, workers=3, limits={REPLY: 1, BULK: 2})
+
+    # A flood of bulk messages never has more than its share in progress, so an
+    # alert sent after them does not wait for them all
+    threads = [_send(dispatcher.client(BULK), 'bulk {0}'.format(x)) for x in range(10)]
+    time.sleep(0.02)
+    threads.append(_send(dispatcher.client(ALERT), 'alert'))
+    for thread in threads:
+        thread.join()
+    dispatcher.stop()
+
+    texts = [x[0] for x in api.calls]
+    assert texts.index('alert') < 4
+    assert api.most_active <= 3
+    assert_equal(0, dispatcher.pending())
+
+
+def test_stop_saves_unsent_calls():
+    state_dir = tempfile.mkdtemp()
+    try:
+        pending_path = os.path.join(state_dir, 'outbound.pending')
+
+        # Slack is stuck, so nothing goes before the deadline
+        api = FakeApi()
+        dispatcher = Dispatcher(api, workers=1, pending_path=pending_path)
+        results = []
+
+        def upload(priority):
+            results.append(dispatcher.api_call(priority, 'files.upload', text=priority,
+                                               file=BytesIO(b'jpeg')))
+
+        threads = [threading.Thread(target=upload, args=(x,)) for x in (REPLY, REPLY, ALERT)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+
+        start = time.time()
+        dispatcher.stop(timeout=0.2)
+        assert time.time() - start < 1
+        for thread in threads:
+            thread.join(1)
+
+        # The call in progress is left to finish, the callers of the queued ones are
+        # told they were not sent. The reply is saved, the alert is left to the alert
+        # code (spool, poller or watcher) to post again.
+        assert_equal([{'ok': False, 'error': 'shutting_down'}] * 2, results)
+        assert os.path.exists(pending_path)
+        api.release.set()
+
+        # And made when the next dispatcher starts
+        api = FakeApi()
+        api.release.set()
+        uploaded = []
+        api.call = lambda method, urgent, **kwargs: uploaded.append(
+            (method, kwargs['text'], kwargs['file'].read())) or {'ok': True}
+
+        dispatcher = Dispatcher(api, pending_path=pending_path)
+        dispatcher.stop()
+        assert_equal([('files.upload', REPLY, b'jpeg')], uploaded)
+        assert not os.path.exists(pending_path)
+    finally:
+        shutil.rmtree(state_dir)
@@ -0,0 +1,181 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+from zonebot.alerts import AlertPipeline
+from zonebot.poller import EventPoller
+from zonebot.zoneminder.zoneminder import ZoneMinder
+from fake_zoneminder import FakeZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+INDEX = '/zm/api/events/index/Id >:{0}.json'
+
+
+def __poller(fake, state_dir, handled):
+    config = fake.config()
+    config.read_dict({'Runtime': {'state dir': state_dir},
+                      'Poller': {'page size': '500'}})
+
+    zone_minder = ZoneMinder(config)
+    zone_minder.login()
+
+    return EventPoller(config, handler=lambda event: handled.append(int(event['Id'])) or True,
+                       zone_minder=zone_minder)
+
+
+def test_poller():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_events(3000)
+        handled = []
+
+        # The first run starts from the newest event, the old ones are not posted
+        poller = __poller(fake, state_dir, handled)
+        poller.run_once()
+        assert_equal([], handled)
+        assert_equal(3000, poller.last_id)
+
+        # A single cheap query when there is nothing new
+        poller.run_once()
+        assert_equal([], handled)
+        assert_equal(1, fake.requests[INDEX.format(3000)])
+
+        # Thousands of new events are fetched in bulk, in order, exactly once
+        fake.add_events(2500)
+        poller.run_once()
+        assert_equal(list(range(3001, 5501)), handled)
+        assert_equal(5, fake.requests[INDEX.format(3000)] - 1)
+
+        with open(os.path.join(state_dir, 'poller.state')) as handle:
+            assert_equal({'last_id': 5500, 'done': []}, json.load(handle))
+
+        # A restart picks up from where the last run stopped
+        fake.add_events(3)
+        handled = []
+        poller = __poller(fake, state_dir, handled)
+        poller.run_once()
+        assert_equal([5501, 5502, 5503], handled)
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
+
+
+def test_open_and_failed_events():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_events(10)
+        handled = []
+        poller = __poller(fake, state_dir, handled)
+        poller.run_once()
+
+        # Events still being recorded wait, later closed events do not
+        fake.add_events(1, closed=False)
+        fake.add_events(2)
+        poller.run_once()
+        assert_equal([12, 13], handled)
+        assert_equal(10, poller.last_id)
+
+        # Once closed it is sent, and nothing is sent twice (even after a restart)
+        poller = __poller(fake, state_dir, handled)
+        poller.run_once()
+        assert_equal([12, 13], handled)
+
+        fake.close_event(11, 50)
+        poller.run_once()
+        assert_equal([12, 13, 11], handled)
+        assert_equal(13, poller.last_id)
+
+        # A failure (ZoneMinder or Slack down) is tried again on the next run
+        failures = [IOError('down')]
+
+        def flaky(event):
+            if failures:
+                raise failures.pop()
+            handled.append(int(event['Id']))
+            return True
+
+        poller.handler = flaky
+        fake.add_events(2)
+        poller.run_once()
+        assert_equal([12, 13, 11], handled)
+        assert_equal(13, poller.last_id)
+
+        poller.run_once()
+        assert_equal([12, 13, 11, 14, 15], handled)
+        assert_equal(15, poller.last_id)
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
+
+
+class FlakySlack(object):
+    """
+    Refuses the first `failures` calls, as Slack does when it is unavailable.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.posted = []
+
+    def api_call(self, method, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            return {'ok': False, 'error': 'service_unavailable'}
+
+        self.posted.append(kwargs.get('text') or kwargs.get('initial_comment'))
+        return {'ok': True, 'file': {'permalink': 'https://files/1'}}
+
+
+def test_slack_failure_is_retried():
+    fake = FakeZoneMinder().start()
+    state_dir = tempfile.mkdtemp()
+
+    try:
+        fake.add_monitor('1', 'Front')
+        fake.add_events(10)
+        poller = __poller(fake, state_dir, [])
+        poller.run_once()
+
+        # The real pipeline, posting to a Slack that is down for the first try
+        slack = FlakySlack(1)
+        pipeline = AlertPipeline(poller.zone_minder.config, zone_minder=poller.zone_minder,
+                                 slack=slack)
+        poller.handler = pipeline.send_event_summary
+
+        fake.add_events(1)
+        poller.run_once()
+        assert_equal([], slack.posted)
+        assert_equal(10, poller.last_id)
+
+        poller.run_once()
+        assert_equal(1, len(slack.posted))
+        assert_equal(11, poller.last_id)
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
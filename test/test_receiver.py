@@ -0,0 +1,162 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import http.client
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from nose.tools import assert_equal
+from zonebot.receiver import EventReceiver, signature
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+SECRET = '8f742231b10e8888abcd99yyyzzz85a5'
+
+
+class Receiver(object):
+    """
+    Runs a receiver on a free port, collecting the events it is sent.
+    """
+
+    def __init__(self, handler=None, pending_path=None):
+        self.events = []
+        self.receiver = EventReceiver(SECRET, handler or self.events.append,
+                                      address='127.0.0.1', port=0, workers=1,
+                                      pending_path=pending_path)
+        self.thread = threading.Thread(target=self.receiver.serve_forever)
+
+    def __enter__(self):
+        self.thread.start()
+        self.receiver.ready.wait()
+        return self
+
+    def __exit__(self, *args):
+        self.receiver.stop()
+        self.thread.join()
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.receiver.port)
+
+
+def _post(connection, payload, secret=SECRET, timestamp=None):
+    body = json.dumps(payload).encode('utf-8')
+    timestamp = str(int(timestamp or time.time()))
+
+    connection.request('POST', '/slack/events', body=body, headers={
+        'Content-Type': 'application/json',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': signature(secret, timestamp, body)})
+
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def _event(index):
+    return {'type': 'event_callback', 'event_id': 'Ev{0}'.format(index),
+            'event': {'type': 'app_mention', 'user': 'U1', 'channel': 'C1',
+                      'text': '<@UBOT> status {0}'.format(index)}}
+
+
+def test_signature():
+    # The example from Slack's documentation
+    body = b'token=xyzz0WbapA4vBCDEFasx0q6G&team_id=T1DC2JH3J&team_domain=testteamnow&' \
+           b'channel_id=G8PSS9T3V&channel_name=foobar&user_id=U2CERLKJA&user_name=roadrunner&' \
+           b'command=%2Fwebhook-collect&text=&response_url=https%3A%2F%2Fhooks.slack.com%2F' \
+           b'commands%2FT1DC2JH3J%2F397700885554%2F96rGlfmibIGlgcZRskXaIFfN&' \
+           b'trigger_id=398738663015.47445629121.803a0bc887a14d10d2c447fce8b6703c'
+
+    assert_equal('v0=a2114d57b48eac39b9ad189dd8316235a7b4a8d21a10bd27519666489c69b503',
+                 signature(SECRET, '1531420618', body))
+
+
+def test_events():
+    with Receiver() as receiver:
+        connection = receiver.connect()
+
+        assert_equal((200, b'{"challenge": "abc"}'),
+                     _post(connection, {'type': 'url_verification', 'challenge': 'abc'}))
+
+        # Bad signatures and old requests are refused
+        assert_equal(401, _post(connection, _event(1), secret='wrong')[0])
+        assert_equal(401, _post(connection, _event(1), timestamp=time.time() - 600)[0])
+
+        # A retry of an event already queued is acknowledged but not queued again
+        assert_equal(200, _post(connection, _event(1))[0])
+        assert_equal(200, _post(connection, _event(1))[0])
+
+    assert_equal(['<@UBOT> status 1'], [x['text'] for x in receiver.events])
+
+
+def test_load():
+    count = 4000
+    threads = 8
+
+    with Receiver() as receiver:
+        def send(first):
+            connection = receiver.connect()
+            for index in range(first, count, threads):
+                assert_equal(200, _post(connection, _event(index))[0])
+
+        senders = [threading.Thread(target=send, args=(x,)) for x in range(threads)]
+        start = time.time()
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        duration = time.time() - start
+
+    # Every event was acknowledged and handled. The rate depends on the machine, so
+    # it is only reported (run with -s to see it).
+    assert_equal(count, len(receiver.events))
+    print('Received {0} events in {1:.2f} seconds, {2:.0f} a second'.format(
+        count, duration, count / duration))
+
+
+def test_stop_saves_unhandled_events():
+    state_dir = tempfile.mkdtemp()
+    try:
+        pending_path = os.path.join(state_dir, 'receiver.pending')
+        release = threading.Event()
+
+        # The only worker is stuck on the first event
+        with Receiver(handler=lambda event: release.wait(), pending_path=pending_path) as first:
+            connection = first.connect()
+            for index in range(3):
+                assert_equal(200, _post(connection, _event(index))[0])
+            first.receiver.stop(timeout=0.2)
+        release.set()
+
+        with open(pending_path) as handle:
+            assert_equal(2, len(json.load(handle)))
+
+        # The next receiver handles the events the last one did not get to
+        with Receiver(pending_path=pending_path) as second:
+            deadline = time.time() + 5
+            while len(second.events) < 2 and time.time() < deadline:
+                time.sleep(0.05)
+
+        assert_equal(['<@UBOT> status 1', '<@UBOT> status 2'],
+                     [x['text'] for x in second.events])
+        assert not os.path.exists(pending_path)
+    finally:
+        shutil.rmtree(state_dir)
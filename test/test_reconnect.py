@@ -0,0 +1,119 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import logging
+import shutil
+import tempfile
+
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from slackclient._server import SlackConnectionError, SlackLoginError
+from zonebot.counters import read_counters
+from zonebot.reconnect import FATAL, RETRYABLE, UNEXPECTED, Backoff, Reconnector, classify
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+def test_classify():
+    assert_equal(RETRYABLE, classify(ConnectionResetError()))
+    assert_equal(RETRYABLE, classify(TimeoutError()))
+    assert_equal(RETRYABLE, classify(SlackConnectionError()))
+    assert_equal(FATAL, classify(SlackLoginError()))
+    assert_equal(UNEXPECTED, classify(KeyError('channel')))
+
+
+def test_backoff():
+    backoff = Backoff(base=1, cap=10, immediate=2, rand=lambda: 1.0)
+
+    # Immediately, then doubling up to the cap
+    assert_equal([0, 0, 1, 2, 4, 8, 10, 10], [backoff.delay() for _ in range(8)])
+
+    backoff.reset()
+    assert_equal(0, backoff.delay())
+
+    # With jitter the wait is anywhere up to the limit
+    backoff = Backoff(base=1, cap=10, immediate=0)
+    delays = [backoff.delay() for _ in range(200)]
+    assert all(0 <= x <= 10 for x in delays)
+    assert len(set(delays)) > 100
+
+
+def test_reconnector():
+    state_dir = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Slack': {'max unexpected errors': '2'}})
+
+        sleeps = []
+        now = [0]
+        reconnector = Reconnector(config, sleep=sleeps.append, rand=lambda: 0.5,
+                                  clock=lambda: now[0])
+
+        # A blip is retried at once, then with backoff
+        assert reconnector.failed(ConnectionResetError())
+        assert reconnector.failed(TimeoutError())
+        assert reconnector.failed(SlackConnectionError())
+        assert_equal([0.5, 1.0], sleeps)
+
+        reconnector.connected()
+        assert_equal(1, len(reconnector.recoveries))
+        counters = read_counters(config)
+        assert_equal(1, counters['slack reconnects'])
+        assert 'slack reconnect ms' in counters
+
+        # Odd errors are retried, but not forever
+        now[0] += 60
+        assert reconnector.failed(KeyError('a'))
+        assert reconnector.failed(KeyError('b'))
+        assert not reconnector.failed(KeyError('c'))
+
+        # A refused token is not retried at all
+        reconnector.connected()
+        now[0] += 60
+        assert not reconnector.failed(SlackLoginError())
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def test_flapping():
+    state_dir = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Slack': {'reconnect max seconds': '100',
+                                    'reconnect stable seconds': '30'}})
+
+        sleeps = []
+        now = [0]
+        reconnector = Reconnector(config, sleep=sleeps.append, rand=lambda: 1.0,
+                                  clock=lambda: now[0])
+
+        # Connections dropped at once keep backing off
+        for _ in range(5):
+            assert reconnector.failed(ConnectionResetError())
+            reconnector.connected()
+            now[0] += 1
+        assert_equal([1, 2, 4, 8], sleeps)
+
+        # One that stayed up starts again with an immediate retry
+        now[0] += 30
+        assert reconnector.failed(ConnectionResetError())
+        assert_equal([1, 2, 4, 8], sleeps)
+    finally:
+        shutil.rmtree(state_dir)
@@ -0,0 +1,104 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import logging
+import shutil
+import tempfile
+import time
+
+import zonebot.sampler
+from fake_zoneminder import FakeZoneMinder
+from nose.tools import assert_equal
+from zonebot.commands import Status
+from zonebot.sampler import StatusSampler
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+logging.getLogger("zoneminder").disabled = True
+
+
+def test_sampler():
+    state_dir = tempfile.mkdtemp()
+    fake = FakeZoneMinder().start()
+    try:
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Status': {'samples': '4', 'disk usage': 'true'}})
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+
+        sampler = StatusSampler(config, zone_minder=zoneminder)
+        for load in [1, 5, 2, 3, 4]:
+            fake.load = [load, 0, 0]
+            sampler.run_once()
+        fake.daemon = 0
+        sampler.run_once()
+
+        # Only the last four samples are kept
+        summary = sampler.summary(3600)
+        assert_equal((2, 3.25, 4), (summary['load']['min'], summary['load']['mean'],
+                                   summary['load']['max']))
+        assert_equal(0.75, summary['running']['mean'])
+        assert_equal(12.5, summary['disk']['max'])
+        assert_equal(None, sampler.summary(3600, now=time.time() + 7200)['load'])
+
+        # The samples survive a restart
+        restarted = StatusSampler(config, zone_minder=zoneminder)
+        assert_equal([2, 3, 4, 4], list(restarted.summary(3600)['load']['values']))
+
+        # A different size starts again
+        config.set('Status', 'samples', '10')
+        assert_equal(None, StatusSampler(config, zone_minder=zoneminder).summary(3600)['load'])
+    finally:
+        fake.stop()
+        shutil.rmtree(state_dir)
+
+
+def test_status_from_samples():
+    state_dir = tempfile.mkdtemp()
+    fake = FakeZoneMinder().start()
+    try:
+        config = fake.config()
+        config.read_dict({'Runtime': {'state dir': state_dir}})
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+
+        sampler = StatusSampler(config, zone_minder=zoneminder)
+        for load in [0.5, 1.5]:
+            fake.load = [load, 0.4, 0.3]
+            sampler.run_once()
+        zonebot.sampler._current = sampler
+
+        class Slack(object):
+            def api_call(self, method, **kwargs):
+                return kwargs['text']
+
+        requests = sum(fake.requests.values())
+        command = Status(config=config)
+        command.perform('me', ['status'], zoneminder)
+        text = command.report(Slack(), 'me', 'C1')
+
+        assert_equal(requests, sum(fake.requests.values()))
+        assert '• _Load average_: 1.5/0.4/0.3\n' in text
+        assert u'• _Load, last hour_: ▃█ min 0.50, avg 1.00, max 1.50\n' in text
+        assert '• _Daemon running, last day_: 100% of the time\n' in text
+        assert 'Event disk use' not in text
+    finally:
+        zonebot.sampler._current = None
+        fake.stop()
+        shutil.rmtree(state_dir)
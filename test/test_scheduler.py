@@ -0,0 +1,154 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+
+import datetime
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import zonebot.scheduler
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from zonebot.commands import ListSchedules, ScheduleCommand, Unschedule
+from zonebot.scheduler import Schedule, Scheduler, parse_days
+from zonebot.tasks import BackgroundTask
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+class Slack(object):
+    def api_call(self, method, **kwargs):
+        return kwargs['text']
+
+
+def test_parse_days():
+    assert_equal([0, 1, 2, 3, 4, 5, 6], parse_days([]))
+    assert_equal([0, 1, 2, 3, 4], parse_days(['Weekdays']))
+    assert_equal([0, 5, 6], parse_days(['weekends', 'mon']))
+    assert_equal([1, 3], parse_days(['tuesday', 'thu']))
+    assert_equal(None, parse_days(['month']))
+
+
+def test_next_run():
+    schedule = Schedule(1, 'me', 'C1', 'enable monitor all', 8, 0, [0, 1, 2, 3, 4])
+
+    # Friday morning, then Friday after eight
+    friday = datetime.datetime(2016, 10, 7, 7, 30)
+    assert_equal(datetime.datetime(2016, 10, 7, 8, 0), schedule.next_run(friday))
+    assert_equal(datetime.datetime(2016, 10, 10, 8, 0),
+                 schedule.next_run(friday.replace(hour=8)))
+
+
+def test_scheduler():
+    state_dir = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir}})
+
+        ran = []
+        scheduler = Scheduler(config, lambda *args: ran.append(args))
+        first = scheduler.add('me', 'C1', 'disable monitor kitchen', 8, 0, [0, 1, 2, 3, 4])
+        second = scheduler.add('you', 'C2', 'enable monitor kitchen', 18, 30, [5, 6])
+        assert_equal([1, 2], [x.id for x in scheduler.list()])
+
+        # Nothing is due yet, the task sleeps until the first one is (at most 15 minutes)
+        scheduler.run_once()
+        assert_equal([], ran)
+        assert 0 <= scheduler.interval <= 15 * 60
+
+        # Make both due now, the removed one does not run
+        scheduler._heap = [(time.time() - 1, 0, first), (time.time() - 1, 1, second)]
+        scheduler.remove(second.id)
+        scheduler.run_once()
+        assert_equal([('me', 'disable monitor kitchen', 'C1')], ran)
+
+        # Run again at the next due time only
+        assert_equal(1, len(scheduler._heap))
+        assert scheduler._heap[0][0] > time.time()
+
+        # Schedules survive a restart
+        restarted = Scheduler(config, None)
+        assert_equal(['1: _disable monitor kitchen_ at 08:00 weekdays, for me'],
+                     [x.describe() for x in restarted.list()])
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def test_schedule_commands():
+    state_dir = tempfile.mkdtemp()
+    try:
+        config = ConfigParser()
+        config.read_dict({'Runtime': {'state dir': state_dir},
+                          'Permissions': {'boss': 'any'}})
+        zonebot.scheduler._current = Scheduler(config, None)
+
+        command = ScheduleCommand(config=config)
+        command.perform('boss', ['schedule', 'disable', 'monitor', 'kitchen', 'at', '08', '00',
+                                 'weekdays'], None)
+        assert_equal('Scheduled 1: _disable monitor kitchen_ at 08:00 weekdays, for boss',
+                     command.report(Slack(), 'boss', 'C1'))
+
+        # Permissions are checked when scheduling as well as when running
+        command = ScheduleCommand(config=config)
+        command.perform('guest', ['schedule', 'enable', 'monitor', 'all', 'at', '8'], None)
+        assert_equal('*Error*: you are not allowed to run _enable monitor all_',
+                     command.report(Slack(), 'guest', 'C1'))
+
+        for words in [['schedule', 'status'], ['schedule', 'status', 'at', '25', '00'],
+                      ['schedule', 'status', 'at', '08', '00', 'someday']]:
+            command = ScheduleCommand(config=config)
+            command.perform('boss', words, None)
+            assert command.report(Slack(), 'boss', 'C1').startswith('*Error*: expected')
+
+        command = ListSchedules(config=config)
+        command.perform('guest', ['schedules'], None)
+        assert_equal('• 1: _disable monitor kitchen_ at 08:00 weekdays, for boss\n',
+                     command.report(Slack(), 'guest', 'C1'))
+
+        command = Unschedule(config=config)
+        command.perform('boss', ['unschedule', '1'], None)
+        assert command.report(Slack(), 'boss', 'C1').startswith('Removed 1')
+        assert_equal([], zonebot.scheduler.current().list())
+    finally:
+        zonebot.scheduler._current = None
+        shutil.rmtree(state_dir)
+
+
+def test_wake():
+    class Counter(BackgroundTask):
+        def __init__(self):
+            super(Counter, self).__init__('counter', 60)
+            self.runs = threading.Semaphore(0)
+
+        def run_once(self):
+            self.runs.release()
+
+    task = Counter()
+    task.start()
+    try:
+        assert task.runs.acquire(timeout=5)
+
+        # Runs again straight away, not after the interval
+        task.wake()
+        assert task.runs.acquire(timeout=5)
+    finally:
+        task.stop()
+        task.join(5)
+    assert not task.is_alive()
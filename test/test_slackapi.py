@@ -0,0 +1,108 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import threading
+import time
+from io import BytesIO
+
+from nose.tools import assert_equal
+from zonebot.slackapi import SlackApi, TokenBucket
+from fake_slack import FakeSlack
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+def test_token_bucket():
+    bucket = TokenBucket(20, 2)
+
+    # The burst is free, after that 20 a second
+    start = time.monotonic()
+    for _ in range(12):
+        bucket.take()
+    assert 0.45 < time.monotonic() - start < 0.7
+
+
+def test_api_call():
+    fake = FakeSlack().start()
+    try:
+        api = SlackApi('token', url=fake.url)
+
+        result = api.api_call('chat.postMessage', channel='C1', text='Hello',
+                              attachments=[{'text': 'x'}], as_user=True)
+        assert result['ok']
+
+        result = api.api_call('files.upload', channels='C1', filename='a.jpeg',
+                              file=BytesIO(b'jpeg'))
+        assert result['ok']
+
+        assert_equal(['chat.postMessage', 'files.upload'], fake.methods())
+        assert_equal({'token': 'token', 'channel': 'C1', 'text': 'Hello',
+                      'attachments': '[{"text": "x"}]', 'as_user': 'true'}, fake.calls[0][1])
+
+        # One kept alive connection for both calls
+        assert_equal(1, fake.connections)
+    finally:
+        fake.stop()
+
+
+def test_rate_limited():
+    fake = FakeSlack(limit=5, period=1.0, retry_after=1).start()
+    try:
+        api = SlackApi('token', url=fake.url)
+        results = []
+
+        # More calls, from more threads, than the server accepts in a second
+        def call(index):
+            results.append(api.api_call('users.info', user='U{0}'.format(index)))
+
+        threads = [threading.Thread(target=call, args=(x,)) for x in range(12)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every call is queued until it goes through, none fail
+        assert_equal(12, len([x for x in results if x['ok']]))
+        assert_equal(12, len(fake.calls))
+        assert fake.limited['users.info'] > 0
+        assert time.time() - start >= 1
+    finally:
+        fake.stop()
+
+
+def test_errors():
+    fake = FakeSlack().start()
+    try:
+        api = SlackApi('token', url=fake.url, timeout=0.5)
+
+        # Slack's error pages are not JSON
+        fake.outage = (503, b'<html><body>Service Unavailable</body></html>')
+        assert_equal({'ok': False, 'error': 'http_503'},
+                     api.api_call('chat.postMessage', channel='C1', text='Hello'))
+
+        # A stalled connection does not hold the caller for ever
+        fake.outage = None
+        fake.stall = 5
+        start = time.time()
+        result = api.api_call('chat.postMessage', channel='C1', text='Hello')
+        assert_equal('request_failed', result['error'])
+        assert time.time() - start < 4
+    finally:
+        fake.stall = 0
+        fake.stop()
@@ -0,0 +1,59 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+from nose.tools import assert_equal
+from zonebot.timeseries import RingBuffer, sparkline
+
+
+def test_sparkline_empty():
+    assert_equal(u'', sparkline([]))
+
+
+def test_sparkline_levels():
+    assert_equal(u'▁▂▃▄▅▆▇█', sparkline([0, 1, 2, 3, 4, 5, 6, 7]))
+
+
+def test_sparkline_flat():
+    assert_equal(u'▁▁▁', sparkline([5, 5, 5]))
+
+
+def test_sparkline_floor():
+    assert_equal(u'████', sparkline([5, 5, 5, 5], floor=0))
+
+
+def test_sparkline_keeps_peaks():
+    values = [0] * 1000
+    values[501] = 10
+
+    line = sparkline(values, width=10)
+
+    assert_equal(10, len(line))
+    assert_equal(u'▁▁▁▁▁█▁▁▁▁', line)
+
+
+def test_ring_buffer():
+    ring = RingBuffer(4)
+    assert_equal([], list(ring.values()))
+
+    for value in range(1, 7):
+        ring.append(value)
+
+    assert_equal(4, len(ring))
+    assert_equal([3, 4, 5, 6], list(ring.values()))
+    assert_equal([5, 6], list(ring.values(2)))
+    assert_equal(16, len(ring.data.tobytes()))
@@ -0,0 +1,150 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import SkipTest
+
+from configparser import ConfigParser
+from nose.tools import assert_equal
+from zonebot.alerts import parse_directory_name
+from zonebot.watcher import EventWatcher
+
+logging.basicConfig(level=logging.CRITICAL)
+logging.getLogger("zonebot").disabled = True
+
+
+class Recorder(object):
+    def __init__(self):
+        self.events = {}
+        self.done = threading.Event()
+
+    def __call__(self, event_dir):
+        self.events[event_dir] = time.time()
+        self.done.set()
+        return True
+
+
+def __start_watcher(root, handler, idle=5.0, threshold=0):
+    if not sys.platform.startswith('linux'):
+        raise SkipTest("inotify is only available on Linux")
+
+    config = ConfigParser()
+    config.add_section('Runtime')
+    config.set('Runtime', 'state dir', os.path.join(root, 'state'))
+    config.add_section('Watcher')
+    config.set('Watcher', 'events dir', root)
+    config.set('Watcher', 'idle seconds', str(idle))
+    config.set('Watcher', 'frame threshold', str(threshold))
+
+    watcher = EventWatcher(config, handler=handler)
+    watcher.start()
+    assert watcher.ready.wait(5)
+
+    return watcher
+
+
+def __write_frames(event_dir, first, last):
+    for frame in range(first, last + 1):
+        with open(os.path.join(event_dir, '{0:05d}-capture.jpg'.format(frame)), 'wb') as f:
+            f.write(b'jpeg')
+
+
+def test_watcher_frame_threshold():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, '3', '16', '10', '01', '14', '05', '00'))
+
+    recorder = Recorder()
+    watcher = __start_watcher(root, recorder, idle=30, threshold=5)
+
+    try:
+        event_dir = os.path.join(root, '3', '16', '10', '01', '14', '05', '59')
+
+        # Not enough frames yet, and far from idle, so not sent
+        os.makedirs(event_dir)
+        __write_frames(event_dir, 1, 4)
+        assert not recorder.done.wait(1), "Event was sent before the frame threshold"
+
+        # The frame that reaches the threshold sends the event, long before the idle
+        # timeout would have
+        __write_frames(event_dir, 5, 5)
+        assert recorder.done.wait(10), "Event was not sent at the frame threshold"
+        assert_equal([event_dir], list(recorder.events))
+    finally:
+        watcher.stop()
+        watcher.join()
+        shutil.rmtree(root)
+
+
+def test_watcher_idle_close_and_new_day():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, '3', '16', '10', '01', '14', '05', '00'))
+
+    recorder = Recorder()
+    watcher = __start_watcher(root, recorder, idle=0.3)
+
+    try:
+        # The whole path for a new day is created at once
+        event_dir = os.path.join(root, '3', '16', '10', '02', '00', '00', '01')
+        os.makedirs(event_dir)
+        __write_frames(event_dir, 1, 3)
+        time.sleep(0.1)
+        __write_frames(event_dir, 4, 6)
+
+        assert recorder.done.wait(5), "Event was not detected"
+        assert_equal([event_dir], list(recorder.events))
+        assert_equal(('3', '2016-10-02 00:00:01'), parse_directory_name(event_dir))
+
+        # The previous day is no longer watched
+        assert os.path.join(root, '3', '16', '10', '01') not in watcher._paths
+    finally:
+        watcher.stop()
+        watcher.join()
+        shutil.rmtree(root)
+
+
+def test_watcher_resumes_open_events():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, '3', '16', '10', '01', '14', '05', '00'))
+
+    try:
+        # Stopped while an event is still open
+        recorder = Recorder()
+        watcher = __start_watcher(root, recorder, idle=5)
+        event_dir = os.path.join(root, '3', '16', '10', '01', '14', '05', '30')
+        os.makedirs(event_dir)
+        __write_frames(event_dir, 1, 3)
+        time.sleep(0.2)
+        watcher.stop()
+        watcher.join()
+        assert_equal({}, recorder.events)
+
+        # The next watcher picks it up
+        recorder = Recorder()
+        watcher = __start_watcher(root, recorder, idle=0.3)
+        try:
+            assert recorder.done.wait(5), "Event was not resumed"
+            assert_equal([event_dir], list(recorder.events))
+        finally:
+            watcher.stop()
+            watcher.join()
+    finally:
+        shutil.rmtree(root)
@@ -18,8 +18,12 @@ import os
 from nose.tools import assert_equal
 import zonebot
 from zonebot.bot import ZoneBot
+from zonebot.counters import read_counters
 import logging
 import json
+import shutil
+import tempfile
+import threading
 
 from configparser import ConfigParser
 
@@ -80,6 +84,193 @@ def test_command_detection():
     assert not channel
 
 
+def test_no_threads_before_start():
+    before = threading.active_count()
+
+    # Nothing may start a thread until the bot has become a daemon (forked), as
+    # threads do not survive a fork
+    ZoneBot(__load_config())
+    assert_equal(before, threading.active_count())
+
+
+def test_command_errors_keep_connection():
+    zb = ZoneBot(__load_config())
+
+    class Server(object):
+        def rtm_connect(self):
+            pass
+
+        def ping(self):
+            pass
+
+    class Client(object):
+        server = Server()
+        reads = 0
+
+        def rtm_read(self):
+            self.reads += 1
+            if self.reads > 2:
+                zb._stopping.set()
+            return [{'type': 'message', 'channel': 'C1', 'user': 'U1',
+                     'text': '<@BOT> list monitors'}]
+
+    handled = []
+
+    def handle_command(user, command, channel):
+        handled.append(command)
+        raise IOError('ZoneMinder is down')
+
+    zb.slack_client = Client()
+    zb.at_bot = '<@BOT>'
+    zb.handle_command = handle_command
+    zb._stopping.wait = lambda timeout=None: zb._stopping.is_set()
+
+    # Each failed command is logged, and the bot goes on reading
+    zb._ZoneBot__polling_loop(lambda: None)
+    assert_equal(3, len(handled))
+
+
+def test_pipelined_commands():
+    config = __load_config()
+    config.remove_section('Permissions')
+    zb = ZoneBot(config)
+
+    class Recorder(object):
+        def __init__(self):
+            self.texts = []
+
+        def client(self, priority):
+            return self
+
+        def api_call(self, method, **kwargs):
+            self.texts.append(kwargs['text'])
+            return {'ok': True}
+
+    barrier = threading.Barrier(2, timeout=5)
+    performed = []
+
+    class Wait(zonebot.commands.Command):
+        def perform(self, user_name, commands, zoneminder):
+            # Only passes if both commands run at the same time
+            barrier.wait()
+            performed.append(commands[1])
+
+        def report(self, slack, user, channel):
+            return slack.api_call('chat.postMessage', channel=channel, text=self.text)
+
+        @property
+        def text(self):
+            return 'waited'
+
+    class Write(Wait):
+        def perform(self, user_name, commands, zoneminder):
+            performed.append('write')
+
+        @property
+        def text(self):
+            return 'wrote'
+
+    zb.outbound = Recorder()
+    zb.zoneminder = None
+    zonebot.commands._all_commands['wait'] = {'permission': 'read', 'classname': Wait,
+                                              'help': '', 'index': 99}
+    zonebot.commands._all_commands['write'] = {'permission': 'write', 'classname': Write,
+                                               'help': '', 'index': 99}
+    try:
+        zb.run_command(None, 'wait 1; wait 2\nwrite;about;;', 'C1')
+    finally:
+        del zonebot.commands._all_commands['wait']
+        del zonebot.commands._all_commands['write']
+
+    # The reads ran together, before the write, and the replies are in order
+    assert_equal(['1', '2'], sorted(performed[:2]))
+    assert_equal('write', performed[2])
+    assert_equal(['waited', 'waited', 'wrote'], zb.outbound.texts[:3])
+    assert zb.outbound.texts[3].startswith('*ZoneBot* version')
+
+    # A failing command is reported, and the others still run
+    zb.outbound.texts = []
+    zb.run_command(None, 'list monitors; about', 'C1')
+    assert zb.outbound.texts[0].startswith('*Error*: _list monitors_ failed')
+    assert zb.outbound.texts[1].startswith('*ZoneBot* version')
+
+
+def test_progressive_replies():
+    config = __load_config()
+    config.remove_section('Permissions')
+    state_dir = tempfile.mkdtemp()
+    config.set('Runtime', 'state dir', state_dir)
+    zb = ZoneBot(config)
+
+    class Recorder(object):
+        def __init__(self):
+            self.calls = []
+
+        def client(self, priority):
+            return self
+
+        def api_call(self, method, **kwargs):
+            self.calls.append((method, kwargs.get('ts'), kwargs.get('text')))
+            return {'ok': True, 'ts': '1.{0}'.format(len(self.calls))}
+
+    started = threading.Event()
+    release = threading.Event()
+
+    class Slow(zonebot.commands.Command):
+        placeholder = 'working'
+        upload = False
+
+        def perform(self, user_name, commands, zoneminder):
+            self.report_progress('half way')
+            started.set()
+            release.wait(5)
+
+        def report(self, slack, user, channel):
+            if Slow.upload:
+                return slack.api_call('files.upload', channels=channel)
+            return slack.api_call('chat.postMessage', channel=channel, text='done')
+
+    zb.outbound = Recorder()
+    zb.zoneminder = None
+    zonebot.commands._all_commands['slow'] = {'permission': 'read', 'classname': Slow,
+                                              'help': '', 'index': 99}
+    try:
+        # The placeholder is posted, updated with progress, then replaced by the reply
+        release.set()
+        zb.run_command('me', 'slow', 'C1')
+        assert_equal([('chat.postMessage', None, 'working'),
+                      ('chat.update', '1.1', 'half way'),
+                      ('chat.update', '1.1', 'done')], zb.outbound.calls)
+
+        # A reply that is not a message leaves the placeholder to be removed
+        zb.outbound.calls = []
+        Slow.upload = True
+        zb.run_command('me', 'slow', 'C1')
+        assert_equal(['chat.postMessage', 'chat.update', 'files.upload', 'chat.delete'],
+                     [x[0] for x in zb.outbound.calls])
+
+        # Sending the command again while it runs does nothing
+        zb.outbound.calls = []
+        Slow.upload = False
+        release.clear()
+        started.clear()
+        first = threading.Thread(target=zb.run_command, args=('me', 'slow', 'C1'))
+        first.start()
+        started.wait(5)
+        zb.run_command('me', 'Slow', 'C1')
+        release.set()
+        first.join(5)
+        assert_equal(1, len([x for x in zb.outbound.calls if x[2] == 'working']))
+        assert_equal({'duplicate commands dropped': 1}, read_counters(config))
+
+        # Once it is done, it can be run again
+        zb.run_command('me', 'slow', 'C1')
+        assert_equal(2, len([x for x in zb.outbound.calls if x[2] == 'working']))
+    finally:
+        del zonebot.commands._all_commands['slow']
+        shutil.rmtree(state_dir)
+
+
 def __load_config():
     example_config = os.path.join(os.path.dirname(__file__),
                                   "..",
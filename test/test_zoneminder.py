@@ -18,10 +18,14 @@ import os
 from nose.tools import assert_equal
 import zonebot
 from zonebot.zoneminder.zoneminder import ZoneMinder
+from zonebot.zoneminder.frames import score_statistics
 import logging
 import json
+import threading
+import time
 
 from configparser import ConfigParser
+from fake_zoneminder import FakeZoneMinder
 
 logging.basicConfig(level=logging.CRITICAL)
 logging.getLogger("zoneminder").disabled = True
@@ -32,6 +36,93 @@ def test_create():
     zoneminder = ZoneMinder(config)
 
 
+def __frame(frame_number, score):
+    return {'Id': str(1000 + frame_number),
+            'FrameId': str(frame_number),
+            'Delta': '{0:.2f}'.format((frame_number - 1) * 0.5),
+            'Score': str(score)}
+
+
+def __event(scores):
+    return {
+        'event': {
+            'Monitor': {'Name': 'Front'},
+            'Event': {'Name': 'Event-1', 'Cause': 'Motion', 'Length': '10.00', 'Id': '1'},
+            'Frame': [__frame(index + 1, score) for index, score in enumerate(scores)]
+        }
+    }
+
+
+def test_parse_event_single_frame():
+    data = ZoneMinder.parse_event(__event([0, 5, 20, 7, 20, 0]))
+
+    assert_equal('Front', data['source'])
+    assert_equal('1003', data['key_frame'])
+    assert_equal('00003-capture.jpg', data['image_filename'])
+    assert_equal(1, len(data['key_frames']))
+
+
+def test_parse_event_no_score():
+    data = ZoneMinder.parse_event(__event([0, 0, 0]))
+
+    assert_equal(None, data['key_frame'])
+    assert 'image_filename' not in data
+    assert_equal([], data['key_frames'])
+
+
+def test_parse_event_top_frames():
+    data = ZoneMinder.parse_event(__event([1, 9, 2, 8, 3, 7]), count=3)
+
+    assert_equal('1002', data['key_frame'])
+    assert_equal(['2', '4', '6'], [x['frame_id'] for x in data['key_frames']])
+    assert_equal([9, 8, 7], [x['score'] for x in data['key_frames']])
+
+
+def test_parse_event_frame_spacing():
+    # A spike around frame 3, and a smaller peak at frame 9
+    data = ZoneMinder.parse_event(__event([0, 50, 60, 55, 40, 0, 0, 10, 30, 5]),
+                                  count=3,
+                                  spacing=3)
+
+    assert_equal('3', data['key_frames'][0]['frame_id'])
+    assert_equal(['3', '9'], [x['frame_id'] for x in data['key_frames']])
+
+
+def test_parse_event_statistics():
+    # 10 frames at 2 fps, event is 5 seconds long
+    data = ZoneMinder.parse_event(__event([0, 10, 30, 40, 0, 0, 20, 0, 0, 0]), threshold=15)
+    statistics = data['statistics']
+
+    assert_equal(40, statistics['peak'])
+    assert_equal(25.0, statistics['mean'])
+    assert_equal(1.5, statistics['above'])
+    assert_equal(10, len(statistics['scores']))
+
+
+def test_statistics_large_event():
+    frames = [__frame(index + 1, (index * 7) % 101) for index in range(20000)]
+
+    start = time.time()
+    statistics = score_statistics(frames, threshold=50, length=10000)
+    duration = time.time() - start
+
+    assert_equal(100, statistics['peak'])
+    assert duration < 0.5, "Statistics took {0} seconds".format(duration)
+
+
+def test_monitor_option():
+    config = __load_config()
+
+    config.set('Alerts', 'key frames', '2')
+    config.add_section('Monitor FRONT door')
+    config.set('Monitor FRONT door', 'key frames', '4')
+
+    assert_equal(4, zonebot.get_monitor_option(config, 'Front Door', 'key frames', getter='getint'))
+    assert_equal(2, zonebot.get_monitor_option(config, 'Back', 'key frames', getter='getint'))
+    assert_equal(2, zonebot.get_monitor_option(config, None, 'key frames', getter='getint'))
+    assert_equal('x', zonebot.get_monitor_option(config, 'Back', 'not set', fallback='x'))
+
+
 def __load_config():
     example_config = os.path.join(os.path.dirname(__file__),
                                   "..",
@@ -44,3 +135,136 @@ def __load_config():
     zonebot.validate_config(config)
 
     return config
+
+
+def test_concurrent_login():
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_events(5)
+        zoneminder = ZoneMinder(fake.config())
+        zoneminder.login()
+
+        def load(event_id):
+            zoneminder.get_event(event_id)
+
+        # Every thread finds the session expired, only one logs in again
+        for attempt in range(2):
+            zoneminder.session.last_login = 0
+            threads = [threading.Thread(target=load, args=(x,)) for x in range(1, 6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert_equal(attempt + 1, fake.requests['/zm/'])
+    finally:
+        fake.stop()
+
+
+def test_monitor_indexes():
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_monitor(1, 'Front', function='Modect')
+        fake.add_monitor(2, 'Back', function='Record', enabled='0')
+        fake.add_monitor(3, 'Garage', function='Modect', enabled='0')
+        zoneminder = ZoneMinder(fake.config())
+        zoneminder.login()
+
+        monitors = zoneminder.get_monitors()
+        monitors.load()
+
+        front = monitors.get('FRONT')
+        assert_equal((1, 'Front', 'Modect', True),
+                     (front.id, front.name, front.function, front.enabled))
+        assert_equal('Back', monitors.get_by_id('2').name)
+        assert_equal(None, monitors.get_by_id(4))
+        assert_equal(1, monitors.get_value('front', 'Id'))
+        assert not monitors.is_enabled('back')
+
+        assert_equal(['Front', 'Garage'], [x.name for x in monitors.select(function='modect')])
+        assert_equal(['Back', 'Garage'], [x.name for x in monitors.select(enabled=False)])
+        assert_equal(['Garage'], [x.name for x in monitors.select('Modect', False)])
+        assert_equal(3, len(monitors.select()))
+    finally:
+        fake.stop()
+
+
+def test_set_states():
+    fake = FakeZoneMinder().start()
+    try:
+        for monitor_id, name in enumerate(['Front', 'Back', 'Garage', 'Drive'], 1):
+            fake.add_monitor(monitor_id, name, enabled='0' if monitor_id < 4 else '1')
+        zoneminder = ZoneMinder(fake.config())
+        zoneminder.login()
+
+        monitors = zoneminder.get_monitors()
+        results = monitors.set_states(['front', 'BACK', 'drive', 'attic'], True)
+
+        assert_equal({'front': 'changed to enabled', 'back': 'changed to enabled',
+                      'drive': 'already enabled', 'attic': 'not found'}, results)
+        assert not monitors.is_enabled('garage')
+
+        # The list is loaded once before and once after, however many are changed
+        assert_equal(2, fake.requests['/zm/api/monitors.json'])
+        assert_equal(1, fake.requests['/zm/api/monitors/1.json'])
+        assert_equal(0, fake.requests['/zm/api/monitors/4.json'])
+
+        results = monitors.set_states(None, False)
+        assert_equal(4, len(results))
+        assert_equal([], monitors.select(enabled=True))
+
+        assert_equal('changed to enabled', monitors.set_state('Garage', True))
+    finally:
+        fake.stop()
+
+
+def test_session_cache():
+    fake = FakeZoneMinder().start()
+    try:
+        fake.add_monitor(1, 'Front')
+        zoneminder = ZoneMinder(fake.config())
+        zoneminder.login()
+
+        # Within the time to live nothing is asked for again, or parsed again
+        monitors = zoneminder.get_monitors()
+        monitors.load()
+        monitors.load()
+        assert_equal(1, fake.requests['/zm/api/monitors.json'])
+
+        url = fake.url + '/api/host/getVersion.json'
+        response = zoneminder.session.get(url)
+        assert_equal('1.30.0', response.json()['version'])
+        assert response.json() is zoneminder.session.get(url).json()
+        assert_equal(1, fake.requests['/zm/api/host/getVersion.json'])
+
+        # A change made by the bot empties the cache
+        monitors.set_state('front', False)
+        assert not monitors.is_enabled('front')
+        assert_equal(2, fake.requests['/zm/api/monitors.json'])
+    finally:
+        fake.stop()
+
+
+def test_session_revalidation():
+    fake = FakeZoneMinder().start()
+    try:
+        fake.etags = True
+        fake.add_monitor(1, 'Front')
+        config = fake.config()
+        config.set('ZoneMinder', 'cache seconds', 'monitors.json: 0')
+        zoneminder = ZoneMinder(config)
+        zoneminder.login()
+
+        url = fake.url + '/api/monitors.json'
+        first = zoneminder.session.get(url)
+        data = first.json()
+
+        # Asked again each time, but not downloaded or parsed if it did not change
+        assert zoneminder.session.get(url).json() is data
+        assert_equal(2, fake.requests['/zm/api/monitors.json'])
+
+        fake.add_monitor(2, 'Back')
+        assert_equal(2, len(zoneminder.session.get(url).json()['monitors']))
+        assert_equal(3, fake.requests['/zm/api/monitors.json'])
+    finally:
+        fake.stop()
@@ -161,6 +161,66 @@ def find_config(command_line_value=None):
     raise ValueError("No config file was provided and none could be located.")
 
 
+def state_path(config, name):
+    """
+    The full path of a file the bot uses to keep state between runs (or between
+    separate zonebot-alert processes). Files are kept in the ``state dir`` of the
+    ``[Runtime]`` section, which defaults to ``$XDG_DATA_HOME/zonebot`` (normally
+    ``~/.local/share/zonebot``). The directory is created if needed.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param name: The name of the state file
+    :type name: str
+    :return: The full path of the state file
+    :rtype: str
+    """
+
+    data_home = os.environ.get('XDG_DATA_HOME',
+                               os.path.join(os.path.expanduser("~"), '.local', 'share'))
+    directory = os.path.expanduser(
+        config.get('Runtime', 'state dir', fallback=os.path.join(data_home, 'zonebot')))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o0755)
+
+    return os.path.join(directory, name)
+
+
+def get_monitor_option(config, monitor_name, option, fallback=None, getter='get'):
+    """
+    Gets an option that can be set for each monitor. A ``[Monitor <name>]`` section
+    (the name is not case sensitive) takes precedence over the ``[Alerts]`` section,
+    which holds the defaults for every monitor.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param monitor_name: Name (not ID) of the monitor, may be `None`
+    :type monitor_name: str
+    :param option: The name of the option to look up
+    :type option: str
+    :param fallback: Value returned when the option is not set anywhere
+    :param getter: Name of the `ConfigParser` method used to read (and convert) the value,
+                   one of 'get', 'getint', 'getfloat' or 'getboolean'
+    :type getter: str
+    :return: The value of the option
+    """
+
+    sections = []
+
+    if monitor_name:
+        wanted = 'monitor ' + monitor_name.lower()
+        sections.extend([x for x in config.sections() if x.lower() == wanted])
+
+    sections.append('Alerts')
+
+    for section in sections:
+        if config.has_option(section, option):
+            return getattr(config, getter)(section, option)
+
+    return fallback
+
+
 def validate_config(config):
     """
     Make sure all the items necessary are available in the config object.
@@ -193,6 +253,11 @@ def validate_config(config):
                     LOGGER.error("Required option %s missing from section [%s]", option, section)
                     result = False
 
+    if config.getboolean('Receiver', 'enabled', fallback=False) and \
+            not config.has_option('Receiver', 'signing secret'):
+        LOGGER.error("The Slack Events API receiver needs the app's signing secret")
+        result = False
+
     if result:
         while config['ZoneMinder']['url'].endswith("/"):
             # We need the URL in a consistent format as some of the API calls
@@ -0,0 +1,697 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Posts ZoneMinder events to Slack. This is shared by the `zonebot-alert` script (one
+process per event) and the bot itself (when it watches for events).
+"""
+
+import logging
+import os
+import threading
+
+import zonebot
+import zonebot.counters
+import zonebot.filters
+import zonebot.images
+import zonebot.timeseries
+from zonebot.coalesce import EventSpool, get_monitor_group
+from zonebot.dedupe import FrameHistory
+from zonebot.slackapi import SlackApi
+from zonebot.zoneminder.local import load_local_event
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+LOGGER = logging.getLogger("zonebot")
+
+
+def parse_directory_name(dirname):
+    """
+    Extracts the monitor ID and event start time from the path of an event directory.
+
+    :param dirname: The directory in which the event files are stored
+    :type dirname: str
+    :return: monitor ID, timestamp ('yyyy-mm-dd hh:mm:ss')
+    :rtype: str, str
+    """
+
+    elements = zonebot.split_os_path(dirname)
+
+    # Array will contain a variable number of leading elements
+    # but always ends with:
+    #   monitor/yy/mm/d/hh/mm/ss
+    # we split that to
+    #   monitor id
+    # and
+    #   yyyy-mm-dd hh:mm:ss
+
+    idx = -7
+    if elements[-1] == '':
+        # Just in case the path ends with a '/'
+        idx = -8
+
+    monitor = elements[idx]
+    timestamp = "20" + elements[idx + 1] + "-" + elements[idx + 2] + "-" + elements[idx + 3] + \
+                " " + \
+                elements[idx + 4] + ":" + elements[idx + 5] + ":" + elements[idx + 6]
+
+    return monitor, timestamp
+
+
+class AlertPipeline(object):
+    """
+    Finds the key frame(s) of an event and posts them to Slack.
+    """
+
+    def __init__(self, config, zone_minder=None, slack=None, background=False):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param zone_minder: ZoneMinder connection to use, one is created when first
+                            needed if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        :param slack: Slack client to use, one is created if not provided
+        :param background: Whether events held back by a `coalesce window` are posted
+                           from a background thread. Set this when running in the bot,
+                           where the caller goes on to handle more events.
+        :type background: bool
+        """
+
+        self.config = config
+        self.background = background
+
+        self._zone_minder = zone_minder
+        self._zone_minder_lock = threading.Lock()
+
+        self.slack = slack or SlackApi.from_config(config)
+
+    @property
+    def zone_minder(self):
+        """
+        The ZoneMinder connection, only created when first needed so that events read
+        from disk are posted without waiting on ZoneMinder at all.
+
+        :rtype: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        with self._zone_minder_lock:
+            if not self._zone_minder:
+                zone_minder = ZoneMinder(self.config)
+                zone_minder.login()
+                self._zone_minder = zone_minder
+
+        return self._zone_minder
+
+    def send_event_dir(self, event_dir):
+        """
+        Posts the event stored in a directory to Slack.
+
+        :param event_dir: The directory in which the event files are stored
+        :type event_dir: str
+        :return: `True` if the event was posted
+        :rtype: bool
+        """
+
+        (monitor, timestamp) = parse_directory_name(event_dir)
+        LOGGER.info("Sending alert about event at %s on monitor %s", timestamp, monitor)
+
+        data = self.load_event(event_dir, monitor, timestamp)
+        if not data:
+            # Filtered out
+            return True
+
+        return self.send_event(data, event_dir)
+
+    def send_event_id(self, event_id):
+        """
+        Posts an event to Slack, using only the ZoneMinder API. This works when the bot
+        is not running on the ZoneMinder host.
+
+        :param event_id: The ID of the event
+        :type event_id: str
+        :return: `True` if the event was posted
+        :rtype: bool
+        """
+
+        LOGGER.info("Sending alert about event %s", event_id)
+
+        data = self.zone_minder.get_event(event_id)
+        return self.send_event(data, None)
+
+    def send_event_summary(self, event):
+        """
+        Posts an event to Slack, using only the ZoneMinder API, unless the filter rules
+        can already tell from the event summary that it should not be posted.
+
+        :param event: The `Event` dictionary, as from :meth:`ZoneMinder.iter_events`
+        :type event: dict
+        :return: `True` if the event was posted (or filtered out)
+        :rtype: bool
+        """
+
+        if self._filtered_summary(event):
+            return True
+
+        return self.send_event_id(event['Id'])
+
+    def load_event(self, event_dir, monitor, timestamp):
+        """
+        Loads an event, from the event directory if `local events` is set and the
+        directory has everything needed, and from the ZoneMinder API otherwise.
+
+        :param event_dir: The directory in which the event files are stored
+        :type event_dir: str
+        :param monitor: ID of the monitor that created the event
+        :type monitor: str
+        :param timestamp: The timestamp ('yyyy-mm-dd hh:mm:ss') at which the event started
+        :type timestamp: str
+        :return: The event data, as from :meth:`ZoneMinder.load_event`, or `None` if the
+                 filter rules found the event should not be posted
+        :rtype: dict
+        """
+
+        data = None
+        if self.config.getboolean('Alerts', 'local events', fallback=False):
+            # Running on the ZoneMinder host, everything needed is (hopefully) on disk
+            data = load_local_event(event_dir, monitor)
+
+            if data and not data['event']['Monitor']['Name']:
+                monitors = self.zone_minder.get_monitors()
+                monitors.load()
+                data['event']['Monitor']['Name'] = _find_monitor_name(monitors, monitor)
+
+            if not data or not data['event']['Monitor']['Name']:
+                LOGGER.info("Event directory %s is incomplete, using the ZoneMinder API",
+                            event_dir)
+                data = None
+
+        if data:
+            data['event']['Event'].setdefault('StartTime', timestamp)
+            return data
+
+        event = self.zone_minder.find_event(monitor, timestamp)
+        if self._filtered_summary(event):
+            return None
+
+        return self.zone_minder.get_event(event['Id'])
+
+    def send_event(self, data, event_dir):
+        """
+        Posts a loaded event to Slack. If a `coalesce window` is set for the monitor,
+        the event is held back, and posted with any other events of the monitor's group
+        that arrive within the window, as one message.
+
+        :param data: The event data, as from :meth:`ZoneMinder.load_event`
+        :type data: dict
+        :param event_dir: The directory in which the event files are stored, or `None`
+                          to download the images from ZoneMinder
+        :type event_dir: str
+        :return: `True` if the event was posted (or held back to be posted)
+        :rtype: bool
+        """
+
+        config = self.config
+
+        name = data['event']['Monitor']['Name']
+        start_time = data['event']['Event'].get('StartTime')
+        data = self.parse_event(data)
+
+        if self._filtered(name,
+                          data['id'],
+                          score=None if data['local'] or not data['statistics']
+                          else data['statistics']['peak'],
+                          length=data['duration'],
+                          cause=data['cause'],
+                          start_time=start_time):
+            return True
+
+        event = self.prepare_event(data, event_dir)
+        if not event:
+            return False
+
+        if not event['images'] and 'skip' == zonebot.get_monitor_option(
+                config, name, 'duplicate frames', fallback='fold'):
+            LOGGER.info("Not posting event %s, it looks the same as a recent alert",
+                        event['id'])
+            return True
+
+        name = event['monitor']
+        window = zonebot.get_monitor_option(config, name, 'coalesce window', fallback=0,
+                                            getter='getfloat')
+        if window > 0:
+            max_delay = zonebot.get_monitor_option(config, name, 'coalesce max delay',
+                                                   fallback=30, getter='getfloat')
+            spool = EventSpool.for_group(config, get_monitor_group(config, name),
+                                         window, max_delay)
+            spool.submit(event, self.post_events, background=self.background)
+            return True
+
+        return self.post_events([event])
+
+    def parse_event(self, data):
+        """
+        Parses a loaded event with the key frame settings of its monitor.
+
+        :param data: The event data, as from :meth:`ZoneMinder.load_event`
+        :type data: dict
+        :return: The parsed event, as from :meth:`ZoneMinder.parse_event`
+        :rtype: dict
+        """
+
+        config = self.config
+        name = data['event']['Monitor']['Name']
+
+        return ZoneMinder.parse_event(
+            data,
+            count=zonebot.get_monitor_option(config, name, 'key frames', fallback=1,
+                                             getter='getint'),
+            spacing=zonebot.get_monitor_option(config, name, 'key frame spacing', fallback=0,
+                                               getter='getint'),
+            threshold=zonebot.get_monitor_option(config, name, 'score threshold', fallback=0,
+                                                 getter='getint'))
+
+    def prepare_event(self, data, event_dir):
+        """
+        Finds the key frame(s) of a parsed event and writes the message to post with them.
+
+        :param data: The parsed event, as from :meth:`parse_event`
+        :type data: dict
+        :param event_dir: The directory in which the event files are stored, or `None`
+                          to download the images from ZoneMinder
+        :type event_dir: str
+        :return: The event id, monitor name, message (comment) and images, or `None` if
+                 there is nothing to post
+        :rtype: dict
+        """
+
+        config = self.config
+
+        name = data['source']
+        threshold = zonebot.get_monitor_option(config, name, 'score threshold', fallback=0,
+                                               getter='getint')
+
+        if not data['key_frames']:
+            LOGGER.error("Could not determine which still frame to upload")
+            return None
+
+        images = []
+        for frame in data['key_frames']:
+            if not event_dir:
+                image, error_text = self.zone_minder.get_event_image(data['id'],
+                                                                     frame['frame_id'])
+                if image:
+                    images.append(image)
+                else:
+                    LOGGER.error("Could not download frame %s of event %s: %s",
+                                 frame['frame_id'], data['id'], error_text)
+                continue
+
+            image_filename = os.path.join(event_dir, frame['image_filename'])
+            if os.path.isfile(image_filename):
+                images.append(image_filename)
+            else:
+                LOGGER.error("Expect image still file %s could not be read", image_filename)
+
+        if not images:
+            return None
+
+        comment = 'Detected {0} on monitor {1}. {2}/index.php?view=event&eid={3}'.format(
+            data['cause'] or 'activity',
+            data['source'],
+            config['ZoneMinder']['url'],
+            data['id']
+        )
+
+        images, hashes = self._drop_duplicates(name, data['id'], images)
+        if not images:
+            comment += ' _(looks the same as a recent alert)_'
+
+        # Scores are not available for events read from disk
+        show_statistics = zonebot.get_monitor_option(config, name, 'score statistics',
+                                                     fallback=True, getter='getboolean')
+        if data['statistics'] and not data['local'] and show_statistics:
+            comment += '\n' + _format_statistics(data['statistics'], threshold)
+
+        return {
+            'id': data['id'],
+            'monitor': name,
+            'comment': comment,
+            'images': images,
+            'hashes': hashes
+        }
+
+    def _drop_duplicates(self, name, event_id, images):
+        """
+        Drops the frames that look the same as a frame recently posted for the monitor
+        (when `duplicate distance` is set).
+
+        :return: The frames still to post, and their hashes to add to the monitor's
+                 history once they have been posted
+        :rtype: tuple
+        """
+
+        config = self.config
+
+        distance = zonebot.get_monitor_option(config, name, 'duplicate distance', fallback=0,
+                                              getter='getint')
+        if distance <= 0:
+            return images, []
+
+        hashes = [zonebot.images.difference_hash(x) for x in images]
+        if None in hashes:
+            return images, []
+
+        duplicates = self._frame_history(name).check(
+            hashes, distance, zonebot.get_monitor_option(config, name, 'duplicate seconds',
+                                                         fallback=3600, getter='getfloat'))
+
+        if any(duplicates):
+            count = zonebot.counters.increment(config, 'duplicate frames', sum(duplicates))
+            LOGGER.info("Dropped %d of %d frames of event %s that look the same as recent "
+                        "alerts (%d duplicate frames so far)", sum(duplicates), len(images),
+                        event_id, count)
+
+        kept = [x for x in zip(images, hashes, duplicates) if not x[2]]
+        return [x[0] for x in kept], [int(x[1]) for x in kept]
+
+    def _frame_history(self, name):
+        """
+        :param name: Name of the monitor
+        :type name: str
+        :return: The recently posted frames of a monitor
+        :rtype: FrameHistory
+        """
+
+        return FrameHistory.for_monitor(
+            self.config, name, zonebot.get_monitor_option(self.config, name,
+                                                          'duplicate history', fallback=16,
+                                                          getter='getint'))
+
+    def _filtered_summary(self, event):
+        """
+        Checks the filter rules against an event summary (an `Event` dictionary without
+        frames), before any more of the event is loaded.
+
+        :return: `True` if the event should not be posted
+        :rtype: bool
+        """
+
+        if not zonebot.filters.filtering_enabled(self.config):
+            # Not worth finding the monitor name for
+            return False
+
+        monitors = self.zone_minder.get_monitors()
+        if not monitors.monitors:
+            monitors.load()
+
+        return self._filtered(_find_monitor_name(monitors, event['MonitorId']),
+                              event['Id'],
+                              score=event.get('MaxScore'),
+                              length=event.get('Length'),
+                              cause=event.get('Cause'),
+                              start_time=event.get('StartTime'))
+
+    def _filtered(self, name, event_id, **summary):
+        """
+        Checks the filter rules of a monitor against an event, and counts the events
+        that are filtered out.
+
+        :return: `True` if the event should not be posted
+        :rtype: bool
+        """
+
+        reason = zonebot.filters.suppression_reason(self.config, name, **summary)
+        if not reason:
+            return False
+
+        count = zonebot.counters.increment(self.config, 'events filtered')
+        LOGGER.info("Not posting event %s on monitor %s, %s (%d events filtered so far)",
+                    event_id, name, reason, count)
+
+        return True
+
+    def post_events(self, events):
+        """
+        Posts one or more prepared events to Slack. Events are posted as a single
+        message, with the key frames of every event, to each set of channels the
+        monitors are routed to. A monitor's frames (and details) only go to its own
+        channels, so events of monitors with different routes are posted separately.
+
+        :param events: The events, as from :meth:`prepare_event`, oldest first
+        :type events: list[dict]
+        :return: `True` if the events were posted
+        :rtype: bool
+        """
+
+        routes = []
+        for event in events:
+            channels = self._channels(event['monitor'])
+            for route in routes:
+                if route[0] == channels:
+                    route[1].append(event)
+                    break
+            else:
+                routes.append((channels, [event]))
+
+        posted = True
+        for channels, routed in routes:
+            if self._post_message(routed, ','.join(channels)):
+                # Only frames that were actually posted count as seen
+                for event in routed:
+                    if event.get('hashes'):
+                        self._frame_history(event['monitor']).record(event['hashes'])
+            else:
+                posted = False
+
+        return posted
+
+    def _channels(self, name):
+        """
+        :param name: Name of the monitor
+        :type name: str
+        :return: The channels the monitor's alerts go to
+        :rtype: list[str]
+        """
+
+        channels = zonebot.get_monitor_option(self.config, name, 'channels',
+                                              fallback=self.config['Slack']['channels'])
+        return [x.strip() for x in channels.split(',') if x.strip()]
+
+    def _post_message(self, events, channels):
+        """
+        Posts events as one message. Each image is uploaded once, and shared to all of
+        the channels.
+
+        :param events: The events, as from :meth:`prepare_event`, oldest first
+        :type events: list[dict]
+        :param channels: The channels to post to, comma separated
+        :type channels: str
+        :return: `True` if the events were posted
+        :rtype: bool
+        """
+
+        config = self.config
+        name = events[0]['monitor']
+
+        if len(events) == 1:
+            comment = events[0]['comment']
+            filename = '{0}_Event_{1}.jpeg'.format(name, events[0]['id'])
+        else:
+            monitors = []
+            for event in events:
+                if event['monitor'] not in monitors:
+                    monitors.append(event['monitor'])
+
+            comment = '{0} events on {1}\n{2}'.format(len(events),
+                                                      ', '.join(monitors),
+                                                      '\n'.join(x['comment'] for x in events))
+            filename = '{0}_Events_{1}-{2}.jpeg'.format(get_monitor_group(config, name),
+                                                        events[0]['id'],
+                                                        events[-1]['id'])
+            LOGGER.info("Merged %d events (%s) on %s into one message", len(events),
+                        ', '.join(str(x['id']) for x in events), ', '.join(monitors))
+
+        images = [image for event in events for image in event['images']]
+
+        # And off it goes ...
+        result = _upload_frames(self.slack,
+                                channels,
+                                comment,
+                                filename,
+                                images,
+                                zonebot.get_monitor_option(config, name, 'multiple frames',
+                                                           fallback='collage'))
+
+        if not result:
+            LOGGER.error("Could not complete Slack API call")
+            return False
+
+        if not result['ok']:
+            error = "Error: "
+            if 'error' in result:
+                error = result['error']
+            elif 'warning' in result:
+                error = result['warning']
+
+            LOGGER.error("Could not upload image: %s", error)
+            return False
+
+        LOGGER.info('Image posted to %s as %s', channels, _permalink(result))
+        return True
+
+
+def _upload_frames(slack, channels, comment, filename, images, style):
+    """
+    Uploads the key frame(s) of an event to Slack. Each image is uploaded only once,
+    however many channels it goes to. A single frame is uploaded as is.
+    Multiple frames are either joined into one collage image (style 'collage') or
+    uploaded individually, shared to the channels, and then linked from a single
+    message (style 'message').
+    A collage falls back to a message if the collage can not be created. With no
+    images at all, only the message is posted.
+
+    :param slack: A fully configured :class:`zonebot.slackapi.SlackApi` instance
+    :param channels: The channel(s) to post to, comma separated
+    :type channels: str
+    :param comment: The text to post with the image(s)
+    :type comment: str
+    :param filename: The name to give the uploaded image
+    :type filename: str
+    :param images: The images to upload (file names or file-like objects), in the order
+                   they were captured
+    :type images: list
+    :param style: How to send multiple images, 'collage' or 'message'
+    :type style: str
+    :return: The result of the last Slack API call made
+    """
+
+    collage = None
+    if len(images) > 1 and 'collage' == style:
+        collage = zonebot.images.make_collage(images)
+
+    if collage or len(images) == 1:
+        image = collage or _open_image(images[0])
+        try:
+            return slack.api_call('files.upload',
+                                  initial_comment=comment,
+                                  filename=filename,
+                                  channels=channels,
+                                  # Note: this is broken in slackclient 1.0.1 and earlier
+                                  file=image)
+        finally:
+            image.close()
+
+    # Upload each image, then post a single message that links to them all. The
+    # images must be shared to the channels too: a file that is not shared is private
+    # to the bot, and its link would not work for anyone else.
+    links = []
+    base_name = os.path.splitext(filename)[0]
+    for index, image in enumerate(images):
+        image = _open_image(image)
+        try:
+            result = slack.api_call('files.upload',
+                                    filename='{0}_{1}.jpeg'.format(base_name, index + 1),
+                                    channels=channels,
+                                    file=image)
+        finally:
+            image.close()
+
+        if not result or not result['ok']:
+            return result
+
+        links.append(_permalink(result))
+
+    result = None
+    for channel in [x.strip() for x in channels.split(',') if x.strip()]:
+        result = slack.api_call('chat.postMessage',
+                                channel=channel,
+                                text='\n'.join([comment] + links),
+                                as_user=True)
+        if not result or not result['ok']:
+            return result
+
+    return result
+
+
+def _open_image(image):
+    """
+    Opens an image for upload.
+
+    :param image: The name of an image file, or the image itself as a file-like object
+    :return: A file-like object
+    """
+
+    if isinstance(image, str):
+        return zonebot.images.map_image(image)
+
+    image.seek(0)
+    return image
+
+
+def _find_monitor_name(monitors, monitor_id):
+    """
+    Finds the name of a monitor from its ID.
+
+    :param monitors: The (loaded) monitors
+    :type monitors: zonebot.zoneminder.monitors.Monitors
+    :param monitor_id: ID of the monitor
+    :type monitor_id: str
+    :return: The name of the monitor or `None` if there is no monitor with that ID
+    :rtype: str
+    """
+
+    monitor = monitors.get_by_id(monitor_id)
+    return monitor.name if monitor else None
+
+
+def _format_statistics(statistics, threshold):
+    """
+    Formats the score statistics of an event for the alert message.
+
+    :param statistics: The statistics from :func:`zonebot.zoneminder.frames.score_statistics`
+    :type statistics: dict
+    :param threshold: The score threshold the statistics were calculated with
+    :type threshold: int
+    :return: A single line of text
+    :rtype: str
+    """
+
+    return u'`{0}` peak score {1}, mean {2:.1f}, {3:.1f}s above {4}'.format(
+        zonebot.timeseries.sparkline(statistics['scores'], floor=0),
+        statistics['peak'],
+        statistics['mean'],
+        statistics['above'],
+        threshold)
+
+
+def _permalink(result):
+    """
+    Extracts the link to an uploaded file from the result of a Slack API call.
+
+    :param result: The result object from Slack
+    :return: The link or 'unknown' if the result does not contain one
+    :rtype: str
+    """
+
+    uploaded = result.get('file', {})
+
+    if 'permalink_public' in uploaded:
+        return uploaded['permalink_public']
+    elif 'permalink' in uploaded:
+        return uploaded['permalink']
+
+    return 'unknown'
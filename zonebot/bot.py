@@ -22,18 +22,81 @@ The main BOT class.
 
 import logging
 import re
+import signal
+import threading
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pwd import getpwnam
 from grp import getgrnam
 
 from slackclient import SlackClient
+from zonebot.alerts import AlertPipeline
+from zonebot.coalesce import SpoolFlusher, coalescing_enabled
+from zonebot.outbound import ALERT, BULK, REPLY, Dispatcher
+from zonebot.reconnect import Reconnector
+from zonebot.slackapi import SlackApi
 from zonebot.zoneminder.zoneminder import ZoneMinder
 import zonebot.commands
+import zonebot.counters
 
 LOGGER = logging.getLogger("zonebot")
 
 
+class Placeholder(object):
+    """
+    A message posted as soon as a slow command is received. It is edited in place
+    as the command reports progress, and the command's reply replaces it. Commands
+    report through it as if it were the Slack client.
+    """
+
+    def __init__(self, slack, channel, text):
+        """
+        :param slack: The Slack client
+        :param channel: The channel the command came from
+        :type channel: str
+        :param text: What to show until there is more to say
+        :type text: str
+        """
+
+        self.slack = slack
+        self.channel = channel
+        self.ts = None
+
+        result = slack.api_call('chat.postMessage', channel=channel, text=text, as_user=True)
+        if result and result.get('ok') and 'ts' in result:
+            self.ts = result['ts']
+
+    def update(self, text):
+        """
+        :param text: The partial reply to show
+        :type text: str
+        """
+
+        if self.ts:
+            zonebot.commands.Command.log_slack_result(
+                self.slack.api_call('chat.update', channel=self.channel, ts=self.ts,
+                                    text=text, as_user=True))
+
+    def api_call(self, method, **kwargs):
+        # The reply, if it is a message to the same channel, replaces the placeholder
+        if self.ts and method == 'chat.postMessage' and kwargs.get('channel') == self.channel:
+            ts, self.ts = self.ts, None
+            return self.slack.api_call('chat.update', ts=ts, **kwargs)
+
+        return self.slack.api_call(method, **kwargs)
+
+    def finish(self):
+        """
+        Removes the placeholder, when the reply was not a message (an image, say).
+        """
+
+        if self.ts:
+            ts, self.ts = self.ts, None
+            zonebot.commands.Command.log_slack_result(
+                self.slack.api_call('chat.delete', channel=self.channel, ts=ts, as_user=True))
+
+
 class ZoneBot(object):
     """
     A smart bot that interacts with Slack via chat commands.
@@ -46,9 +109,37 @@ class ZoneBot(object):
         self.last_ping = 0
         self.slack_client = SlackClient(config['Slack']['api_token'])
 
+        # Web API calls (command replies, etc) go through our own, rate limit aware,
+        # client. The slackclient is only used for the RTM connection.
+        self.slack_api = SlackApi.from_config(config)
+
+        # Everything sent to Slack is queued by priority, so that alerts are never
+        # held up by replies to commands. Created when the bot starts, as its worker
+        # threads would not survive becoming a daemon (a fork).
+        self.outbound = None
+
         self.at_bot = "<@" + config['Slack']['bot_id'] + ">"
         self.bot_name = config['Slack']['bot_name'] or "zonebot"
 
+        # What read only commands found, shared by users with the same permissions
+        self.command_cache = None
+        if config.getboolean('Runtime', 'command cache', fallback=True):
+            self.command_cache = zonebot.commands.CommandCache(config)
+
+        # Commands being run, so that resends are dropped rather than run again
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+        # Background tasks, created when the bot starts
+        self.tasks = []
+
+        # Set when asked to stop (SIGTERM). Work in progress is finished, or saved,
+        # within `shutdown timeout` seconds of that.
+        self.shutdown_timeout = config.getfloat('Runtime', 'shutdown timeout', fallback=20)
+        self.receiver = None
+        self._stopping = threading.Event()
+        self._deadline = None
+
     def start(self):
         """
         If configured, converts to a daemon. Otherwise start connected to the current console.
@@ -91,41 +182,170 @@ class ZoneBot(object):
         Starts the bot by connecting to Slack.
         """
 
+        self.outbound = Dispatcher.from_config(self.config, self.slack_api)
+
         self.zoneminder = ZoneMinder(self.config)
         self.zoneminder.login()
 
-        while True:
-            try:
-                self.__polling_loop()
-            except KeyboardInterrupt:
-                return
-            except (TimeoutError, ConnectionResetError) as e:
-                LOGGER.warning("Connection to Slack lost, reconnecting: %s", str(e))
-                time.sleep(30)
-            except Exception as e:
-                LOGGER.exception("Unhandled exception, terminating process: %s", str(e))
+        signal.signal(signal.SIGTERM, self._terminate)
+
+        self.start_tasks()
+
+        try:
+            if self.config.getboolean('Receiver', 'enabled', fallback=False):
+                # Slack posts events to us, no connection to keep open
+                from zonebot.receiver import EventReceiver
+                self.receiver = EventReceiver.from_config(self.config, self.handle_event)
+                try:
+                    self.receiver.serve_forever()
+                except KeyboardInterrupt:
+                    pass
                 return
 
-    def __polling_loop(self):
-        """Polling loop, without re-connect logic"""
+            reconnector = Reconnector(self.config, sleep=self._stopping.wait)
+            while not self._stopping.is_set():
+                try:
+                    self.__polling_loop(reconnector.connected)
+                except KeyboardInterrupt:
+                    return
+                except Exception as e:
+                    if not reconnector.failed(e):
+                        LOGGER.error("Terminating process")
+                        return
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """
+        Stops taking new commands. Commands being run are finished and `start` returns
+        once the queued work has been done or saved. Can be called from any thread.
+        """
+
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.shutdown_timeout
+
+        self._stopping.set()
+        if self.receiver:
+            self.receiver.stop(self.shutdown_timeout)
+
+    def shutdown(self):
+        """
+        Stops the background tasks and sends the queued Slack messages, until the
+        shutdown timeout. Messages not sent by then are saved and sent on the next start.
+        """
+
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.shutdown_timeout
+
+        tasks = list(self.tasks)
+        self.stop_tasks(timeout=max(0, self._deadline - time.monotonic()))
+        self.outbound.stop(timeout=max(0, self._deadline - time.monotonic()))
+
+        # Tasks still waiting on Slack have now been answered, give them a moment to
+        # save what they did not finish
+        for task in tasks:
+            task.join(5)
+
+    def _terminate(self, signum, frame):
+        LOGGER.info("Received signal %d, shutting down", signum)
+        self.stop()
+
+    def start_tasks(self):
+        """
+        Creates and starts the configured background tasks.
+        """
+
+        pipeline = AlertPipeline(self.config, zone_minder=self.zoneminder,
+                                 slack=self.outbound.client(ALERT), background=True)
+
+        if self.config.getboolean('Watcher', 'enabled', fallback=False):
+            from zonebot.watcher import EventWatcher
+            self.tasks.append(EventWatcher(self.config, handler=pipeline.send_event_dir))
+
+        if self.config.getboolean('Poller', 'enabled', fallback=False):
+            from zonebot.poller import EventPoller
+            self.tasks.append(EventPoller(self.config, handler=pipeline.send_event_summary,
+                                          zone_minder=self.zoneminder))
+
+        if coalescing_enabled(self.config):
+            self.tasks.append(SpoolFlusher(self.config, pipeline.post_events))
+
+        if self.config.getboolean('Monitor Changes', 'enabled', fallback=False):
+            from zonebot.monitor_watch import MonitorWatcher
+            self.tasks.append(MonitorWatcher(self.config, self.outbound.client(BULK),
+                                             zone_minder=self.zoneminder))
+
+        if self.config.getboolean('Health', 'enabled', fallback=False):
+            from zonebot.health import HealthMonitor
+            self.tasks.append(HealthMonitor(self.config, self.outbound.client(ALERT),
+                                            zone_minder=self.zoneminder))
+
+        if self.config.getboolean('Status', 'enabled', fallback=False):
+            from zonebot.sampler import StatusSampler
+            self.tasks.append(StatusSampler(self.config, zone_minder=self.zoneminder))
+
+        if self.config.getboolean('Scheduler', 'enabled', fallback=True):
+            from zonebot.scheduler import Scheduler
+            self.tasks.append(Scheduler(self.config, self.run_command))
+
+        if self.config.getfloat('Events', 'refresh interval', fallback=0) > 0:
+            from zonebot.poller import EventIndexer
+            self.tasks.append(EventIndexer(self.config, zone_minder=self.zoneminder))
+
+        for task in self.tasks:
+            task.start()
+
+    def stop_tasks(self, timeout=None):
+        """
+        Stops all the background tasks and waits for them to finish.
+
+        :param timeout: The most seconds to wait, `None` to wait for as long as it takes
+        :type timeout: float
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        for task in self.tasks:
+            task.stop()
+
+        for task in self.tasks:
+            task.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if task.is_alive():
+                LOGGER.warning("Background task %s did not stop in time", task.name)
+
+        self.tasks = []
+
+    def __polling_loop(self, connected):
+        """
+        Polling loop, without re-connect logic
+
+        :param connected: Called once the connection has been made
+        """
 
         read_websocket_delay = 1  # 1 second delay between reading from firehose
 
         self.connect()
+        connected()
 
-        while True:
+        while not self._stopping.is_set():
             for reply in self.slack_client.rtm_read():
                 user, channel, command = self._extract_command(reply, self.at_bot)
                 if user and channel and command:
-                    self.handle_command(user, command, channel)
+                    # A command failing, say when ZoneMinder is down, must not drop
+                    # the connection to Slack
+                    try:
+                        self.handle_command(user, command, channel)
+                    except Exception as e:
+                        LOGGER.exception("Failed to handle command '%s': %s", command, str(e))
 
             self.autoping()
-            time.sleep(read_websocket_delay)
+            self._stopping.wait(read_websocket_delay)
 
     def connect(self):
         """Convenience method that creates Server instance"""
 
-        self.slack_client.rtm_connect()
+        # Not SlackClient.rtm_connect, which hides the reason a connection failed
+        self.slack_client.server.rtm_connect()
 
     def autoping(self):
         """Pings the remote system to keep the connection alive"""
@@ -167,6 +387,18 @@ class ZoneBot(object):
         # No match ...
         return None, None, None
 
+    def handle_event(self, event):
+        """
+        Acts on a message from the Slack Events API, if it is a command for the bot.
+
+        :param event: The `event` of an Events API callback
+        :type event: dict
+        """
+
+        user, channel, command = self._extract_command(event, self.at_bot)
+        if user and channel and command:
+            self.handle_command(user, command, channel)
+
     def handle_command(self, user, command_string, channel):
         """
         Receives commands directed at the bot and determines if they
@@ -181,29 +413,136 @@ class ZoneBot(object):
         :type channel: str
         """
 
-        user_name = zonebot.commands.Command.resolve_user(user, self.slack_client)
+        user_name = zonebot.commands.Command.resolve_user(user, self.slack_api)
 
         LOGGER.info("Received command '%s' in channel %s from %s",
                     command_string,
                     channel,
                     user_name if user_name else user)
 
-        if not command_string:
-            words = ['help']
-        else:
-            words = re.split(r'\W+', command_string)
+        self.run_command(user_name, command_string, channel)
+
+    def run_command(self, user_name, command_string, channel):
+        """
+        Runs a command, with the permissions of the named user, and replies to the
+        channel. Scheduled commands are run this way.
+
+        Several commands can be sent at once, separated by ';' or new lines. Read
+        only commands next to each other are run at the same time, up to
+        `pipeline workers` of them. Commands that change something are run on their
+        own, in the order given. The replies are posted in the order of the commands.
+
+        :param user_name: Name (not ID) of the user the command is run for
+        :type user_name: str
+        :param command_string: The command(s)
+        :type command_string: str
+        :param channel: The channel the reply goes to
+        :type channel: str
+        """
 
-        # Remove any blank or empty entries
-        words = [x for x in words if x]
+        commands = []
+        for part in re.split(r'[;\n]', command_string or ''):
+            # Remove any blank or empty entries
+            words = [x for x in re.split(r'\W+', part) if x]
+            if words:
+                commands.append(words)
+
+        if not commands:
+            commands = [['help']]
+
+        # The same commands, from the same user, are already being run. Users resend
+        # commands that seem to be taking too long, which only doubles the work.
+        key = (user_name, channel, ';'.join(' '.join(x).lower() for x in commands))
+        with self._running_lock:
+            if key in self._running:
+                LOGGER.info("Dropping '%s' from %s, it is already running",
+                            command_string, user_name)
+                zonebot.counters.increment(self.config, 'duplicate commands dropped')
+                return
+            self._running.add(key)
 
         start_time = time.time()
 
-        cmd = zonebot.commands.get_command(words, user_name=user_name, config=self.config)
-        cmd.perform(user_name=user_name, commands=words, zoneminder=self.zoneminder)
-        result = cmd.report(self.slack_client, user_name, channel)
+        try:
+            batch = []
+            for words in commands:
+                if zonebot.commands.is_read_only(words):
+                    batch.append(words)
+                    continue
+
+                self._run_commands(batch, user_name, channel)
+                self._run_commands([words], user_name, channel)
+                batch = []
+
+            self._run_commands(batch, user_name, channel)
+        finally:
+            with self._running_lock:
+                self._running.discard(key)
 
         duration = time.time() - start_time
         LOGGER.debug("Completed command '%s' in %f seconds", command_string, duration)
 
-        zonebot.commands.Command.log_slack_result(result)
+    def _run_commands(self, commands, user_name, channel):
+        """
+        Performs commands at the same time, then posts their replies in order.
+
+        :param commands: The words of each command
+        :type commands: list[list[str]]
+        :param user_name: Name (not ID) of the user the commands are run for
+        :type user_name: str
+        :param channel: The channel the replies go to
+        :type channel: str
+        """
+
+        if not commands:
+            return
+
+        cmds = [zonebot.commands.get_command(x, user_name=user_name, config=self.config)
+                for x in commands]
+
+        slack = self.outbound.client(REPLY)
+
+        # Let the user know slow commands have been seen, before performing any
+        placeholders = []
+        for cmd in cmds:
+            placeholder = None
+            if cmd.placeholder:
+                placeholder = Placeholder(slack, channel, cmd.placeholder)
+                cmd.progress = placeholder.update
+            placeholders.append(placeholder)
+
+        def perform(index):
+            try:
+                if cmds[index].cacheable and self.command_cache:
+                    cmds[index] = self.command_cache.perform(cmds[index], user_name,
+                                                             commands[index], self.zoneminder)
+                else:
+                    cmds[index].perform(user_name=user_name, commands=commands[index],
+                                        zoneminder=self.zoneminder)
+                return None
+            except Exception as e:
+                LOGGER.exception("Command '%s' failed: %s", ' '.join(commands[index]), str(e))
+                return e
+
+        if len(cmds) == 1:
+            errors = [perform(0)]
+        else:
+            workers = self.config.getint('Runtime', 'pipeline workers', fallback=4)
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(cmds)))) as executor:
+                errors = list(executor.map(perform, range(len(cmds))))
+
+        for words, cmd, error, placeholder in zip(commands, cmds, errors, placeholders):
+            reply = placeholder or slack
+            if error:
+                result = reply.api_call("chat.postMessage",
+                                        channel=channel,
+                                        text='*Error*: _{0}_ failed: {1}'.format(' '.join(words),
+                                                                                str(error)),
+                                        as_user=True)
+            else:
+                result = cmd.report(reply, user_name, channel)
+
+            zonebot.commands.Command.log_slack_result(result)
+            if placeholder:
+                placeholder.finish()
 
@@ -0,0 +1,350 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Coalescing of bursts of events, so that one incident (a person walking past several
+cameras) is posted to Slack as a single message.
+
+Events are written to a spool directory for their monitor group. Whoever manages to
+take the group's lock (a zonebot-alert process or a thread in the bot) becomes the
+leader: it waits until no new event has arrived for `window` seconds (but never more
+than `max delay` seconds after the first event), then sends every spooled event at
+once. Everyone else returns straight away and leaves their event to the leader.
+
+Events stay in the spool until they have been sent. Events left behind, because
+sending failed or a leader died while waiting, are sent by the next leader of the
+group or by :class:`SpoolFlusher` in the bot.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import zonebot
+from zonebot.tasks import BackgroundTask
+
+LOGGER = logging.getLogger("zonebot")
+
+# Events that could not be sent this many times are given up on
+_MAX_ATTEMPTS = 3
+
+
+def get_monitor_group(config, monitor_name):
+    """
+    Finds the group a monitor belongs to. Groups are listed in the ``[Monitor Groups]``
+    section as ``group = monitor, monitor, ...`` (names are not case sensitive). A
+    monitor that is not in any group is a group of its own.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param monitor_name: Name (not ID) of the monitor
+    :type monitor_name: str
+    :return: The name of the group
+    :rtype: str
+    """
+
+    if config.has_section('Monitor Groups'):
+        for group, monitors in config.items('Monitor Groups'):
+            if monitor_name.lower() in [x.strip().lower() for x in monitors.split(',')]:
+                return group
+
+    return monitor_name
+
+
+def get_group_monitors(config, group):
+    """
+    Lists the monitors in a group from the ``[Monitor Groups]`` section.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param group: The name of the group (not case sensitive)
+    :type group: str
+    :return: The names of the monitors, or `None` if there is no such group
+    :rtype: list[str]
+    """
+
+    if not config or not config.has_section('Monitor Groups'):
+        return None
+
+    monitors = config.get('Monitor Groups', group.lower(), fallback=None)
+    if monitors is None:
+        return None
+
+    return [x.strip() for x in monitors.split(',') if x.strip()]
+
+
+def coalescing_enabled(config):
+    """
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :return: `True` if a `coalesce window` is set for any monitor
+    :rtype: bool
+    """
+
+    sections = ['Alerts'] + [x for x in config.sections() if x.lower().startswith('monitor ')]
+
+    return any(config.getfloat(x, 'coalesce window', fallback=0) > 0 for x in sections)
+
+
+class EventSpool(object):
+    """
+    The spool directory, and lock, of one monitor group.
+    """
+
+    def __init__(self, directory, window, max_delay):
+        """
+        :param directory: The spool directory of the group, created if needed
+        :type directory: str
+        :param window: Seconds to wait for another event before sending
+        :type window: float
+        :param max_delay: The most seconds an event is held back for
+        :type max_delay: float
+        """
+
+        self.directory = directory
+        self.window = window
+        self.max_delay = max_delay
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o0755, exist_ok=True)
+
+    @classmethod
+    def for_group(cls, config, group, window, max_delay):
+        """
+        The spool of a monitor group, kept in the bot's state directory.
+
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :param group: The name of the group
+        :type group: str
+        """
+
+        name = re.sub(r'\W+', '_', group.lower())
+        return cls(os.path.join(zonebot.state_path(config, 'spool'), name), window, max_delay)
+
+    def submit(self, event, send, background=False):
+        """
+        Adds an event to the spool and, if no one else is already doing so, sends the
+        spooled events once the window has closed.
+
+        :param event: The event, anything that can be stored as JSON. Images (file-like
+                      objects) in its `images` list are saved to the spool.
+        :type event: dict
+        :param send: Called with the list of events to post as one message, returns
+                     `True` if they were posted
+        :param background: Wait for the window in a new thread rather than in the
+                           caller's, for callers that have more events to submit
+        :type background: bool
+        """
+
+        self._write(event)
+
+        if background:
+            thread = threading.Thread(target=self.flush, args=(send,), name='event spool')
+            thread.daemon = True
+            thread.start()
+        else:
+            self.flush(send)
+
+    def flush(self, send):
+        """
+        Sends the spooled events, unless someone else is already doing so.
+
+        :param send: Called with the list of events to post as one message, returns
+                     `True` if they were posted
+        """
+
+        while True:
+            handle = open(os.path.join(self.directory, 'lock'), 'a')
+            try:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    # The current leader will send it
+                    return
+
+                while True:
+                    entries = self._wait()
+                    if not entries:
+                        break
+
+                    if not self._send(entries, send):
+                        # Left for the next leader to try again
+                        return
+            finally:
+                handle.close()
+
+            # An event may have been added after the last check but before the lock was
+            # released, and its writer could not get the lock.
+            if not self.entries():
+                return
+
+    def entries(self):
+        """
+        :return: The spooled events, oldest first
+        :rtype: list[dict]
+        """
+
+        entries = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json'):
+                continue
+
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, 'r') as handle:
+                    entry = json.load(handle)
+            except (IOError, OSError, ValueError) as e:
+                LOGGER.warning("Could not read spooled event %s: %s", path, str(e))
+                continue
+
+            entry['path'] = path
+            entries.append(entry)
+
+        return entries
+
+    def _write(self, event):
+        """
+        Writes an event to the spool, in one step so it is never seen half written.
+        """
+
+        queued = time.time()
+        name = '{0:.6f}-{1}-{2}'.format(queued, os.getpid(), threading.get_ident())
+
+        images = []
+        spooled = []
+        for index, image in enumerate(event.get('images', [])):
+            if not isinstance(image, str):
+                filename = os.path.join(self.directory, '{0}-{1}.jpg'.format(name, index))
+                with open(filename, 'wb') as handle:
+                    image.seek(0)
+                    handle.write(image.read())
+                spooled.append(filename)
+                image = filename
+            images.append(image)
+
+        entry = dict(event, images=images, spooled=spooled, queued=queued, attempts=0)
+        _write_entry(os.path.join(self.directory, name + '.json'), entry)
+
+    def _wait(self):
+        """
+        Waits for the window to close.
+
+        :return: The events to send, an empty list if there are none
+        :rtype: list[dict]
+        """
+
+        while True:
+            entries = self.entries()
+            if not entries:
+                return entries
+
+            first = entries[0]['queued']
+            last = entries[-1]['queued']
+            wait = min(last + self.window, first + self.max_delay) - time.time()
+            if wait <= 0:
+                return entries
+
+            time.sleep(min(wait, 0.25))
+
+    def _send(self, entries, send):
+        """
+        Sends events as one message. They are removed from the spool once sent, or
+        once sending has failed too often.
+
+        :return: `True` if the events were sent
+        :rtype: bool
+        """
+
+        try:
+            sent = send(entries)
+        except Exception as e:
+            LOGGER.exception("Could not send %d events: %s", len(entries), str(e))
+            sent = False
+
+        for entry in entries:
+            entry['attempts'] = entry.get('attempts', 0) + 1
+            if sent or entry['attempts'] >= _MAX_ATTEMPTS:
+                if not sent:
+                    LOGGER.error("Giving up on event %s after %d attempts", entry.get('id'),
+                                 entry['attempts'])
+
+                for path in entry['spooled'] + [entry['path']]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            else:
+                _write_entry(entry['path'], dict((k, v) for k, v in entry.items()
+                                                 if k != 'path'))
+
+        return sent
+
+
+def _write_entry(path, entry):
+    """
+    Replaces a spool file in one step.
+    """
+
+    temporary = os.path.splitext(path)[0] + '.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump(entry, handle)
+
+    os.replace(temporary, path)
+
+
+class SpoolFlusher(BackgroundTask):
+    """
+    Sends events left in the spool, by a failed send or a leader that died, once they
+    are older than the `coalesce max delay`.
+    """
+
+    def __init__(self, config, send, interval=30):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param send: Called with the list of events to post as one message
+        :param interval: Seconds between checks
+        :type interval: float
+        """
+
+        super(SpoolFlusher, self).__init__('spool flusher', interval)
+
+        self.directory = zonebot.state_path(config, 'spool')
+        self.max_delay = config.getfloat('Alerts', 'coalesce max delay', fallback=30)
+        self.send = send
+
+    def run_once(self):
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+
+            # Window and delay are long past, send straight away
+            spool = EventSpool(path, 0, 0)
+            entries = spool.entries()
+            if entries and entries[0]['queued'] + self.max_delay < time.time():
+                LOGGER.info("Sending %d events left in the %s spool", len(entries), name)
+                spool.flush(self.send)
@@ -21,8 +21,15 @@ All the commands possible for the bot. This is basically a big routing table.
 """
 
 import zonebot
+import zonebot.coalesce
+import zonebot.counters
+import zonebot.timeseries
 
+import datetime
 import logging
+import re
+import threading
+import time
 from abc import ABCMeta, abstractmethod
 
 LOGGER = logging.getLogger("zonebot")
@@ -35,9 +42,31 @@ class Command:
 
     _usermap = {}
 
+    # Whether what `perform` found can be shared, for `cache_ttl` seconds, by users
+    # with the same permissions (see `CommandCache`)
+    cacheable = False
+    cache_ttl = 0
+
+    # Text posted as soon as the command is received, for commands that may take a
+    # while. It is edited in place as the command calls `report_progress`, and then
+    # replaced by the reply. The bot sets `progress` when it posts the placeholder.
+    placeholder = None
+    progress = None
+
     def __init__(self, config=None):
         self.config = config
 
+    def report_progress(self, text):
+        """
+        Shows what has been found so far in the placeholder, if one was posted.
+
+        :param text: The partial reply
+        :type text: str
+        """
+
+        if self.progress:
+            self.progress(text)
+
     @abstractmethod
     def perform(self, user_name, commands, zoneminder):
         pass
@@ -73,7 +102,7 @@ class Command:
 
         :param user_id: Slack user ID of the user (e.g. 'U1234567890')
         :type user_id: str
-        :param slack: A fully configured `slackclient` instance
+        :param slack: A fully configured :class:`zonebot.slackapi.SlackApi` instance
         :return: The resolved name of the user or `None` if the user ID could not be resolved.
         """
 
@@ -180,6 +209,99 @@ class Command:
         return name, monitors, None
 
 
+class CommandCache(object):
+    """
+    Shares what read only commands found (the performed `Command`, which `report`
+    renders) between users with the same permissions, for the command's
+    `cache_ttl` seconds. Users asking while the command is being performed wait for
+    it rather than performing it again.
+    """
+
+    class _Entry(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.command = None
+            self.expires = None
+
+    def __init__(self, config=None):
+        """
+        :param config: The configuration for the bot, for the permissions
+        :type config: configparser.ConfigParser
+        """
+
+        self.config = config
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def perform(self, command, user_name, words, zoneminder):
+        """
+        Performs a cacheable command, unless a user with the same permissions has
+        recently done so.
+
+        :param command: The command
+        :type command: Command
+        :param user_name: Name (not ID) of the user running the command
+        :type user_name: str
+        :param words: The words of the command
+        :type words: list[str]
+        :param zoneminder: The ZoneMinder instance
+        :return: The command to report, either `command` or an earlier one
+        :rtype: Command
+        """
+
+        key = (' '.join(x.lower() for x in words), self.permission_key(user_name))
+
+        with self._lock:
+            now = time.monotonic()
+            # Forget what has expired, so the cache never grows past what is in use
+            for expired in [k for k, v in self._entries.items()
+                            if v.expires is not None and v.expires <= now]:
+                del self._entries[expired]
+
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = CommandCache._Entry()
+
+        if not owner:
+            entry.done.wait()
+            if entry.command is not None:
+                zonebot.counters.increment(self.config, 'command cache hits')
+                return entry.command
+            # The first attempt failed, try it ourselves
+            command.perform(user_name=user_name, commands=words, zoneminder=zoneminder)
+            return command
+
+        try:
+            command.perform(user_name=user_name, commands=words, zoneminder=zoneminder)
+            entry.command = command
+            entry.expires = time.monotonic() + command.cache_ttl
+        finally:
+            if entry.command is None:
+                with self._lock:
+                    self._entries.pop(key, None)
+            entry.done.set()
+
+        return command
+
+    def permission_key(self, user_name):
+        """
+        :param user_name: Name (not ID) of the user
+        :type user_name: str
+        :return: The user's permissions, the same for every user with the same ones
+        :rtype: tuple
+        """
+
+        if not self.config or not self.config.has_section('Permissions'):
+            return ('any',)
+
+        if not user_name:
+            return ()
+
+        access = self.config.get('Permissions', user_name.lower(), fallback='read')
+        return tuple(sorted(set(x.strip() for x in access.split(','))))
+
+
 class About(Command):
     """
     Prints about text.
@@ -202,21 +324,53 @@ class About(Command):
 
 class Status(Command):
     """
-    Prints ZoneMinder status
+    Prints ZoneMinder status. When the status sampler is running (see the ``[Status]``
+    section) the latest sample is shown, with the history of the load average, and
+    nothing is asked of ZoneMinder.
     """
+
+    cacheable = True
+    cache_ttl = 10
+
     def __init__(self, config=None):
+        import zonebot.sampler
+
         super(Status, self).__init__(config=config)
         self.status = {}
+        self.history = []
+
+        # Only asking ZoneMinder takes a while, the sampler already has the answer
+        sampler = zonebot.sampler.current()
+        if not sampler or not sampler.latest:
+            self.placeholder = '_Asking ZoneMinder for its status..._'
 
     def perform(self, user_name, commands, zoneminder):
-        self.status = zoneminder.get_status()
+        import zonebot.sampler
+
+        sampler = zonebot.sampler.current()
+        if sampler and sampler.latest:
+            self.status = sampler.latest
+            self.history = [('last hour', sampler.summary(60 * 60)),
+                            ('last day', sampler.summary(24 * 60 * 60))]
+        else:
+            def partial(status):
+                self.report_progress(self.format_status(status) + '_Still asking..._')
+
+            self.status = zoneminder.get_status(progress=partial)
 
     def report(self, slack, user, channel):
-        text = ''
+        text = self.format_status(self.status)
 
-        text += '• _ZoneMinder version_: {0}\n'.format(self.status['version'])
-        text += '• _ZoneMinder daemon_: {0}\n'.format(self.status['daemon'])
-        text += '• _Load average_: {0}\n'.format(self.status['load'])
+        for period, summary in self.history:
+            text += self.format_summary('Load, ' + period, summary['load'], '{0:.2f}')
+
+        if self.history:
+            running = self.history[-1][1]['running']
+            if running:
+                text += '• _Daemon running, last day_: {0:.0f}% of the time\n'.format(
+                    running['mean'] * 100)
+            text += self.format_summary('Event disk use, last day',
+                                        self.history[-1][1]['disk'], '{0:.1f} GB')
 
         #
         # Disk usage. This very, ***VERY*** often times out and is currently disabled.
@@ -231,6 +385,49 @@ class Status(Command):
                               text=text,
                               as_user=True)
 
+    @staticmethod
+    def format_status(status):
+        """
+        :param status: From :meth:`ZoneMinder.get_status`, perhaps only part of it
+        :type status: dict
+        :return: A line for each part of the status that is known
+        :rtype: str
+        """
+
+        text = ''
+        if 'version' in status:
+            text += '• _ZoneMinder version_: {0}\n'.format(status['version'])
+        if 'daemon' in status:
+            text += '• _ZoneMinder daemon_: {0}\n'.format(status['daemon'])
+        if 'load' in status:
+            text += '• _Load average_: {0}\n'.format(status['load'])
+
+        return text
+
+    @staticmethod
+    def format_summary(title, summary, number):
+        """
+        :param title: What was sampled, and when
+        :type title: str
+        :param summary: From :func:`zonebot.timeseries.window_summary`, may be `None`
+        :type summary: dict
+        :param number: Format of the numbers
+        :type number: str
+        :return: A line with a sparkline and the minimum, average and maximum, or an
+                 empty string if there is no summary
+        :rtype: str
+        """
+
+        if not summary:
+            return ''
+
+        return '• _{0}_: {1} min {2}, avg {3}, max {4}\n'.format(
+            title,
+            zonebot.timeseries.sparkline(summary['values'], floor=0),
+            number.format(summary['min']),
+            number.format(summary['mean']),
+            number.format(summary['max']))
+
 
 class Help(Command):
     """
@@ -297,6 +494,10 @@ class Denied(Unknown):
 
 
 class ListMonitors(Command):
+
+    cacheable = True
+    cache_ttl = 10
+
     def __init__(self, config=None):
         super(ListMonitors, self).__init__(config=config)
 
@@ -306,14 +507,12 @@ class ListMonitors(Command):
         monitors = zoneminder.get_monitors()
         monitors.load()
 
-        for monitor_name in monitors.monitors:
-            monitor = monitors.monitors[monitor_name]
-
-            enabled = 'Yes' if monitor['Enabled'] == '1' else 'No'
-            color = '#2fa44f' if monitor['Enabled'] == '1' else '#d52000'
+        for monitor in monitors.select():
+            enabled = 'Yes' if monitor.enabled else 'No'
+            color = '#2fa44f' if monitor.enabled else '#d52000'
 
             self.attachments.append({
-                'text': '{0} (ID: {1})'.format(monitor['Name'], monitor['Id']),
+                'text': '{0} (ID: {1})'.format(monitor.name, monitor.id),
                 'fields': [
                     {
                         'title': 'Enabled',
@@ -322,7 +521,7 @@ class ListMonitors(Command):
                     },
                     {
                         'title': 'Detection',
-                        'value': monitor['Function'],
+                        'value': monitor.function,
                         'short': True
                     }
                 ],
@@ -337,21 +536,75 @@ class ListMonitors(Command):
 
 
 class ToggleMonitor(Command):
+    """
+    Enables or disables a monitor, the monitors of a group (see ``[Monitor Groups]``)
+    or all of them.
+    """
+
     def __init__(self, config=None):
         super(ToggleMonitor, self).__init__(config=config)
         self.result = None
 
     def perform(self, user_name, commands, zoneminder):
+        if len(commands) <= 2:
+            self.result = '*Error*: the name of the monitor is required. ' \
+                          '_\'list monitors\'_ will display them all'
+            return
 
-        name, monitors, error_text = Command.get_monitor(commands, 2, zoneminder)
-        if not name:
-            self.result = error_text
+        on = commands[0].lower() == 'enable'
+        target = ' '.join(commands[2:]).strip().lower()
+        monitors = zoneminder.get_monitors()
+
+        if 'all' == target:
+            names = None
+        else:
+            names = zonebot.coalesce.get_group_monitors(self.config, target)
+
+        if names is None and 'all' != target:
+            # A single monitor
+            changed = monitors.set_state(target, on)
+            if 'not found' == changed:
+                self.result = '*Error*: monitor {0} not found. ' \
+                              '_\'list monitors\'_ will display them all'.format(target)
+            else:
+                self.result = 'Monitor {0} state {1}'.format(target, changed)
             return
 
-        on = True if commands[0] == 'enable' else False
-        changed = monitors.set_state(name, on)
+        results = monitors.set_states(names, on)
+        self.result = self.summarize(target, on, results, monitors)
+
+    @staticmethod
+    def summarize(target, on, results, monitors):
+        """
+        :param target: The group, or 'all'
+        :type target: str
+        :param on: Whether the monitors were enabled
+        :type on: bool
+        :param results: What happened to each monitor, from `Monitors.set_states`
+        :type results: dict
+        :param monitors: The monitors, to find the names as written in ZoneMinder
+        :type monitors: zonebot.zoneminder.monitors.Monitors
+        :return: The reply, a line of totals and a line for each monitor
+        :rtype: str
+        """
+
+        changed = len([x for x in results.values() if x.startswith('changed')])
+        unchanged = len([x for x in results.values() if x.startswith('already')])
+        failed = len(results) - changed - unchanged
+
+        text = '*{0}* monitors {1}: {2} changed, {3} already {4}, {5} failed'.format(
+            'All' if 'all' == target else target,
+            'enabled' if on else 'disabled',
+            changed,
+            unchanged,
+            'enabled' if on else 'disabled',
+            failed)
 
-        self.result = 'Monitor {0} state {1}'.format(name, changed)
+        for name in sorted(results):
+            monitor = monitors.get(name)
+            text += '\n{0} {1}'.format(monitor.name if monitor else name, results[name])
+
+        return text
 
     def report(self, slack, user, channel):
         return slack.api_call("chat.postMessage",
@@ -365,6 +618,8 @@ class GetStillImage(Command):
     Returns the current still image from a monitor and replies to the channel with it.
     """
 
+    placeholder = '_Getting the image..._'
+
     def __init__(self, config=None):
         super(GetStillImage, self).__init__(config=config)
         self.error_text = None
@@ -378,6 +633,7 @@ class GetStillImage(Command):
             return
 
         self.name = monitors.get_value(name, 'Name')
+        self.report_progress('_Getting the latest image from {0}..._'.format(self.name))
 
         image, error_text = zoneminder.get_still_image(monitors.get_value(name, 'Id'))
         if error_text:
@@ -404,6 +660,291 @@ class GetStillImage(Command):
                               file=self.image
                               )
 
+
+class ListEvents(Command):
+    """
+    Lists recent (or the highest scoring) events from the local event index.
+    """
+
+    cacheable = True
+    cache_ttl = 10
+
+    def __init__(self, config=None):
+        super(ListEvents, self).__init__(config=config)
+        self.text = None
+
+    def perform(self, user_name, commands, zoneminder):
+        arguments = [x.lower() for x in commands[1:]]
+
+        top = False
+        monitor = None
+
+        if arguments and arguments[0] == 'top':
+            top = True
+            arguments = arguments[1:]
+
+        if arguments and parse_since(arguments[0]) is None:
+            monitor = arguments[0]
+            arguments = arguments[1:]
+
+        since = None
+        if arguments:
+            since = parse_since(arguments[0])
+            if since is None:
+                self.text = "*Error*: '{0}' is not a time. Use _today_, _yesterday_ or " \
+                            "a number of minutes, hours or days like _30m_, _6h_ or _2d_" \
+                    .format(arguments[0])
+                return
+
+        index = zoneminder.get_event_index()
+
+        # Only go to ZoneMinder when the index is not being kept up to date already
+        max_age = self.config.getint('Events', 'max age', fallback=60) if self.config else 60
+        if index.last_refresh + max_age < time.time():
+            index.refresh(zoneminder)
+
+        if top:
+            events = index.top(monitor=monitor, since=since)
+        else:
+            events = index.recent(monitor=monitor, since=since)
+
+        if not events:
+            self.text = 'No events found'
+            return
+
+        lines = []
+        for event in events:
+            lines.append('• <{0}/index.php?view=event&eid={1}|{1}> _{2}_ {3} '
+                         '({4:.0f}s, {5}, score {6})'.format(zoneminder.url,
+                                                             event['id'],
+                                                             event['monitor'],
+                                                             event['start_time'],
+                                                             event['length'],
+                                                             event['cause'],
+                                                             event['max_score']))
+
+        self.text = '\n'.join(lines)
+
+    def report(self, slack, user, channel):
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=self.text,
+                              as_user=True)
+
+
+class Stats(Command):
+    """
+    Shows the counters kept by the bot and the alert scripts.
+    """
+
+    def __init__(self, config=None):
+        super(Stats, self).__init__(config=config)
+        self.counters = {}
+
+    def perform(self, user_name, commands, zoneminder):
+        self.counters = zonebot.counters.read_counters(self.config)
+
+    def report(self, slack, user, channel):
+        text = ''
+        for name in sorted(self.counters):
+            text += '• _{0}_: {1}\n'.format(name, self.counters[name])
+
+        # Replies sent through the outbound queue can also say how long calls wait
+        dispatcher = getattr(slack, 'dispatcher', None)
+        if dispatcher:
+            for name, ages in sorted(dispatcher.queue_ages().items()):
+                if ages['count']:
+                    text += '• _{0} queue wait_: {1:.2f}s mean, {2:.2f}s max\n'.format(
+                        name, ages['mean'], ages['max'])
+
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=text or 'Nothing has been counted yet',
+                              as_user=True)
+
+
+class Health(Command):
+    """
+    Shows the health of each camera, from the samples the health monitor keeps in
+    memory. Nothing is asked of ZoneMinder.
+    """
+
+    def __init__(self, config=None):
+        super(Health, self).__init__(config=config)
+        self.rows = None
+
+    def perform(self, user_name, commands, zoneminder):
+        import zonebot.health
+
+        monitor = zonebot.health.current()
+        if monitor:
+            self.rows = monitor.table()
+
+    def report(self, slack, user, channel):
+        if self.rows is None:
+            text = 'Camera health is not being watched, see the [Health] section ' \
+                   'of the config file'
+        elif not self.rows:
+            text = 'No camera health samples yet'
+        else:
+            text = ''
+            for row in self.rows:
+                text += '• _{0}_: {1}, {2} fps now, {3} fps mean {4}'.format(
+                    row['name'],
+                    row['state'],
+                    '?' if row['fps'] is None else '{0:.1f}'.format(row['fps']),
+                    '?' if row['mean fps'] is None else '{0:.1f}'.format(row['mean fps']),
+                    row['sparkline'])
+                if row['latency'] is not None:
+                    text += ', snapshot {0:.0f} ms'.format(row['latency'])
+                text += '\n'
+
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=text,
+                              as_user=True)
+
+
+class ScheduleCommand(Command):
+    """
+    Schedules a command, as in `schedule disable monitor kitchen at 08:00 weekdays`.
+    The days are 'daily' (the default), 'weekdays', 'weekends' or day names. The
+    schedule is added when the reply is made, as that is when the channel is known.
+    """
+
+    def __init__(self, config=None):
+        super(ScheduleCommand, self).__init__(config=config)
+        self.error_text = None
+        self.command = None
+        self.hour = None
+        self.minute = None
+        self.days = None
+
+    def perform(self, user_name, commands, zoneminder):
+        import zonebot.scheduler
+
+        usage = '*Error*: expected _schedule <command> at HH:MM [daily|weekdays|weekends|' \
+                'mon tue ...]_'
+
+        lowered = [x.lower() for x in commands]
+        if 'at' not in lowered[2:]:
+            self.error_text = usage
+            return
+
+        at = len(lowered) - 1 - lowered[::-1].index('at')
+        words = commands[1:at]
+        rest = commands[at + 1:]
+
+        # The time arrives as two words, '08:00' having been split at the ':'
+        numbers = []
+        while rest and rest[0].isdigit() and len(numbers) < 2:
+            numbers.append(int(rest.pop(0)))
+        if not numbers or numbers[0] > 23 or (len(numbers) > 1 and numbers[1] > 59):
+            self.error_text = usage
+            return
+
+        self.days = zonebot.scheduler.parse_days(rest)
+        if self.days is None:
+            self.error_text = usage
+            return
+
+        cmd = get_command(words, user_name=user_name, config=self.config)
+        if isinstance(cmd, Denied):
+            self.error_text = '*Error*: you are not allowed to run _{0}_'.format(' '.join(words))
+            return
+        if isinstance(cmd, (Unknown, Help)) or not words:
+            self.error_text = '*Error*: _{0}_ is not a command'.format(' '.join(words))
+            return
+        if isinstance(cmd, (ScheduleCommand, Unschedule)):
+            self.error_text = '*Error*: schedules can not be scheduled'
+            return
+
+        self.command = ' '.join(words)
+        self.hour = numbers[0]
+        self.minute = numbers[1] if len(numbers) > 1 else 0
+
+    def report(self, slack, user, channel):
+        import zonebot.scheduler
+
+        scheduler = zonebot.scheduler.current()
+        if self.error_text:
+            text = self.error_text
+        elif not scheduler:
+            text = 'Scheduling is not enabled, see the [Scheduler] section of the config file'
+        else:
+            schedule = scheduler.add(user, channel, self.command, self.hour, self.minute,
+                                     self.days)
+            text = 'Scheduled {0}'.format(schedule.describe())
+
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=text,
+                              as_user=True)
+
+
+class ListSchedules(Command):
+    """
+    Lists the scheduled commands.
+    """
+
+    def __init__(self, config=None):
+        super(ListSchedules, self).__init__(config=config)
+        self.schedules = None
+
+    def perform(self, user_name, commands, zoneminder):
+        import zonebot.scheduler
+
+        scheduler = zonebot.scheduler.current()
+        if scheduler:
+            self.schedules = scheduler.list()
+
+    def report(self, slack, user, channel):
+        if self.schedules is None:
+            text = 'Scheduling is not enabled, see the [Scheduler] section of the config file'
+        elif not self.schedules:
+            text = 'Nothing is scheduled'
+        else:
+            text = ''.join('• {0}\n'.format(x.describe()) for x in self.schedules)
+
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=text,
+                              as_user=True)
+
+
+class Unschedule(Command):
+    """
+    Removes a scheduled command, by its number.
+    """
+
+    def __init__(self, config=None):
+        super(Unschedule, self).__init__(config=config)
+        self.result = None
+
+    def perform(self, user_name, commands, zoneminder):
+        import zonebot.scheduler
+
+        scheduler = zonebot.scheduler.current()
+        if not scheduler:
+            self.result = 'Scheduling is not enabled, see the [Scheduler] section of the ' \
+                          'config file'
+        elif len(commands) < 2 or not commands[1].isdigit():
+            self.result = '*Error*: the number of the schedule is required. ' \
+                          '_\'schedules\'_ will list them all'
+        else:
+            schedule = scheduler.remove(int(commands[1]))
+            if schedule:
+                self.result = 'Removed {0}'.format(schedule.describe())
+            else:
+                self.result = '*Error*: there is no schedule {0}'.format(commands[1])
+
+    def report(self, slack, user, channel):
+        return slack.api_call("chat.postMessage",
+                              channel=channel,
+                              text=self.result,
+                              as_user=True)
+
+
 #
 # meta - true for meta (not user) command that should not show up in the help
 # index - the oder in which the command should be displayed in the help output
@@ -447,13 +988,15 @@ _all_commands = {
     },
     'enable monitor': {
         'permission': 'write',
-        'help': 'Enable alarms on a monitor (supplied by name, not ID)',
+        'help': 'Enable alarms on a monitor (supplied by name, not ID), the monitors '
+                'of a group or \'all\'',
         'classname': ToggleMonitor,
         'index': 4
     },
     'disable monitor': {
         'permission': 'write',
-        'help': 'Disable alarms on a monitor (supplied by name, not ID)',
+        'help': 'Disable alarms on a monitor (supplied by name, not ID), the monitors '
+                'of a group or \'all\'',
         'classname': ToggleMonitor,
         'index': 5
     },
@@ -462,6 +1005,45 @@ _all_commands = {
         'help': 'Get a still image from the named monitor (supplied by name, not ID)',
         'classname': GetStillImage,
         'index': 6
+    },
+    'events': {
+        'permission': 'read',
+        'help': 'List recent events, from all monitors or the named monitor. '
+                '\'events top\' lists the highest scoring events instead. Either can be '
+                'limited to events since a time (today, yesterday, 30m, 6h, 2d)',
+        'classname': ListEvents,
+        'index': 7
+    },
+    'stats': {
+        'permission': 'read',
+        'help': 'Show how many alerts have been filtered, merged, etc',
+        'classname': Stats,
+        'index': 8
+    },
+    'health': {
+        'permission': 'read',
+        'help': 'Show the capture rate and snapshot time of each camera',
+        'classname': Health,
+        'index': 9
+    },
+    'schedule': {
+        'permission': 'write',
+        'help': 'Run a command at a time of day, e.g. \'schedule disable monitor kitchen '
+                'at 08:00 weekdays\' (daily, weekdays, weekends or day names)',
+        'classname': ScheduleCommand,
+        'index': 10
+    },
+    'schedules': {
+        'permission': 'read',
+        'help': 'List the scheduled commands',
+        'classname': ListSchedules,
+        'index': 11
+    },
+    'unschedule': {
+        'permission': 'write',
+        'help': 'Remove a scheduled command, by its number',
+        'classname': Unschedule,
+        'index': 12
     }
 }
 
@@ -481,20 +1063,92 @@ def get_command(words, user_name=None, config=None):
     if not words or len(words) < 1:
         return Help()
 
+    command_text = _find_command(words)
+    if command_text is None:
+        return Unknown()
+
+    perms = _all_commands[command_text]['permission']
+
+    if not Command.has_permission(user_name, config, command_text, perms):
+        return Denied()
+
+    return _all_commands[command_text]['classname'](config=config)
+
+
+def is_read_only(words):
+    """
+    Whether a command only reads, so that it can be run at the same time as others.
+    Unknown commands (which only reply) count as read only.
+
+    :param words: The list of words that make up the command and its arguments.
+    :type words: List[str]
+    :rtype: bool
+    """
+
+    command_text = _find_command(words)
+    if command_text is None:
+        return True
+
+    return _all_commands[command_text]['permission'] in ('any', 'read')
+
+
+def _find_command(words):
+    """
+    :param words: The list of words that make up the command and its arguments.
+    :type words: List[str]
+    :return: The name of the command, the key in `_all_commands`, or `None`
+    :rtype: str
+    """
+
+    if not words:
+        return None
+
     command_text = words[0].strip().lower()
     if command_text not in _all_commands:
         if len(words) > 1:
             command_text = '{0} {1}'.format(words[0].strip().lower(), words[1].strip().lower())
 
     if command_text not in _all_commands:
-        return Unknown()
+        return None
 
-    perms = _all_commands[command_text]['permission']
+    return command_text
 
-    if not Command.has_permission(user_name, config, command_text, perms):
-        return Denied()
 
-    return _all_commands[command_text]['classname'](config=config)
+def parse_since(text, now=None):
+    """
+    Converts a (chat friendly) relative time into a timestamp. Supported are 'today',
+    'yesterday' and a number of minutes, hours, days or weeks such as '30m', '6h',
+    '2d' or '1w'.
+
+    :param text: The time to convert
+    :type text: str
+    :param now: The current time (seconds since the epoch), defaults to now
+    :type now: float
+    :return: The timestamp ('yyyy-mm-dd hh:mm:ss') or `None` if the text is not a time
+    :rtype: str
+    """
+
+    if now is None:
+        now = time.time()
+
+    text = text.strip().lower()
+    midnight = datetime.datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0,
+                                                            microsecond=0)
+
+    if 'today' == text:
+        start = midnight
+    elif 'yesterday' == text:
+        start = midnight - datetime.timedelta(days=1)
+    else:
+        match = re.match(r'^(\d+)([mhdw])$', text)
+        if not match:
+            return None
+
+        units = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+        delta = datetime.timedelta(**{units[match.group(2)]: int(match.group(1))})
+        start = datetime.datetime.fromtimestamp(now) - delta
+
+    return start.strftime('%Y-%m-%d %H:%M:%S')
 
 
 suffixes = ['bytes', 'Kb', 'Mb', 'Gb', 'Tb', 'Pb']
@@ -0,0 +1,84 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Counters kept in the bot's state directory, so that counts from every zonebot-alert
+process (and the bot) add up and survive restarts.
+"""
+
+import fcntl
+import json
+import logging
+import os
+
+import zonebot
+
+LOGGER = logging.getLogger("zonebot")
+
+
+def increment(config, name, amount=1):
+    """
+    Adds to a counter.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param name: The name of the counter
+    :type name: str
+    :param amount: The amount to add
+    :type amount: int
+    :return: The new value of the counter
+    :rtype: int
+    """
+
+    path = zonebot.state_path(config, 'counters.json')
+
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        counters = _read(path)
+        counters[name] = counters.get(name, 0) + amount
+
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(counters, handle, sort_keys=True)
+        os.replace(temporary, path)
+
+    return counters[name]
+
+
+def read_counters(config):
+    """
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :return: Every counter, by name
+    :rtype: dict
+    """
+
+    return _read(zonebot.state_path(config, 'counters.json'))
+
+
+def _read(path):
+    if not os.path.isfile(path):
+        return {}
+
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except ValueError:
+        LOGGER.warning("Ignoring unreadable counters in %s", path)
+        return {}
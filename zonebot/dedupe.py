@@ -0,0 +1,154 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Recognizes alert frames that look the same as a frame posted recently, such as a
+static scene with a flickering light, so they are not posted again and again.
+
+The perceptual hash of every posted frame is kept in a small ring buffer for each
+monitor. The buffers are files in the bot's state directory, so they are shared by
+every zonebot-alert process.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import time
+
+import numpy
+
+import zonebot
+
+LOGGER = logging.getLogger("zonebot")
+
+_RECORD = numpy.dtype([('hash', '<u8'), ('time', '<f8')])
+
+
+class FrameHistory(object):
+    """
+    The hashes of the frames recently posted for one monitor.
+    """
+
+    def __init__(self, path, size=16):
+        """
+        :param path: The file the ring buffer is kept in
+        :type path: str
+        :param size: The number of hashes to keep
+        :type size: int
+        """
+
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def for_monitor(cls, config, monitor_name, size=16):
+        """
+        The history of a monitor, kept in the bot's state directory.
+
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :param monitor_name: Name (not ID) of the monitor
+        :type monitor_name: str
+        """
+
+        name = re.sub(r'\W+', '_', monitor_name.lower())
+        return cls(zonebot.state_path(config, 'frames-{0}.bin'.format(name)), size)
+
+    def check(self, hashes, distance, max_age):
+        """
+        Finds which frames look like a frame posted in the last `max_age` seconds, or
+        like an earlier frame in `hashes`. The history is not changed: frames are only
+        added by :meth:`record`, once they have been posted.
+
+        :param hashes: The hashes of the frames, from
+                       :func:`zonebot.images.difference_hash`
+        :type hashes: list[int]
+        :param distance: Frames whose hashes differ in fewer bits than this are the same
+        :type distance: int
+        :param max_age: Seconds for which a posted frame is remembered
+        :type max_age: float
+        :return: Whether each frame is a duplicate
+        :rtype: list[bool]
+        """
+
+        now = time.time()
+        duplicates = []
+
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            ring = self._read()
+
+        recent = ring['hash'][ring['time'] > now - max_age]
+
+        for value in hashes:
+            if recent.size:
+                different = numpy.bitwise_xor(recent, numpy.uint64(value))
+                bits = numpy.unpackbits(different.view(numpy.uint8)).reshape(-1, 64)
+                duplicate = bool((bits.sum(axis=1) < distance).any())
+            else:
+                duplicate = False
+
+            duplicates.append(duplicate)
+            if not duplicate:
+                recent = numpy.append(recent, numpy.uint64(value))
+
+        return duplicates
+
+    def record(self, hashes):
+        """
+        Adds the hashes of posted frames to the history, replacing the oldest.
+
+        :param hashes: The hashes of the frames, from
+                       :func:`zonebot.images.difference_hash`
+        :type hashes: list[int]
+        """
+
+        if not hashes:
+            return
+
+        now = time.time()
+
+        with open(self.path + '.lock', 'a') as lock:
+            # Other alert processes may be recording at the same time
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            ring = self._read()
+            for value in hashes:
+                oldest = numpy.argmin(ring['time'])
+                ring[oldest] = (value, now)
+
+            temporary = self.path + '.tmp'
+            ring.tofile(temporary)
+            os.replace(temporary, self.path)
+
+    def _read(self):
+        """
+        :return: The ring buffer, empty slots have a time of 0
+        :rtype: numpy.ndarray
+        """
+
+        ring = numpy.zeros(self.size, dtype=_RECORD)
+
+        if os.path.isfile(self.path):
+            saved = numpy.fromfile(self.path, dtype=_RECORD)
+            # Newest first, in case the size has changed
+            saved = saved[numpy.argsort(-saved['time'])][:self.size]
+            ring[:len(saved)] = saved
+
+        return ring
@@ -0,0 +1,121 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Rules that stop uninteresting events (shadows, insects, ...) from being posted. Each
+rule can be set in the ``[Alerts]`` section or for a single monitor.
+
+The rules only need an event's summary (score, length, cause and start time), so they
+can be checked before any frames or images are loaded.
+"""
+
+import datetime
+import logging
+
+import zonebot
+
+LOGGER = logging.getLogger("zonebot")
+
+
+_OPTIONS = ['min score', 'min length', 'causes', 'quiet hours']
+
+
+def filtering_enabled(config):
+    """
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :return: `True` if any filter rule is set, for any monitor
+    :rtype: bool
+    """
+
+    sections = ['Alerts'] + [x for x in config.sections() if x.lower().startswith('monitor ')]
+
+    return any(config.get(section, option, fallback=None)
+               for section in sections for option in _OPTIONS)
+
+
+def suppression_reason(config, monitor_name, score=None, length=None, cause=None,
+                       start_time=None):
+    """
+    Checks an event against the filter rules of its monitor. Rules that need a value
+    that is not known (`None`) are skipped.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :param monitor_name: Name (not ID) of the monitor
+    :type monitor_name: str
+    :param score: The highest score of any frame in the event
+    :type score: int
+    :param length: Length of the event in seconds
+    :type length: float
+    :param cause: Cause of the event ('Motion', 'Signal', ...)
+    :type cause: str
+    :param start_time: When the event started ('yyyy-mm-dd hh:mm:ss')
+    :type start_time: str
+    :return: Why the event should not be posted, `None` if it should be
+    :rtype: str
+    """
+
+    min_score = zonebot.get_monitor_option(config, monitor_name, 'min score', fallback=0,
+                                           getter='getint')
+    if score is not None and int(score) < min_score:
+        return 'score {0} is below {1}'.format(score, min_score)
+
+    min_length = zonebot.get_monitor_option(config, monitor_name, 'min length', fallback=0,
+                                            getter='getfloat')
+    if length is not None and float(length) < min_length:
+        return 'length {0}s is below {1}s'.format(length, min_length)
+
+    causes = zonebot.get_monitor_option(config, monitor_name, 'causes', fallback='')
+    causes = [x.strip().lower() for x in causes.split(',') if x.strip()]
+    if cause and causes and cause.lower() not in causes:
+        return 'cause {0} is not one of {1}'.format(cause, ', '.join(causes))
+
+    quiet_hours = zonebot.get_monitor_option(config, monitor_name, 'quiet hours', fallback='')
+    if start_time and quiet_hours:
+        start = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').time()
+        for period in [x.strip() for x in quiet_hours.split(',') if x.strip()]:
+            if in_period(start, period):
+                return 'started during quiet hours {0}'.format(period)
+
+    return None
+
+
+def in_period(when, period):
+    """
+    Whether a time of day is within a period such as '22:00-06:30'. Periods that end
+    before they start run past midnight.
+
+    :param when: The time of day
+    :type when: datetime.time
+    :param period: The period, 'hh:mm-hh:mm'
+    :type period: str
+    :rtype: bool
+    """
+
+    try:
+        first, last = [datetime.datetime.strptime(x.strip(), '%H:%M').time()
+                       for x in period.split('-')]
+    except ValueError:
+        LOGGER.error("Quiet hours '%s' are not in the form hh:mm-hh:mm", period)
+        return False
+
+    if first <= last:
+        return first <= when < last
+
+    return when >= first or when < last
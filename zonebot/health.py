@@ -0,0 +1,298 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Camera health. Every `interval` seconds the capture rate of each active monitor is
+read from the monitor list (ZoneMinder 1.32 and later report it), and optionally a
+still image is fetched from zms to time how long a snapshot takes. The samples are
+kept in memory, in a fixed size ring buffer for each monitor.
+
+A monitor whose average capture rate over the last `window` samples falls below
+`min fps`, or whose snapshots all failed, is reported as degraded, once, and again
+when it recovers. The `health` command shows the samples without asking ZoneMinder.
+"""
+
+import logging
+import math
+import threading
+import time
+
+import numpy
+
+import zonebot
+import zonebot.counters
+from zonebot.tasks import BackgroundTask
+from zonebot.timeseries import RingBuffer, sparkline
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+LOGGER = logging.getLogger("zonebot")
+
+OK = 'ok'
+DEGRADED = 'degraded'
+UNKNOWN = 'unknown'
+
+# The running health monitor, for the `health` command
+_current = None
+
+
+def current():
+    """
+    :return: The health monitor running in this process, or `None`
+    :rtype: HealthMonitor
+    """
+
+    return _current
+
+
+class CameraHealth(object):
+    """
+    The samples of one monitor.
+    """
+
+    def __init__(self, name, size):
+        """
+        :param name: The name of the monitor
+        :type name: str
+        :param size: The number of samples kept
+        :type size: int
+        """
+
+        self.name = name
+        self.fps = RingBuffer(size)
+        self.latency = RingBuffer(size)
+        self.state = UNKNOWN
+
+    def add(self, fps, latency):
+        """
+        :param fps: Frames captured per second, `nan` if not known
+        :type fps: float
+        :param latency: Milliseconds to fetch a snapshot, `nan` if it failed or was
+                        not tried
+        :type latency: float
+        """
+
+        self.fps.append(fps)
+        self.latency.append(latency)
+
+    def check(self, window, min_fps, probing):
+        """
+        :param window: The number of samples averaged
+        :type window: int
+        :param min_fps: The lowest average capture rate that is healthy
+        :type min_fps: float
+        :param probing: Whether snapshots are being fetched
+        :type probing: bool
+        :return: `OK`, `DEGRADED` or `UNKNOWN` (not enough samples yet)
+        :rtype: str
+        """
+
+        if len(self.fps) < window:
+            return UNKNOWN
+
+        fps = self.fps.values(window)
+        if not numpy.isnan(fps).all() and numpy.nanmean(fps) < min_fps:
+            return DEGRADED
+
+        if probing and numpy.isnan(self.latency.values(window)).all():
+            return DEGRADED
+
+        return OK
+
+
+class HealthMonitor(BackgroundTask):
+    """
+    Samples the health of every enabled monitor, every `interval` seconds.
+    """
+
+    def __init__(self, config, slack, zone_minder=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param slack: Where to post degraded and recovered monitors, a
+                      :class:`zonebot.slackapi.SlackApi` or a client of the bot's
+                      outbound dispatcher
+        :param zone_minder: ZoneMinder connection to use, one is created if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        super(HealthMonitor, self).__init__('camera health',
+                                            config.getfloat('Health', 'interval', fallback=60))
+
+        if not zone_minder:
+            zone_minder = ZoneMinder(config)
+            zone_minder.login()
+        self.zone_minder = zone_minder
+        self.slack = slack
+        self.config = config
+
+        self.samples = config.getint('Health', 'samples', fallback=60)
+        self.window = max(1, min(self.samples, config.getint('Health', 'window', fallback=5)))
+        self.min_fps = config.getfloat('Health', 'min fps', fallback=1)
+        self.probe = config.getboolean('Health', 'probe snapshots', fallback=False)
+
+        channels = config.get('Slack', 'channels', fallback='')
+        self.channel = config.get('Health', 'channel', fallback=channels.split(',')[0].strip())
+
+        self.cameras = {}
+        self.last_sample = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        global _current
+        _current = self
+
+        super(HealthMonitor, self).start()
+
+    def run_once(self):
+        """
+        Takes a sample of every enabled monitor, then reports the ones that became
+        degraded or recovered.
+        """
+
+        monitors = self.zone_minder.get_monitors()
+        monitors.load()
+
+        samples = {}
+        for monitor in monitors.select(enabled=True):
+            if 'none' == monitor.function.lower():
+                continue
+
+            fps = float('nan') if monitor.capture_fps is None else monitor.capture_fps
+            latency = self._probe(monitor) if self.probe else float('nan')
+            samples[monitor.id] = (monitor.name, fps, latency)
+
+        changes = []
+        with self._lock:
+            # Monitors that were disabled, or removed, are forgotten
+            for monitor_id in [x for x in self.cameras if x not in samples]:
+                del self.cameras[monitor_id]
+
+            for monitor_id, (name, fps, latency) in samples.items():
+                camera = self.cameras.get(monitor_id)
+                if camera is None:
+                    camera = self.cameras[monitor_id] = CameraHealth(name, self.samples)
+                camera.name = name
+                camera.add(fps, latency)
+
+                state = camera.check(self.window, self._min_fps(name), self.probe)
+                if state == UNKNOWN or state == camera.state:
+                    continue
+
+                if camera.state == UNKNOWN and state == OK:
+                    # Healthy from the start, nothing to say
+                    camera.state = state
+                else:
+                    changes.append((camera, state))
+
+            self.last_sample = time.time()
+
+        # The state only changes once it has been posted, so a failed post is tried
+        # again on the next run
+        for camera, state in changes:
+            if self._report(camera, state):
+                with self._lock:
+                    camera.state = state
+
+    def table(self):
+        """
+        The current health of every monitor, from the samples in memory.
+
+        :return: For each monitor (by name): its state, the latest and average capture
+                 rate, a sparkline of the capture rate, and the average snapshot time
+        :rtype: list[dict]
+        """
+
+        rows = []
+        with self._lock:
+            for camera in sorted(self.cameras.values(), key=lambda x: x.name.lower()):
+                fps = camera.fps.values()
+                window = fps[-self.window:]
+                latency = camera.latency.values(self.window)
+                known = fps[~numpy.isnan(fps)]
+
+                rows.append({
+                    'name': camera.name,
+                    'state': camera.state,
+                    'fps': None if math.isnan(fps[-1]) else float(fps[-1]),
+                    'mean fps': None if numpy.isnan(window).all() else
+                    float(numpy.nanmean(window)),
+                    'sparkline': sparkline(known, floor=0),
+                    'latency': None if numpy.isnan(latency).all() else
+                    float(numpy.nanmean(latency))
+                })
+
+        return rows
+
+    def _min_fps(self, name):
+        return zonebot.get_monitor_option(self.config, name, 'min fps',
+                                          fallback=self.min_fps, getter='getfloat')
+
+    def _probe(self, monitor):
+        """
+        :param monitor: The monitor to fetch a snapshot from
+        :type monitor: zonebot.zoneminder.monitors.Monitor
+        :return: Milliseconds it took, or `nan` if it failed
+        :rtype: float
+        """
+
+        start = time.monotonic()
+        try:
+            image, error_text = self.zone_minder.get_still_image(monitor.id)
+        except Exception as e:
+            image, error_text = None, str(e)
+
+        if error_text or image is None:
+            LOGGER.warning("Could not fetch a snapshot from %s: %s", monitor.name, error_text)
+            return float('nan')
+
+        return (time.monotonic() - start) * 1000
+
+    def _report(self, camera, state):
+        """
+        :param camera: The monitor that changed
+        :type camera: CameraHealth
+        :param state: Its new state
+        :type state: str
+        :return: `True` if the change was posted
+        :rtype: bool
+        """
+
+        fps = camera.fps.values(self.window)
+        rate = 'unknown' if numpy.isnan(fps).all() else '{0:.1f}'.format(numpy.nanmean(fps))
+
+        if DEGRADED == state:
+            text = ':warning: Monitor {0} is degraded: {1} fps over the last {2} samples'.format(
+                camera.name, rate, self.window)
+            if self.probe and numpy.isnan(camera.latency.values(self.window)).all():
+                text += ', and no snapshot could be fetched'
+        else:
+            text = 'Monitor {0} has recovered: {1} fps'.format(camera.name, rate)
+
+        LOGGER.warning(text)
+
+        result = self.slack.api_call('chat.postMessage',
+                                     channel=self.channel,
+                                     text=text,
+                                     as_user=True)
+        if not result or not result.get('ok'):
+            LOGGER.error("Could not post the health of %s: %s", camera.name,
+                         result.get('error') if result else 'no answer')
+            return False
+
+        zonebot.counters.increment(self.config,
+                                   'monitors degraded' if DEGRADED == state else 'monitors recovered')
+        return True
@@ -0,0 +1,130 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Image manipulation for alert frames.
+
+These use the optional `Pillow` package. If it is not installed, callers are told so
+(rather than failing) and can fall back to sending the original images.
+"""
+
+import logging
+import math
+import mmap
+from io import BytesIO
+
+LOGGER = logging.getLogger("zonebot")
+
+
+def make_collage(images, columns=None, tile_width=640):
+    """
+    Joins several JPEG images into a single grid image, in the order given.
+
+    :param images: The JPEG images to join, as file names or file-like objects
+    :type images: list
+    :param columns: Number of images per row, defaults to a roughly square grid
+    :type columns: int
+    :param tile_width: Width (in pixels) of each image in the grid
+    :type tile_width: int
+    :return: The joined JPEG image, or `None` if `Pillow` is not installed
+    :rtype: BytesIO
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        LOGGER.warning("Pillow is not installed, a collage can not be created")
+        return None
+
+    if not columns:
+        columns = int(math.ceil(math.sqrt(len(images))))
+    rows = int(math.ceil(len(images) / float(columns)))
+
+    tiles = []
+    for image in images:
+        tile = Image.open(image)
+        height = int(tile.height * tile_width / float(tile.width))
+        tiles.append(tile.convert('RGB').resize((tile_width, height)))
+
+    tile_height = max(tile.height for tile in tiles)
+
+    collage = Image.new('RGB', (columns * tile_width, rows * tile_height))
+    for index, tile in enumerate(tiles):
+        collage.paste(tile, ((index % columns) * tile_width, (index // columns) * tile_height))
+
+    result = BytesIO()
+    collage.save(result, format='JPEG', quality=85)
+    result.seek(0)
+
+    return result
+
+
+def map_image(filename):
+    """
+    Opens an image file for reading through a read-only memory map, so the file is read
+    by the kernel as it is sent rather than copied into memory first.
+
+    :param filename: The image file to open
+    :type filename: str
+    :return: An object with `read` and `close` methods
+    """
+
+    with open(filename, 'rb') as handle:
+        try:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files can not be mapped
+            return BytesIO(handle.read())
+
+
+def difference_hash(image, size=8):
+    """
+    A perceptual (difference) hash of an image: whether each pixel of a small grey
+    scale version of the image is brighter than the one to its right. Images that look
+    alike have hashes that differ in only a few bits.
+
+    JPEG images are decoded at a reduced size (Pillow's draft mode), which keeps this
+    to a few milliseconds even for large frames.
+
+    :param image: The JPEG image, as a file name or file-like object
+    :param size: The hash has `size` * `size` bits, at most 8
+    :type size: int
+    :return: The hash, or `None` if `Pillow` is not installed
+    :rtype: int
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        LOGGER.warning("Pillow is not installed, images can not be compared")
+        return None
+
+    import numpy
+
+    if not isinstance(image, str):
+        image.seek(0)
+
+    picture = Image.open(image)
+    picture.draft('L', (size * 8, size * 8))
+    pixels = numpy.asarray(picture.convert('L').resize((size + 1, size)), dtype=numpy.int16)
+
+    if not isinstance(image, str):
+        image.seek(0)
+
+    bits = numpy.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
@@ -0,0 +1,184 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Tells an operations channel when monitors change outside the bot's sight: a camera
+being disabled, its function changed, or monitors added, removed or renamed.
+
+The list of monitors is loaded once every `interval` seconds (from the session's
+cache when it is fresh) and compared with the previous snapshot. Only the
+differences are posted. The snapshot is kept in a state file, so changes made while
+the bot was not running are reported when it starts.
+"""
+
+import json
+import logging
+import os
+
+import zonebot
+from zonebot.tasks import BackgroundTask
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+LOGGER = logging.getLogger("zonebot")
+
+
+def snapshot(monitors):
+    """
+    :param monitors: The (loaded) monitors
+    :type monitors: zonebot.zoneminder.monitors.Monitors
+    :return: The name, function and state of each monitor, by ID
+    :rtype: dict
+    """
+
+    return dict((monitor.id, (monitor.name, monitor.function, monitor.enabled))
+                for monitor in monitors.select())
+
+
+def describe_changes(old, new):
+    """
+    Describes the differences between two snapshots.
+
+    :param old: The earlier snapshot, from `snapshot`
+    :type old: dict
+    :param new: The later snapshot
+    :type new: dict
+    :return: A line for each change, in monitor ID order
+    :rtype: list[str]
+    """
+
+    changes = []
+    for monitor_id in sorted(set(old) | set(new)):
+        if monitor_id not in new:
+            changes.append('Monitor {0} (ID: {1}) was removed'.format(old[monitor_id][0],
+                                                                     monitor_id))
+            continue
+
+        name, function, enabled = new[monitor_id]
+        if monitor_id not in old:
+            changes.append('Monitor {0} (ID: {1}) was added, {2} and {3}'.format(
+                name, monitor_id, function, 'enabled' if enabled else 'disabled'))
+            continue
+
+        old_name, old_function, old_enabled = old[monitor_id]
+        if old_name != name:
+            changes.append('Monitor {0} (ID: {1}) was renamed to {2}'.format(old_name,
+                                                                           monitor_id, name))
+        if old_enabled != enabled:
+            changes.append('Monitor {0} was {1}'.format(name,
+                                                        'enabled' if enabled else 'disabled'))
+        if old_function != function:
+            changes.append('Monitor {0} changed from {1} to {2}'.format(name, old_function,
+                                                                       function))
+
+    return changes
+
+
+class MonitorWatcher(BackgroundTask):
+    """
+    Posts the changes to the monitors every `interval` seconds.
+    """
+
+    def __init__(self, config, slack, zone_minder=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param slack: Where to post the changes, a :class:`zonebot.slackapi.SlackApi` or
+                      a client of the bot's outbound dispatcher
+        :param zone_minder: ZoneMinder connection to use, one is created if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        super(MonitorWatcher, self).__init__('monitor watcher',
+                                             config.getfloat('Monitor Changes', 'interval',
+                                                             fallback=60))
+
+        if not zone_minder:
+            zone_minder = ZoneMinder(config)
+            zone_minder.login()
+        self.zone_minder = zone_minder
+        self.slack = slack
+
+        channels = config.get('Slack', 'channels', fallback='')
+        self.channel = config.get('Monitor Changes', 'channel',
+                                  fallback=channels.split(',')[0].strip())
+
+        self.state_file = zonebot.state_path(config, 'monitors.state')
+        self.last = self._read_state()
+
+    def run_once(self):
+        """
+        Loads the monitors and posts any changes since the last run. The snapshot only
+        moves on once the changes have been posted, so they are tried again otherwise.
+        """
+
+        monitors = self.zone_minder.get_monitors()
+        monitors.load()
+        current = snapshot(monitors)
+
+        if self.last is None:
+            # First run ever, nothing to compare with
+            self.last = current
+            self._write_state()
+            return
+
+        changes = describe_changes(self.last, current)
+        if not changes:
+            return
+
+        LOGGER.info("Monitors changed: %s", '; '.join(changes))
+
+        result = self.slack.api_call('chat.postMessage',
+                                     channel=self.channel,
+                                     text='\n'.join(changes),
+                                     as_user=True)
+        if not result or not result.get('ok'):
+            LOGGER.error("Could not post monitor changes: %s",
+                         result.get('error') if result else 'no answer')
+            return
+
+        self.last = current
+        self._write_state()
+
+    def _read_state(self):
+        """
+        :return: The saved snapshot, or `None` if there is not one
+        :rtype: dict
+        """
+
+        if not os.path.isfile(self.state_file):
+            return None
+
+        try:
+            with open(self.state_file, 'r') as handle:
+                state = json.load(handle)
+        except ValueError:
+            LOGGER.warning("Ignoring unreadable monitor state in %s", self.state_file)
+            return None
+
+        return dict((int(k), tuple(v)) for k, v in state.items())
+
+    def _write_state(self):
+        """
+        Saves the snapshot. The file is replaced in one step, so a crash can never leave
+        it half written.
+        """
+
+        temporary = self.state_file + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(dict((str(k), list(v)) for k, v in self.last.items()), handle)
+
+        os.replace(temporary, self.state_file)
@@ -0,0 +1,333 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A single queue for everything the bot sends to Slack, so that security alerts are
+never stuck behind chat replies or bulk messages (or the other way round).
+
+Calls are sent in priority order: alerts, then replies to commands, then bulk
+messages. Each class has its own limit on the number of calls in progress. With more
+workers than replies and bulk messages may use together, there is always a worker
+free for an alert. Alerts also skip the client side rate limit (Slack's own
+`Retry-After` is still honoured). How long calls wait in the queue is
+measured for each class.
+"""
+
+import base64
+import heapq
+import itertools
+import logging
+import threading
+import time
+from io import BytesIO
+
+import zonebot
+import zonebot.pending
+
+LOGGER = logging.getLogger("zonebot")
+
+ALERT = 'alert'
+REPLY = 'reply'
+BULK = 'bulk'
+
+_PRIORITIES = {ALERT: 0, REPLY: 1, BULK: 2}
+
+# The answer to calls that could not be made before the dispatcher stopped
+_STOPPED = {'ok': False, 'error': 'shutting_down'}
+
+
+class _Call(object):
+    """
+    A queued call and, once made, its result.
+    """
+
+    def __init__(self, priority, method, kwargs):
+        self.priority = priority
+        self.method = method
+        self.kwargs = kwargs
+        self.queued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def saved(self):
+        """
+        :return: The call, as something that can be saved as JSON
+        :rtype: dict
+        """
+
+        kwargs = dict(self.kwargs)
+        saved = {'priority': self.priority, 'method': self.method, 'kwargs': kwargs}
+
+        if 'file' in kwargs:
+            content = kwargs.pop('file')
+            if hasattr(content, 'read'):
+                content = content.read()
+            saved['file'] = base64.b64encode(content).decode('ascii')
+
+        return saved
+
+    @classmethod
+    def restore(cls, saved):
+        """
+        :param saved: A call returned by `saved`
+        :type saved: dict
+        :rtype: _Call
+        """
+
+        kwargs = saved['kwargs']
+        if 'file' in saved:
+            kwargs['file'] = BytesIO(base64.b64decode(saved['file']))
+
+        return cls(saved['priority'], saved['method'], kwargs)
+
+
+class Dispatcher(object):
+    """
+    Sends Slack API calls from a priority queue, with worker threads.
+    """
+
+    def __init__(self, api, workers=4, limits=None, slow_seconds=5, pending_path=None):
+        """
+        :param api: The Slack client that makes the calls
+        :type api: zonebot.slackapi.SlackApi
+        :param workers: The most calls in progress at once
+        :type workers: int
+        :param limits: The most calls of each class in progress at once
+        :type limits: dict
+        :param slow_seconds: Calls that wait longer than this in the queue are logged
+        :type slow_seconds: float
+        :param pending_path: File calls not made when the dispatcher stops are saved
+                             to, and made from when it next starts
+        :type pending_path: str
+        """
+
+        self.api = api
+        self.limits = dict({ALERT: workers, REPLY: 2, BULK: 1}, **(limits or {}))
+        self.slow_seconds = slow_seconds
+        self.pending_path = pending_path
+
+        self._queue = []
+        self._order = itertools.count()
+        self._active = dict((x, 0) for x in _PRIORITIES)
+        self._ages = dict((x, {'count': 0, 'total': 0.0, 'max': 0.0}) for x in _PRIORITIES)
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._stopped = False
+
+        self._workers = []
+        for index in range(workers):
+            worker = threading.Thread(target=self._work, name='slack sender {0}'.format(index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        # Calls saved when last stopped. Nobody is waiting for their results.
+        for saved in zonebot.pending.take(pending_path):
+            self._put(_Call.restore(saved))
+
+    @classmethod
+    def from_config(cls, config, api):
+        """
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :param api: The Slack client that makes the calls
+        :type api: zonebot.slackapi.SlackApi
+        :rtype: Dispatcher
+        """
+
+        limits = dict((x, config.getint('Outbound', '{0} workers'.format(x), fallback=None))
+                      for x in _PRIORITIES)
+
+        return cls(api, workers=config.getint('Outbound', 'workers', fallback=4),
+                   limits=dict((k, v) for k, v in limits.items() if v),
+                   pending_path=zonebot.state_path(config, 'outbound.pending'))
+
+    def client(self, priority):
+        """
+        A Slack client (anything with an `api_call` method) whose calls are queued
+        with the given priority.
+
+        :param priority: One of `ALERT`, `REPLY` or `BULK`
+        :type priority: str
+        :rtype: PriorityClient
+        """
+
+        return PriorityClient(self, priority)
+
+    def api_call(self, priority, method, **kwargs):
+        """
+        Queues a call and waits for it to be made.
+
+        :param priority: One of `ALERT`, `REPLY` or `BULK`
+        :type priority: str
+        :param method: The method to call, such as 'chat.postMessage'
+        :type method: str
+        :return: The response from Slack
+        :rtype: dict
+        """
+
+        call = _Call(priority, method, kwargs)
+        if not self._put(call):
+            LOGGER.warning("Not sending %s call %s, shutting down", priority, method)
+            return dict(_STOPPED)
+
+        call.done.wait()
+        if call.error:
+            raise call.error
+
+        return call.result
+
+    def queue_ages(self):
+        """
+        :return: For each class, the number of calls made and the mean and longest time
+                 (in seconds) they waited in the queue
+        :rtype: dict
+        """
+
+        with self._condition:
+            return dict((x, {'count': y['count'],
+                             'mean': y['total'] / y['count'] if y['count'] else 0.0,
+                             'max': y['max']}) for x, y in self._ages.items())
+
+    def pending(self):
+        """
+        :return: The number of calls queued or in progress
+        :rtype: int
+        """
+
+        with self._condition:
+            return len(self._queue) + sum(self._active.values())
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers once the queue is empty, or the timeout has passed. Callers
+        waiting for calls not made by then are answered with an error. Replies and bulk
+        messages are also saved, to be made when the dispatcher is next started.
+        Alerts are not: the alert code keeps its own record of alerts not yet posted
+        (the coalescing spool, the poller's and watcher's state) and posts them again,
+        so saving them here too would post them twice.
+
+        :param timeout: The most seconds to wait, or `None` to wait for every call
+        :type timeout: float
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+        with self._condition:
+            left = [x[2] for x in sorted(self._queue)]
+            self._queue = []
+            self._stopped = True
+            self._condition.notify_all()
+
+        if left:
+            LOGGER.warning("%d Slack call(s) not made before stopping", len(left))
+            if self.pending_path:
+                zonebot.pending.save(self.pending_path,
+                                     [x.saved() for x in left if ALERT != x.priority])
+
+        for call in left:
+            call.result = dict(_STOPPED)
+            call.done.set()
+
+    def _put(self, call):
+        """
+        Queues a call.
+
+        :return: `False` if the dispatcher has stopped
+        :rtype: bool
+        """
+
+        with self._condition:
+            if self._stopped:
+                return False
+
+            heapq.heappush(self._queue, (_PRIORITIES[call.priority], next(self._order), call))
+            self._condition.notify_all()
+
+        return True
+
+    def _next(self):
+        """
+        Waits for the most important call whose class is below its limit.
+
+        :return: The call, or `None` when stopping
+        :rtype: _Call
+        """
+
+        with self._condition:
+            while True:
+                for entry in sorted(self._queue):
+                    call = entry[2]
+                    if self._active[call.priority] < self.limits[call.priority]:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._active[call.priority] += 1
+                        return call
+
+                if self._stopping and not self._queue:
+                    return None
+
+                self._condition.wait()
+
+    def _work(self):
+        while True:
+            call = self._next()
+            if not call:
+                return
+
+            age = time.monotonic() - call.queued
+            if age > self.slow_seconds:
+                LOGGER.warning("%s call %s waited %.1f seconds to be sent", call.priority,
+                               call.method, age)
+
+            try:
+                call.result = self.api.call(call.method, ALERT == call.priority,
+                                            **call.kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._condition:
+                    self._active[call.priority] -= 1
+                    ages = self._ages[call.priority]
+                    ages['count'] += 1
+                    ages['total'] += age
+                    ages['max'] = max(ages['max'], age)
+                    self._condition.notify_all()
+
+                call.done.set()
+
+
+class PriorityClient(object):
+    """
+    The `api_call` interface of a Slack client, for calls of one priority class.
+    """
+
+    def __init__(self, dispatcher, priority):
+        self.dispatcher = dispatcher
+        self.priority = priority
+
+    def api_call(self, method, **kwargs):
+        return self.dispatcher.api_call(self.priority, method, **kwargs)
@@ -0,0 +1,78 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Work left unfinished when the bot is stopped, kept in the state directory until the
+bot starts again.
+"""
+
+import json
+import logging
+import os
+
+LOGGER = logging.getLogger("zonebot")
+
+
+def save(path, items):
+    """
+    Replaces the work saved in a file. The file is removed if there is no work.
+
+    :param path: The file to save to
+    :type path: str
+    :param items: The work, anything that can be saved as JSON
+    :type items: list
+    """
+
+    if not items:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as handle:
+        json.dump(items, handle)
+    os.replace(temporary, path)
+
+    LOGGER.info("Saved %d unfinished item(s) to %s", len(items), path)
+
+
+def take(path):
+    """
+    Reads, and removes, the work saved in a file.
+
+    :param path: The file saved to
+    :type path: str
+    :return: The work, an empty list if there is none
+    :rtype: list
+    """
+
+    if not path or not os.path.exists(path):
+        return []
+
+    try:
+        with open(path) as handle:
+            items = json.load(handle)
+    except ValueError as e:
+        LOGGER.warning("Ignoring unreadable unfinished work in %s: %s", path, str(e))
+        items = []
+
+    os.remove(path)
+
+    if items:
+        LOGGER.info("Resuming %d unfinished item(s) from %s", len(items), path)
+    return items
@@ -0,0 +1,225 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Polls the ZoneMinder API for new events and posts them to Slack from within the bot
+process. Unlike the ZoneMinder filter and the event watcher, this works when the bot
+is not running on the ZoneMinder host.
+
+The ID of the newest event seen (the high-water mark) is kept in a state file so that
+no events are missed, or posted twice, across restarts.
+"""
+
+import json
+import logging
+import os
+import time
+
+import zonebot
+from zonebot.alerts import AlertPipeline
+from zonebot.tasks import BackgroundTask
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+LOGGER = logging.getLogger("zonebot")
+
+
+class EventPoller(BackgroundTask):
+    """
+    Asks ZoneMinder for events newer than the last one seen, every `interval` seconds.
+    """
+
+    def __init__(self, config, handler=None, zone_minder=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param handler: Called with the `Event` dictionary of each new event, oldest
+                        first, and returns `True` once it has been handled. Defaults to
+                        posting the event with :class:`zonebot.alerts.AlertPipeline`
+        :param zone_minder: ZoneMinder connection to use, one is created if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        super(EventPoller, self).__init__('event poller',
+                                          config.getfloat('Poller', 'interval', fallback=10))
+
+        if not zone_minder:
+            zone_minder = ZoneMinder(config)
+            zone_minder.login()
+        self.zone_minder = zone_minder
+
+        if not handler:
+            pipeline = AlertPipeline(config, zone_minder=zone_minder, background=True)
+            handler = pipeline.send_event_summary
+        self.handler = handler
+
+        self.page_size = config.getint('Poller', 'page size', fallback=100)
+        self.max_open = config.getfloat('Poller', 'max open seconds', fallback=600)
+        self.max_attempts = config.getint('Poller', 'max attempts', fallback=5)
+        self.state_file = zonebot.state_path(config, 'poller.state')
+
+        # Events after the high-water mark that have already been handled
+        self.done = set()
+
+        # When each open (still recording) event was first seen, and how often each
+        # failed event has been tried
+        self.held = {}
+        self.attempts = {}
+
+        self.last_id = self._read_state()
+
+    def run_once(self):
+        """
+        Handles every closed event newer than the high-water mark, then saves the new
+        mark. Events still being recorded are held back until they close (or have been
+        open for `max open seconds`), and events that could not be handled are tried
+        again on the next run. The mark only moves past an event once it is handled.
+        """
+
+        if self.last_id is None:
+            # First run ever. Start from now rather than posting every old event.
+            self.last_id = self.zone_minder.latest_event_id()
+            self._write_state()
+            LOGGER.info("Polling for events after %d", self.last_id)
+            return
+
+        start_id = self.last_id
+        start_done = len(self.done)
+        waiting = set()
+        newest = self.last_id
+        now = time.time()
+
+        try:
+            for event in self.zone_minder.iter_events(self.last_id, page_size=self.page_size):
+                if self.stopping:
+                    break
+
+                event_id = int(event['Id'])
+                newest = max(newest, event_id)
+                if event_id in self.done:
+                    continue
+
+                if not event.get('EndTime'):
+                    first_seen = self.held.setdefault(event_id, now)
+                    if now - first_seen < self.max_open:
+                        waiting.add(event_id)
+                        continue
+                    LOGGER.warning("Event %d is still open after %d seconds, sending it now",
+                                   event_id, self.max_open)
+
+                # The handler either raises or returns a false value (as the alert
+                # pipeline does when Slack refuses the upload) on failure
+                try:
+                    error = None if self.handler(event) else 'the alert was not posted'
+                except Exception as e:
+                    error = str(e)
+
+                if error:
+                    self.attempts[event_id] = self.attempts.get(event_id, 0) + 1
+                    if self.attempts[event_id] < self.max_attempts:
+                        LOGGER.warning("Could not handle event %d, will try again: %s",
+                                       event_id, error)
+                        waiting.add(event_id)
+                        # ZoneMinder or Slack is likely down, try the rest later as well
+                        break
+
+                    LOGGER.error("Could not handle event %d, giving up: %s", event_id, error)
+
+                self.done.add(event_id)
+                self.held.pop(event_id, None)
+                self.attempts.pop(event_id, None)
+        finally:
+            # Everything up to the oldest event still waiting is finished with
+            if waiting:
+                self.last_id = min(waiting) - 1
+            elif not self.stopping:
+                self.last_id = newest
+            else:
+                while self.last_id + 1 in self.done:
+                    self.last_id += 1
+
+            self.done = set(x for x in self.done if x > self.last_id)
+
+            if self.last_id != start_id or len(self.done) != start_done:
+                LOGGER.debug("Handled events up to %d", self.last_id)
+                self._write_state()
+
+    def _read_state(self):
+        """
+        :return: The saved high-water mark, or `None` if there is not one
+        :rtype: int
+        """
+
+        if not os.path.isfile(self.state_file):
+            return None
+
+        with open(self.state_file, 'r') as handle:
+            text = handle.read().strip()
+
+        if text.isdigit():
+            # Just the mark, as saved by earlier versions
+            return int(text)
+
+        try:
+            state = json.loads(text)
+        except ValueError:
+            LOGGER.warning("Ignoring unreadable poller state in %s", self.state_file)
+            return None
+
+        self.done = set(state.get('done', []))
+        return state.get('last_id')
+
+    def _write_state(self):
+        """
+        Saves the high-water mark and the events handled after it. The file is replaced
+        in one step, so a crash can never leave it half written.
+        """
+
+        temporary = self.state_file + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'last_id': self.last_id, 'done': sorted(self.done)}, handle)
+
+        os.replace(temporary, self.state_file)
+
+
+class EventIndexer(BackgroundTask):
+    """
+    Keeps the local event index (see :class:`zonebot.zoneminder.index.EventIndex`) up to
+    date, so the `events` commands never have to wait for ZoneMinder.
+    """
+
+    def __init__(self, config, zone_minder=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param zone_minder: ZoneMinder connection to use, one is created if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        super(EventIndexer, self).__init__('event indexer',
+                                           config.getfloat('Events', 'refresh interval',
+                                                           fallback=0))
+
+        if not zone_minder:
+            zone_minder = ZoneMinder(config)
+            zone_minder.login()
+        self.zone_minder = zone_minder
+
+        self.page_size = config.getint('Poller', 'page size', fallback=100)
+
+    def run_once(self):
+        self.zone_minder.get_event_index().refresh(self.zone_minder, page_size=self.page_size)
@@ -0,0 +1,337 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Receives chat messages from the Slack Events API, as an alternative to the Real Time
+Messaging (websocket) connection.
+
+Slack posts each event to a small HTTP server run by the bot. The server checks the
+request signature, acknowledges the event straight away (Slack wants an answer within
+3 seconds) and queues it for worker threads, which run the command.
+"""
+
+import asyncio
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+
+import zonebot
+import zonebot.pending
+
+LOGGER = logging.getLogger("zonebot")
+
+# Requests signed longer ago than this are rejected, as possible replays
+_MAX_CLOCK_SKEW = 300
+
+# Largest request body accepted
+_MAX_BODY = 1024 * 1024
+
+# Number of event IDs remembered to drop Slack's retries of events already queued
+_SEEN_EVENTS = 1000
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+def signature(signing_secret, timestamp, body):
+    """
+    The signature Slack sends with a request, in the `X-Slack-Signature` header.
+
+    :param signing_secret: The app's signing secret
+    :type signing_secret: str
+    :param timestamp: The `X-Slack-Request-Timestamp` header
+    :type timestamp: str
+    :param body: The request body
+    :type body: bytes
+    :rtype: str
+    """
+
+    base = b'v0:' + timestamp.encode('utf-8') + b':' + body
+    return 'v0=' + hmac.new(signing_secret.encode('utf-8'), base, hashlib.sha256).hexdigest()
+
+
+class EventReceiver(object):
+    """
+    An asyncio HTTP server for Slack Events API callbacks.
+    """
+
+    def __init__(self, signing_secret, handler, address='', port=3000, workers=4,
+                 max_queue=10000, pending_path=None):
+        """
+        :param signing_secret: The app's signing secret, to check requests come from Slack
+        :type signing_secret: str
+        :param handler: Called, from a worker thread, with the `event` of each callback
+        :param address: Address to listen on, all addresses when empty
+        :type address: str
+        :param port: Port to listen on, 0 for any free port
+        :type port: int
+        :param workers: Number of threads handling events
+        :type workers: int
+        :param max_queue: Events queued before Slack is asked to send them again later
+        :type max_queue: int
+        :param pending_path: File events not handled when the receiver stops are saved
+                             to, and handled from when it next starts
+        :type pending_path: str
+        """
+
+        self.signing_secret = signing_secret
+        self.handler = handler
+        self.address = address
+        self.port = port
+        self.workers = workers
+        self.pending_path = pending_path
+
+        self.ready = threading.Event()
+        self._stop_requested = threading.Event()
+        self._closing = threading.Event()
+        self._abandon = threading.Event()
+        self._timeout = None
+
+        self._queue = queue.Queue(max_queue)
+        self._seen = collections.OrderedDict()
+        self._loop = None
+        self._stopped = None
+
+    @classmethod
+    def from_config(cls, config, handler):
+        """
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :param handler: Called with the `event` of each callback
+        :rtype: EventReceiver
+        """
+
+        return cls(config.get('Receiver', 'signing secret'),
+                   handler,
+                   address=config.get('Receiver', 'address', fallback=''),
+                   port=config.getint('Receiver', 'port', fallback=3000),
+                   workers=config.getint('Receiver', 'workers', fallback=4),
+                   pending_path=zonebot.state_path(config, 'receiver.pending'))
+
+    def serve_forever(self):
+        """
+        Runs the server, and the workers, until `stop` is called.
+        """
+
+        for event in zonebot.pending.take(self.pending_path):
+            self._queue.put(event)
+
+        threads = [threading.Thread(target=self._work, name='event worker {0}'.format(x))
+                   for x in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            asyncio.run(self._serve())
+        finally:
+            # Finish the events already acknowledged, for as long as allowed
+            self._closing.set()
+            deadline = None if self._timeout is None else time.monotonic() + self._timeout
+            for thread in threads:
+                thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+            self._abandon.set()
+            left = []
+            while not self._queue.empty():
+                left.append(self._queue.get_nowait())
+
+            if left:
+                LOGGER.warning("%d Slack event(s) not handled before stopping", len(left))
+                if self.pending_path:
+                    zonebot.pending.save(self.pending_path, left)
+
+    def stop(self, timeout=None):
+        """
+        Stops accepting events. Can be called from any thread, or a signal handler.
+        `serve_forever` returns once the events already queued have been handled, or
+        the timeout has passed.
+
+        :param timeout: The most seconds to wait for queued events, `None` for no limit
+        :type timeout: float
+        """
+
+        if self._stop_requested.is_set():
+            # Only the first call decides how long to wait
+            return
+
+        self._timeout = timeout
+        self._stop_requested.set()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def pending(self):
+        """
+        :return: The number of events waiting for a worker
+        :rtype: int
+        """
+
+        return self._queue.qsize()
+
+    def verify(self, headers, body, now=None):
+        """
+        Checks a request was signed, recently, with the signing secret.
+
+        :param headers: The request headers, with lower case names
+        :type headers: dict
+        :param body: The request body
+        :type body: bytes
+        :param now: The current time, for testing
+        :type now: float
+        :rtype: bool
+        """
+
+        timestamp = headers.get('x-slack-request-timestamp', '')
+        try:
+            if abs((now or time.time()) - int(timestamp)) > _MAX_CLOCK_SKEW:
+                return False
+        except ValueError:
+            return False
+
+        expected = signature(self.signing_secret, timestamp, body)
+        return hmac.compare_digest(expected, headers.get('x-slack-signature', ''))
+
+    def handle_request(self, method, headers, body):
+        """
+        Answers one request. This runs on the event loop, so must not block.
+
+        :param method: The HTTP method
+        :type method: str
+        :param headers: The request headers, with lower case names
+        :type headers: dict
+        :param body: The request body
+        :type body: bytes
+        :return: The status code and the response body
+        :rtype: tuple
+        """
+
+        if 'POST' != method:
+            return 405, b''
+
+        if not self.verify(headers, body):
+            LOGGER.warning("Rejected a Slack event with a bad or old signature")
+            return 401, b''
+
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return 400, b''
+
+        if 'url_verification' == payload.get('type'):
+            return 200, json.dumps({'challenge': payload.get('challenge')}).encode('utf-8')
+
+        if 'event_callback' != payload.get('type'):
+            return 200, b''
+
+        event_id = payload.get('event_id')
+        if event_id in self._seen:
+            # Slack did not see our answer in time and sent it again
+            return 200, b''
+
+        try:
+            self._queue.put_nowait(payload.get('event', {}))
+        except queue.Full:
+            LOGGER.warning("Too many Slack events queued, asking Slack to send %s later",
+                           event_id)
+            return 503, b''
+
+        if event_id:
+            self._seen[event_id] = True
+            if len(self._seen) > _SEEN_EVENTS:
+                self._seen.popitem(last=False)
+
+        return 200, b''
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self._stop_requested.is_set():
+            # Stopped before the loop was running
+            self._stopped.set()
+
+        server = await asyncio.start_server(self._connection, self.address or None, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+
+        LOGGER.info("Listening for Slack events on port %d", self.port)
+        self.ready.set()
+
+        async with server:
+            await self._stopped.wait()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+
+                method = request.decode('latin-1').split(' ')[0]
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > _MAX_BODY:
+                    writer.write(self._response(413, b'', False))
+                    break
+
+                body = await reader.readexactly(length)
+                status, content = self.handle_request(method, headers, body)
+
+                keep_alive = 'close' != headers.get('connection', '').lower()
+                writer.write(self._response(status, content, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _response(status, content, keep_alive):
+        head = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\n' \
+               'Content-Length: {2}\r\nConnection: {3}\r\n\r\n'.format(
+                   status, _REASONS[status], len(content), 'keep-alive' if keep_alive else 'close')
+
+        return head.encode('latin-1') + content
+
+    def _work(self):
+        while not self._abandon.is_set():
+            try:
+                event = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._closing.is_set():
+                    return
+                continue
+
+            try:
+                self.handler(event)
+            except Exception as e:
+                LOGGER.exception("Failed to handle Slack event: %s", str(e))
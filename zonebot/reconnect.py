@@ -0,0 +1,201 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Keeping the connection to Slack up.
+
+After a connection is lost the first attempt to reconnect is immediate, then the
+wait doubles after each failure, up to a limit, with random jitter so that many bots
+(or a bot and its supervisor) do not retry in step. Errors are sorted into ones
+worth retrying (the network, Slack being unavailable), fatal ones (the token was
+refused) and unexpected ones, which are retried a few times in a row before giving up.
+
+A connection only counts as recovered once it has stayed up for a while, so one that
+is made and then dropped straight away keeps backing off rather than starting again
+with immediate retries.
+"""
+
+import logging
+import random
+import time
+
+import websocket
+from slackclient._client import SlackNotConnected
+from slackclient._server import SlackConnectionError, SlackLoginError
+
+import zonebot.counters
+
+LOGGER = logging.getLogger("zonebot")
+
+RETRYABLE = 'retryable'
+FATAL = 'fatal'
+UNEXPECTED = 'unexpected'
+
+
+def classify(error):
+    """
+    :param error: An exception raised while connected, or connecting, to Slack
+    :type error: Exception
+    :return: One of `RETRYABLE`, `FATAL` or `UNEXPECTED`
+    :rtype: str
+    """
+
+    if isinstance(error, SlackLoginError):
+        return FATAL
+
+    # OSError includes connection, timeout and socket errors, and those from requests
+    if isinstance(error, (OSError, SlackConnectionError, SlackNotConnected,
+                          websocket.WebSocketException)):
+        return RETRYABLE
+
+    return UNEXPECTED
+
+
+class Backoff(object):
+    """
+    Exponential backoff, with full jitter, after a number of immediate retries.
+    """
+
+    def __init__(self, base=1.0, cap=60.0, immediate=1, rand=random.random):
+        """
+        :param base: The longest wait after the first delayed retry, in seconds
+        :type base: float
+        :param cap: The longest wait ever
+        :type cap: float
+        :param immediate: Number of retries made without waiting
+        :type immediate: int
+        :param rand: Source of random numbers in [0, 1), for testing
+        """
+
+        self.base = base
+        self.cap = cap
+        self.immediate = immediate
+        self.rand = rand
+        self.failures = 0
+
+    def delay(self):
+        """
+        :return: Seconds to wait before the next retry
+        :rtype: float
+        """
+
+        self.failures += 1
+        if self.failures <= self.immediate:
+            return 0.0
+
+        exponent = self.failures - self.immediate - 1
+        return self.rand() * min(self.cap, self.base * 2 ** min(exponent, 32))
+
+    def reset(self):
+        """
+        Starts again from immediate retries, after a success.
+        """
+
+        self.failures = 0
+
+
+class Reconnector(object):
+    """
+    Decides whether, and when, to reconnect after an error, and measures how long it
+    took to recover.
+    """
+
+    def __init__(self, config, sleep=time.sleep, rand=random.random, clock=time.monotonic):
+        """
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :param sleep: Waits a number of seconds, for testing
+        :param rand: Source of random numbers in [0, 1), for testing
+        :param clock: Returns the time in seconds, for testing
+        """
+
+        self.config = config
+        self.sleep = sleep
+        self.clock = clock
+        self.backoff = Backoff(
+            base=config.getfloat('Slack', 'reconnect base seconds', fallback=1),
+            cap=config.getfloat('Slack', 'reconnect max seconds', fallback=60),
+            immediate=config.getint('Slack', 'reconnect immediate', fallback=1),
+            rand=rand)
+        self.max_unexpected = config.getint('Slack', 'max unexpected errors', fallback=5)
+        self.stable_seconds = config.getfloat('Slack', 'reconnect stable seconds', fallback=30)
+
+        self.unexpected = 0
+        self.recoveries = []
+        self._down_since = None
+        self._up_since = None
+
+    def connected(self):
+        """
+        Called once a connection has been made.
+        """
+
+        now = self.clock()
+        if self._down_since is not None:
+            recovery = now - self._down_since
+            self.recoveries.append(recovery)
+
+            LOGGER.info("Reconnected to Slack after %.1f seconds and %d attempt(s)",
+                        recovery, self.backoff.failures)
+            zonebot.counters.increment(self.config, 'slack reconnects')
+            zonebot.counters.increment(self.config, 'slack reconnect ms',
+                                       int(recovery * 1000))
+
+        self._down_since = None
+        self._up_since = now
+
+    def failed(self, error):
+        """
+        Called when the connection is lost or could not be made. Waits before the next
+        attempt, unless there should not be one.
+
+        :param error: The reason
+        :type error: Exception
+        :return: `True` to reconnect, `False` if the error is fatal
+        :rtype: bool
+        """
+
+        now = self.clock()
+        if self._up_since is not None:
+            if now - self._up_since >= self.stable_seconds:
+                self.unexpected = 0
+                self.backoff.reset()
+            self._up_since = None
+
+        kind = classify(error)
+        if FATAL == kind:
+            LOGGER.error("Can not connect to Slack: %s", repr(error))
+            return False
+
+        if UNEXPECTED == kind:
+            self.unexpected += 1
+            if self.unexpected > self.max_unexpected:
+                LOGGER.error("Giving up after %d unexpected errors in a row", self.unexpected)
+                return False
+            LOGGER.exception("Unexpected error, reconnecting: %s", repr(error))
+
+        if self._down_since is None:
+            self._down_since = now
+
+        delay = self.backoff.delay()
+        LOGGER.warning("Connection to Slack lost (%s), reconnecting in %.1f seconds",
+                       repr(error), delay)
+        if delay:
+            self.sleep(delay)
+
+        return True
@@ -0,0 +1,193 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Keeps a history of the ZoneMinder host's load average, daemon state and (optionally)
+event disk usage, so that the `status` command can show how they have changed
+without asking ZoneMinder.
+
+A sample is taken every `interval` seconds into ring buffers of `samples` values, a
+day's worth by default. The buffers are saved to a small binary file after each
+sample and loaded again when the bot starts.
+"""
+
+import array
+import logging
+import os
+import struct
+import threading
+import time
+
+import zonebot
+from zonebot.tasks import BackgroundTask
+from zonebot.timeseries import RingBuffer, window_summary
+from zonebot.zoneminder.zoneminder import ZoneMinder
+
+LOGGER = logging.getLogger("zonebot")
+
+# File header: magic, number of values per buffer, values taken, next slot
+_MAGIC = b'ZBS1'
+_HEADER = struct.Struct('<4sIII')
+
+# The running sampler, for the `status` command
+_current = None
+
+
+def current():
+    """
+    :return: The status sampler running in this process, or `None`
+    :rtype: StatusSampler
+    """
+
+    return _current
+
+
+class StatusSampler(BackgroundTask):
+    """
+    Samples the ZoneMinder host every `interval` seconds.
+    """
+
+    def __init__(self, config, zone_minder=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param zone_minder: ZoneMinder connection to use, one is created if not provided
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        """
+
+        super(StatusSampler, self).__init__('status sampler',
+                                            config.getfloat('Status', 'interval', fallback=60))
+
+        if not zone_minder:
+            zone_minder = ZoneMinder(config)
+            zone_minder.login()
+        self.zone_minder = zone_minder
+
+        self.size = max(1, config.getint('Status', 'samples', fallback=1440))
+        self.disk = config.getboolean('Status', 'disk usage', fallback=False)
+        self.state_file = zonebot.state_path(config, 'status.samples')
+
+        self.times = RingBuffer(self.size, 'd')
+        self.load = RingBuffer(self.size)
+        self.running = RingBuffer(self.size)
+        self.disk_usage = RingBuffer(self.size)
+
+        # The answer to the latest `get_status`, as shown by the `status` command
+        self.latest = None
+        self._lock = threading.Lock()
+
+        self._read_state()
+
+    @property
+    def _rings(self):
+        return [self.times, self.load, self.running, self.disk_usage]
+
+    def start(self):
+        global _current
+        _current = self
+
+        super(StatusSampler, self).start()
+
+    def run_once(self):
+        """
+        Takes a sample and saves the buffers.
+        """
+
+        status = self.zone_minder.get_status()
+
+        disk = float('nan')
+        if self.disk:
+            try:
+                disk = self.zone_minder.get_disk_usage()
+            except Exception as e:
+                LOGGER.warning("Could not obtain the disk usage: %s", str(e))
+
+        load = status.get('load values')
+        running = status.get('running')
+
+        with self._lock:
+            self.latest = status
+            self.times.append(time.time())
+            self.load.append(load[0] if load else float('nan'))
+            self.running.append(float('nan') if running is None else float(running))
+            self.disk_usage.append(disk)
+
+            self._write_state()
+
+    def summary(self, seconds, now=None):
+        """
+        Summarizes the samples taken over a period, see
+        :func:`zonebot.timeseries.window_summary`.
+
+        :param seconds: The length of the period, ending now
+        :type seconds: float
+        :param now: The current time, for testing
+        :type now: float
+        :return: A summary of the 'load', 'running' (1 for running, 0 for not) and
+                 'disk' samples, each `None` if there were none
+        :rtype: dict
+        """
+
+        since = (time.time() if now is None else now) - seconds
+
+        with self._lock:
+            times = self.times.values()
+            return {'load': window_summary(times, self.load.values(), since),
+                    'running': window_summary(times, self.running.values(), since),
+                    'disk': window_summary(times, self.disk_usage.values(), since)}
+
+    def _read_state(self):
+        """
+        Loads the saved buffers, if they were saved with the same number of samples.
+        """
+
+        if not os.path.isfile(self.state_file):
+            return
+
+        try:
+            with open(self.state_file, 'rb') as handle:
+                magic, size, count, next_slot = _HEADER.unpack(handle.read(_HEADER.size))
+                if magic != _MAGIC or size != self.size:
+                    LOGGER.warning("Ignoring status samples in %s, saved with a different size",
+                                   self.state_file)
+                    return
+
+                loaded = []
+                for ring in self._rings:
+                    data = array.array(ring.data.typecode)
+                    data.fromfile(handle, size)
+                    loaded.append(data)
+        except (EOFError, struct.error, OSError) as e:
+            LOGGER.warning("Ignoring unreadable status samples in %s: %s", self.state_file, str(e))
+            return
+
+        for ring, data in zip(self._rings, loaded):
+            ring.data, ring.count, ring.next = data, count, next_slot
+
+    def _write_state(self):
+        """
+        Saves the buffers. The file is replaced in one step, so a crash can never leave
+        it half written.
+        """
+
+        temporary = self.state_file + '.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(_HEADER.pack(_MAGIC, self.size, self.times.count, self.times.next))
+            for ring in self._rings:
+                ring.data.tofile(handle)
+
+        os.replace(temporary, self.state_file)
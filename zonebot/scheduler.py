@@ -0,0 +1,317 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Commands run at set times, such as ``schedule disable monitor kitchen at 08:00
+weekdays``.
+
+Schedules are saved in a state file and run by a single background task. The task
+keeps the next run of every schedule in a heap and sleeps until the earliest one is
+due, so it does not look at each schedule in turn. A scheduled command goes through
+the bot's normal command path, with the permissions of the user who scheduled it.
+Runs missed while the bot was not running are skipped.
+"""
+
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import zonebot
+from zonebot.tasks import BackgroundTask
+
+LOGGER = logging.getLogger("zonebot")
+
+_DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+_FULL_DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+_DAY_SETS = {
+    'daily': list(range(7)),
+    'weekdays': list(range(5)),
+    'weekends': [5, 6]
+}
+
+# Longest sleep, so that clock changes are noticed
+_MAX_SLEEP = 15 * 60
+
+# The running scheduler, for the schedule commands
+_current = None
+
+
+def current():
+    """
+    :return: The scheduler running in this process, or `None`
+    :rtype: Scheduler
+    """
+
+    return _current
+
+
+def parse_days(words):
+    """
+    :param words: 'daily', 'weekdays', 'weekends' or day names ('mon', 'tuesday' ...).
+                  No words at all is every day.
+    :type words: list[str]
+    :return: The days of the week (0 is Monday), or `None` if a word is not a day
+    :rtype: list[int]
+    """
+
+    days = set()
+    for word in [x.strip().lower() for x in words if x.strip()]:
+        if word in _DAY_SETS:
+            days.update(_DAY_SETS[word])
+            continue
+
+        matches = [day for day, name in enumerate(_FULL_DAY_NAMES)
+                   if len(word) >= 3 and name.startswith(word)]
+        if not matches:
+            return None
+        days.update(matches)
+
+    return sorted(days) if days else list(range(7))
+
+
+def describe_days(days):
+    """
+    :param days: Days of the week, 0 is Monday
+    :type days: list[int]
+    :return: The days, as text
+    :rtype: str
+    """
+
+    for name, day_set in sorted(_DAY_SETS.items()):
+        if list(days) == day_set:
+            return name
+
+    return ' '.join(_DAY_NAMES[x] for x in days)
+
+
+class Schedule(object):
+    """
+    A command, and when to run it.
+    """
+
+    def __init__(self, schedule_id, user, channel, command, hour, minute, days):
+        """
+        :param schedule_id: Number of the schedule
+        :type schedule_id: int
+        :param user: Name (not ID) of the user who scheduled the command
+        :type user: str
+        :param channel: The channel replies go to
+        :type channel: str
+        :param command: The command, as it would be typed
+        :type command: str
+        :param hour: Hour of the day (local time)
+        :type hour: int
+        :param minute: Minute of the hour
+        :type minute: int
+        :param days: Days of the week, 0 is Monday
+        :type days: list[int]
+        """
+
+        self.id = schedule_id
+        self.user = user
+        self.channel = channel
+        self.command = command
+        self.hour = hour
+        self.minute = minute
+        self.days = days
+
+    def next_run(self, after):
+        """
+        :param after: The time after which to look
+        :type after: datetime.datetime
+        :return: The next time the command is due
+        :rtype: datetime.datetime
+        """
+
+        for offset in range(8):
+            day = after.date() + datetime.timedelta(days=offset)
+            when = datetime.datetime.combine(day, datetime.time(self.hour, self.minute))
+            if when > after and day.weekday() in self.days:
+                return when
+
+        # There is always at least one day
+        raise ValueError("No days in schedule {0}".format(self.id))
+
+    def describe(self):
+        """
+        :return: The schedule, as text
+        :rtype: str
+        """
+
+        return '{0}: _{1}_ at {2:02d}:{3:02d} {4}, for {5}'.format(
+            self.id, self.command, self.hour, self.minute, describe_days(self.days), self.user)
+
+    def saved(self):
+        return {'id': self.id, 'user': self.user, 'channel': self.channel,
+                'command': self.command, 'hour': self.hour, 'minute': self.minute,
+                'days': self.days}
+
+    @classmethod
+    def from_saved(cls, data):
+        return cls(data['id'], data['user'], data['channel'], data['command'],
+                   data['hour'], data['minute'], data['days'])
+
+
+class Scheduler(BackgroundTask):
+    """
+    Runs the scheduled commands when they are due.
+    """
+
+    def __init__(self, config, runner):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param runner: Runs a command, called with the name of the user, the command
+                       and the channel
+        """
+
+        super(Scheduler, self).__init__('scheduler', _MAX_SLEEP)
+
+        self.runner = runner
+        self.state_file = zonebot.state_path(config, 'schedules.json')
+
+        self.schedules = {}
+        self._lock = threading.Lock()
+
+        # (due time, sequence, schedule), the sequence keeps equal times in order
+        self._heap = []
+        self._sequence = itertools.count()
+
+        for schedule in self._read_state():
+            self.schedules[schedule.id] = schedule
+            self._push(schedule, datetime.datetime.now())
+
+    def start(self):
+        global _current
+        _current = self
+
+        super(Scheduler, self).start()
+
+    def add(self, user, channel, command, hour, minute, days):
+        """
+        Adds, and saves, a schedule.
+
+        :return: The new schedule
+        :rtype: Schedule
+        """
+
+        with self._lock:
+            schedule = Schedule(max(self.schedules or [0]) + 1, user, channel, command,
+                                hour, minute, days)
+            self.schedules[schedule.id] = schedule
+            self._push(schedule, datetime.datetime.now())
+            self._write_state()
+
+        # It may be due before whatever the task is waiting for
+        self.wake()
+        return schedule
+
+    def remove(self, schedule_id):
+        """
+        Removes, and saves, a schedule. Its entry in the heap is skipped when it comes up.
+
+        :param schedule_id: Number of the schedule
+        :type schedule_id: int
+        :return: The schedule, or `None` if there is no such schedule
+        :rtype: Schedule
+        """
+
+        with self._lock:
+            schedule = self.schedules.pop(schedule_id, None)
+            if schedule:
+                self._write_state()
+
+        return schedule
+
+    def list(self):
+        """
+        :return: Every schedule, by number
+        :rtype: list[Schedule]
+        """
+
+        with self._lock:
+            return [self.schedules[x] for x in sorted(self.schedules)]
+
+    def run_once(self):
+        """
+        Runs the commands that are due, then sleeps until the next one is.
+        """
+
+        due = []
+        with self._lock:
+            now = datetime.datetime.now()
+            while self._heap and self._heap[0][0] <= now.timestamp():
+                _, _, schedule = heapq.heappop(self._heap)
+                if self.schedules.get(schedule.id) is not schedule:
+                    # Removed since
+                    continue
+                due.append(schedule)
+                self._push(schedule, now)
+
+            wait = _MAX_SLEEP
+            if self._heap:
+                wait = min(_MAX_SLEEP, max(0, self._heap[0][0] - time.time()))
+            self.interval = wait
+
+        for schedule in due:
+            if self.stopping:
+                break
+
+            LOGGER.info("Running scheduled command '%s' for %s", schedule.command,
+                        schedule.user)
+            try:
+                self.runner(schedule.user, schedule.command, schedule.channel)
+            except Exception as e:
+                LOGGER.exception("Scheduled command '%s' failed: %s", schedule.command, str(e))
+
+    def _push(self, schedule, after):
+        heapq.heappush(self._heap, (schedule.next_run(after).timestamp(), next(self._sequence),
+                                    schedule))
+
+    def _read_state(self):
+        """
+        :return: The saved schedules
+        :rtype: list[Schedule]
+        """
+
+        if not os.path.isfile(self.state_file):
+            return []
+
+        try:
+            with open(self.state_file, 'r') as handle:
+                return [Schedule.from_saved(x) for x in json.load(handle)]
+        except (ValueError, KeyError, TypeError):
+            LOGGER.warning("Ignoring unreadable schedules in %s", self.state_file)
+            return []
+
+    def _write_state(self):
+        """
+        Saves the schedules. The file is replaced in one step, so a crash can never leave
+        it half written.
+        """
+
+        temporary = self.state_file + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump([self.schedules[x].saved() for x in sorted(self.schedules)], handle)
+
+        os.replace(temporary, self.state_file)
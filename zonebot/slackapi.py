@@ -0,0 +1,264 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A small Slack Web API client. It is a drop in replacement for `SlackClient.api_call`
+that keeps its HTTP connections open between calls and paces calls to stay within
+Slack's rate limits, so a busy moment is queued rather than refused.
+
+Slack groups its methods into tiers, each with its own rate limit. Calls to a tier
+wait for a token from that tier's bucket. If Slack still answers 429 (Too Many
+Requests) the call waits for as long as its `Retry-After` header asks, and is retried.
+"""
+
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LOGGER = logging.getLogger("zonebot")
+
+# Calls per second and burst size of each tier, see https://api.slack.com/docs/rate-limits
+_TIERS = {
+    1: (1 / 60.0, 1),
+    2: (20 / 60.0, 3),
+    3: (50 / 60.0, 5),
+    4: (100 / 60.0, 10),
+    # chat.postMessage: about one message a second for each channel
+    'post': (1.0, 3)
+}
+
+_METHOD_TIERS = {
+    'chat.postMessage': 'post',
+    'chat.update': 3,
+    'files.upload': 2,
+    'users.info': 4
+}
+
+
+class TokenBucket(object):
+    """
+    Hands out up to `rate` tokens a second, with bursts of up to `capacity` tokens.
+    Callers that find the bucket empty wait their turn.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added each second
+        :type rate: float
+        :param capacity: The most tokens the bucket holds
+        :type capacity: int
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, urgent=False):
+        """
+        Takes a token, possibly one that has not been added yet.
+
+        :param urgent: Use the token straight away, ahead of any callers already waiting
+        :type urgent: bool
+        :return: Seconds to wait before the token may be used
+        :rtype: float
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            self._tokens -= 1
+            wait = 0.0 if urgent else max(0.0, -self._tokens / self.rate)
+
+            return max(wait, self._paused_until - now)
+
+    def take(self, urgent=False):
+        """
+        Takes a token, waiting for one if needed.
+
+        :param urgent: Use the token straight away, ahead of any callers already waiting
+        :type urgent: bool
+        """
+
+        wait = self.reserve(urgent)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Hands out no tokens for `seconds` (Slack asked us to back off).
+        """
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class SlackApi(object):
+    """
+    Calls Slack Web API methods, over a pool of kept alive connections and within
+    Slack's rate limits.
+    """
+
+    def __init__(self, token, url='https://slack.com/api', max_retries=5, pool_size=10,
+                 timeout=30):
+        """
+        :param token: The bot's API token
+        :type token: str
+        :param url: The base URL of the API
+        :type url: str
+        :param max_retries: How often a call is retried after a 429 response
+        :type max_retries: int
+        :param pool_size: The most connections kept open to Slack
+        :type pool_size: int
+        :param timeout: Seconds to wait to connect, and then between bytes of the response
+        :type timeout: float
+        """
+
+        self.token = token
+        self.url = url
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: The configuration for the bot.
+        :type config: configparser.ConfigParser
+        :rtype: SlackApi
+        """
+
+        return cls(config['Slack']['api_token'],
+                   url=config.get('Slack', 'api url', fallback='https://slack.com/api'),
+                   timeout=config.getfloat('Slack', 'api timeout', fallback=30))
+
+    def api_call(self, method, **kwargs):
+        """
+        Calls a Web API method, the same as `SlackClient.api_call`.
+
+        :param method: The method to call, such as 'chat.postMessage'
+        :type method: str
+        :param kwargs: The arguments of the method. `file` is uploaded for
+                       'files.upload', anything but a string is sent as JSON.
+        :return: The response from Slack
+        :rtype: dict
+        """
+
+        return self.call(method, False, **kwargs)
+
+    def call(self, method, urgent, **kwargs):
+        """
+        Calls a Web API method.
+
+        :param method: The method to call, such as 'chat.postMessage'
+        :type method: str
+        :param urgent: Do not wait for the rate limit, only for Slack's own `Retry-After`.
+                       For the few calls (security alerts) that must not be held up.
+        :type urgent: bool
+        :param kwargs: The arguments of the method, as for :meth:`api_call`
+        :return: The response from Slack. If Slack could not be reached, or did not
+                 answer with JSON, a response with `ok` false and the reason as `error`.
+        :rtype: dict
+        """
+
+        files = None
+        if 'files.upload' == method and 'file' in kwargs:
+            files = {'file': kwargs.pop('file')}
+
+        data = {'token': self.token}
+        for key, value in kwargs.items():
+            data[key] = value if isinstance(value, str) else json.dumps(value)
+
+        bucket = self._bucket(method, kwargs.get('channel'))
+
+        for attempt in range(self.max_retries + 1):
+            bucket.take(urgent)
+
+            if files and attempt:
+                # Send the file again from the start
+                files['file'].seek(0)
+
+            try:
+                response = self.session.post('{0}/{1}'.format(self.url, method), data=data,
+                                             files=files, timeout=self.timeout)
+            except requests.RequestException as e:
+                LOGGER.warning("Could not call Slack %s: %s", method, str(e))
+                return {'ok': False, 'error': 'request_failed', 'detail': str(e)}
+
+            if 429 != response.status_code:
+                return self._result(method, response)
+
+            retry_after = float(response.headers.get('Retry-After', 1))
+            LOGGER.warning("Slack rate limited %s, retrying in %.0f seconds", method,
+                           retry_after)
+            bucket.pause(retry_after)
+
+        return {'ok': False, 'error': 'ratelimited'}
+
+    @staticmethod
+    def _result(method, response):
+        """
+        :return: The JSON body of a response, or an error if it does not have one (such
+                 as the HTML page of a 5xx error)
+        :rtype: dict
+        """
+
+        try:
+            result = json.loads(response.text)
+        except ValueError:
+            result = None
+
+        if 200 != response.status_code or not isinstance(result, dict):
+            LOGGER.warning("Slack answered %s with HTTP status %d", method,
+                           response.status_code)
+            if isinstance(result, dict) and 'error' in result:
+                return result
+            return {'ok': False, 'error': 'http_{0}'.format(response.status_code)}
+
+        return result
+
+    def _bucket(self, method, channel):
+        """
+        :return: The token bucket for calls to `method` (and, for messages, `channel`)
+        :rtype: TokenBucket
+        """
+
+        tier = _METHOD_TIERS.get(method, 3)
+        key = (tier, channel) if 'post' == tier else tier
+
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(*_TIERS[tier])
+
+            return self._buckets[key]
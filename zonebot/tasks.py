@@ -0,0 +1,107 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Work the bot does in the background, alongside listening for chat commands.
+"""
+
+import logging
+import threading
+
+LOGGER = logging.getLogger("zonebot")
+
+
+class BackgroundTask(threading.Thread):
+    """
+    A daemon thread that calls `run_once` every `interval` seconds until stopped.
+    Exceptions from `run_once` are logged and do not stop the task. `wake` runs it
+    again without waiting for the rest of the interval.
+    """
+
+    def __init__(self, name, interval):
+        """
+        :param name: Name of the task, used for the thread and in log messages
+        :type name: str
+        :param interval: Seconds to wait between each call to `run_once`
+        :type interval: float
+        """
+
+        super(BackgroundTask, self).__init__(name=name)
+        self.daemon = True
+        self.interval = interval
+
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+
+    def run(self):
+        LOGGER.info("Starting background task %s", self.name)
+
+        while not self._stopping.is_set():
+            # Cleared before the work, so that a wake during it is not lost
+            self._wakeup.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                LOGGER.exception("Background task %s failed: %s", self.name, str(e))
+
+            self._wakeup.wait(self.interval)
+
+        try:
+            self.cleanup()
+        except Exception as e:
+            LOGGER.exception("Background task %s failed to clean up: %s", self.name, str(e))
+
+        LOGGER.info("Background task %s stopped", self.name)
+
+    def run_once(self):
+        """
+        Does one round of work. Must be provided by subclasses.
+        """
+
+        raise NotImplementedError()
+
+    def cleanup(self):
+        """
+        Called once, from the task's thread, after it has stopped. Subclasses can override
+        this to release resources.
+        """
+
+        pass
+
+    def stop(self):
+        """
+        Asks the task to stop. It stops after the current `run_once` has finished.
+        """
+
+        self._stopping.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """
+        Calls `run_once` now, or as soon as the current call has finished.
+        """
+
+        self._wakeup.set()
+
+    @property
+    def stopping(self):
+        """
+        `True` once `stop` has been called.
+        """
+
+        return self._stopping.is_set()
@@ -0,0 +1,142 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Helpers for summarizing series of numbers (scores, load averages, etc) for chat messages.
+"""
+
+import array
+
+import numpy
+
+# Eight levels, lowest to highest
+_BARS = u'▁▂▃▄▅▆▇█'
+
+
+def sparkline(values, width=20, floor=None):
+    """
+    Renders a series of values as a compact line of bar characters. Series longer than
+    `width` are reduced by keeping the maximum of each bucket, so that short peaks are
+    not averaged away.
+
+    :param values: The values to render, oldest first
+    :type values: list|numpy.ndarray
+    :param width: The maximum number of characters in the result
+    :type width: int
+    :param floor: The value drawn as the lowest bar, defaults to the smallest value
+    :type floor: float
+    :return: The sparkline, or an empty string if there are no values
+    :rtype: str
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if values.size == 0:
+        return u''
+
+    if values.size > width:
+        edges = numpy.linspace(0, values.size, width + 1).astype(numpy.intp)[:-1]
+        values = numpy.maximum.reduceat(values, edges)
+
+    low = values.min() if floor is None else floor
+    spread = values.max() - low
+    if spread <= 0:
+        levels = numpy.zeros(values.size, dtype=numpy.intp)
+    else:
+        levels = numpy.rint((values - low) * (len(_BARS) - 1) / spread)
+        levels = numpy.clip(levels, 0, len(_BARS) - 1).astype(numpy.intp)
+
+    return u''.join(_BARS[level] for level in levels)
+
+
+def window_summary(times, values, since):
+    """
+    Summarizes the values of a series taken since a time. Missing values (`nan`) are
+    left out.
+
+    :param times: When each value was taken (seconds since the epoch), oldest first
+    :type times: numpy.ndarray
+    :param values: The values
+    :type values: numpy.ndarray
+    :param since: The earliest time included
+    :type since: float
+    :return: 'min', 'mean', 'max' and the 'values' themselves, or `None` if there are
+             no values in the window
+    :rtype: dict
+    """
+
+    selected = values[times >= since]
+    selected = selected[~numpy.isnan(selected)]
+    if selected.size == 0:
+        return None
+
+    return {'min': float(selected.min()),
+            'mean': float(selected.mean()),
+            'max': float(selected.max()),
+            'values': selected}
+
+
+class RingBuffer(object):
+    """
+    The last `size` values of a series, in a fixed-size `array` (4 byte floats by
+    default), overwriting the oldest value once full.
+    """
+
+    def __init__(self, size, typecode='f'):
+        """
+        :param size: The number of values kept
+        :type size: int
+        :param typecode: The `array` type code of the values
+        :type typecode: str
+        """
+
+        self.size = size
+        self.data = array.array(typecode, [0]) * size
+        self.count = 0
+        self.next = 0
+
+    def append(self, value):
+        """
+        :param value: The newest value
+        :type value: float
+        """
+
+        self.data[self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self, last=None):
+        """
+        :param last: Only the newest `last` values, all of them if `None`
+        :type last: int
+        :return: The values, oldest first
+        :rtype: numpy.ndarray
+        """
+
+        data = numpy.frombuffer(self.data, dtype=numpy.dtype(self.data.typecode))
+        if self.count < self.size:
+            values = data[:self.count].copy()
+        else:
+            values = numpy.concatenate((data[self.next:], data[:self.next]))
+
+        if last is not None:
+            values = values[max(0, values.size - last):]
+
+        return values
+
+    def __len__(self):
+        return self.count
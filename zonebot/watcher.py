@@ -0,0 +1,340 @@
+#! -*- coding: utf-8 -*-
+
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Watches the ZoneMinder events directory (with Linux inotify) for new events and posts
+them to Slack from within the bot process. This is an alternative to having a ZoneMinder
+filter run the `zonebot-alert` script, which only happens on the filter's own polling
+interval and starts a new process for every event.
+
+Only the current branch of the events tree is watched: ZoneMinder only ever creates new
+directories for the current time, so the watches on older directories are removed as
+soon as a newer sibling appears.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import re
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import zonebot
+import zonebot.pending
+from zonebot.alerts import AlertPipeline, parse_directory_name
+from zonebot.tasks import BackgroundTask
+
+LOGGER = logging.getLogger("zonebot")
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Depth, below the events directory, of the directory for a single event:
+#   monitor/yy/mm/dd/hh/mm/ss
+_EVENT_DEPTH = 7
+
+_CAPTURE_FILE = re.compile(r'^\d+-capture\.jpg$')
+
+
+class Inotify(object):
+    """
+    A minimal wrapper around the Linux inotify system calls.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not initialize inotify")
+
+    def add_watch(self, path, mask):
+        """
+        Starts watching a file or directory.
+
+        :return: The watch descriptor
+        :rtype: int
+        """
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "Could not watch " + path)
+
+        return wd
+
+    def rm_watch(self, wd):
+        """
+        Stops watching, errors (the watched directory was removed, etc) are ignored.
+        """
+
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        Waits up to `timeout` seconds for events.
+
+        :return: list of (watch descriptor, mask, name)
+        :rtype: list[tuple]
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class EventWatcher(BackgroundTask):
+    """
+    Watches for new event directories and hands each one to the alert pipeline once
+    the event has closed (no new frames for `idle seconds`) or has reached
+    `frame threshold` frames.
+    """
+
+    def __init__(self, config, handler=None):
+        """
+        :param config: Bot configuration
+        :type config: configparser.ConfigParser
+        :param handler: Called with the event directory of each event. Defaults to
+                        posting the event with :class:`zonebot.alerts.AlertPipeline`
+        """
+
+        super(EventWatcher, self).__init__('event watcher', 0)
+
+        self.events_dir = config.get('Watcher', 'events dir',
+                                     fallback='/var/cache/zoneminder/events')
+        self.idle_time = config.getfloat('Watcher', 'idle seconds', fallback=5)
+        self.frame_threshold = config.getint('Watcher', 'frame threshold', fallback=0)
+        self.check_interval = min(0.5, self.idle_time)
+
+        if not handler:
+            handler = AlertPipeline(config, background=True).send_event_dir
+        self.handler = handler
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.getint('Watcher', 'workers', fallback=4))
+
+        # Events still open when the bot stopped
+        self.pending_path = zonebot.state_path(config, 'watcher.pending')
+        self._unsent = []
+        self._lock = threading.Lock()
+
+        self._inotify = None
+        self._watches = {}
+        self._paths = {}
+        self._pending = {}
+
+        # Set once the initial watches are in place
+        self.ready = threading.Event()
+
+    def run_once(self):
+        if not self._inotify:
+            self._inotify = Inotify()
+            self._watch_branch(self.events_dir, 0, False)
+            for path in zonebot.pending.take(self.pending_path):
+                if os.path.isdir(path) and path not in self._paths:
+                    self._add_event(path)
+            self.ready.set()
+
+        for wd, mask, name in self._inotify.read(self.check_interval):
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.warning("Too many file system events, some events may be missed")
+                continue
+
+            if wd not in self._watches:
+                # Removed watches, etc.
+                continue
+
+            path, depth = self._watches[wd]
+
+            if depth < _EVENT_DEPTH and mask & IN_ISDIR:
+                if depth == 0 and not name.isdigit():
+                    # Only the monitor ID directories, not the name links
+                    continue
+
+                self._new_directory(os.path.join(path, name), depth + 1)
+
+            elif depth == _EVENT_DEPTH and path in self._pending:
+                pending = self._pending[path]
+                pending['last'] = time.time()
+                if _CAPTURE_FILE.match(name):
+                    pending['frames'].add(name)
+
+        self._check_pending()
+
+    def cleanup(self):
+        # Events being sent are finished, those still open, or that could not be sent,
+        # are picked up next time
+        self._executor.shutdown(wait=True)
+        zonebot.pending.save(self.pending_path, sorted(set(self._pending) | set(self._unsent)))
+        if self._inotify:
+            self._inotify.close()
+
+    def _new_directory(self, path, depth):
+        """
+        Handles a new directory. Everything older at the same level (within the same
+        monitor) is finished with and no longer watched.
+        """
+
+        if depth > 1:
+            parent = os.path.dirname(path)
+            for other in list(self._paths):
+                _, other_depth = self._watches[self._paths[other]]
+                if depth <= other_depth < _EVENT_DEPTH \
+                        and other.startswith(parent + os.sep) \
+                        and not (other == path or other.startswith(path + os.sep)):
+                    self._unwatch(other)
+
+        self._watch_branch(path, depth, True)
+
+    def _watch_branch(self, path, depth, new):
+        """
+        Watches a directory and the newest branch below it, down to the event directory.
+        ZoneMinder creates the whole path for an event at once, so the directories below
+        a new one may already exist by the time it is watched.
+        """
+
+        if path in self._paths:
+            return
+
+        if depth == _EVENT_DEPTH:
+            if new:
+                self._add_event(path)
+            return
+
+        try:
+            self._watch(path, depth, IN_CREATE | IN_MOVED_TO | IN_ONLYDIR)
+            children = [x for x in os.listdir(path)
+                        if os.path.isdir(os.path.join(path, x))
+                        and not os.path.islink(os.path.join(path, x))
+                        and x.isdigit()]
+        except OSError as e:
+            LOGGER.warning("Could not watch %s: %s", path, str(e))
+            return
+
+        if depth == 0:
+            # Every monitor
+            for child in children:
+                self._watch_branch(os.path.join(path, child), 1, new)
+        elif depth == _EVENT_DEPTH - 1 and new:
+            # Every event created in this new minute so far
+            for child in children:
+                self._watch_branch(os.path.join(path, child), depth + 1, new)
+        elif children:
+            self._watch_branch(os.path.join(path, max(children)), depth + 1, new)
+
+    def _add_event(self, path):
+        """
+        Starts tracking a new event.
+        """
+
+        now = time.time()
+
+        try:
+            self._watch(path, _EVENT_DEPTH, IN_CLOSE_WRITE | IN_MOVED_TO)
+            # A set of names, as frames written while the watch is added are both
+            # listed here and reported by inotify
+            frames = set(x for x in os.listdir(path) if _CAPTURE_FILE.match(x))
+        except OSError as e:
+            LOGGER.warning("Could not watch event %s: %s", path, str(e))
+            return
+
+        monitor, timestamp = parse_directory_name(path)
+        LOGGER.debug("New event at %s on monitor %s", timestamp, monitor)
+
+        self._pending[path] = {
+            'created': now,
+            'last': now,
+            'frames': frames
+        }
+
+    def _check_pending(self):
+        """
+        Sends every event that has closed or has enough frames.
+        """
+
+        now = time.time()
+
+        for path in list(self._pending):
+            pending = self._pending[path]
+
+            if (self.frame_threshold and len(pending['frames']) >= self.frame_threshold) \
+                    or now - pending['last'] >= self.idle_time:
+                del self._pending[path]
+                self._unwatch(path)
+
+                if pending['frames']:
+                    self._executor.submit(self._handle, path)
+
+    def _handle(self, path):
+        try:
+            if self.handler(path):
+                return
+        except Exception as e:
+            LOGGER.exception("Could not send alert for %s: %s", path, str(e))
+
+        if self.stopping:
+            # Most likely cut short by the shutdown, try again next time
+            with self._lock:
+                self._unsent.append(path)
+
+    def _watch(self, path, depth, mask):
+        wd = self._inotify.add_watch(path, mask)
+        self._watches[wd] = (path, depth)
+        self._paths[path] = wd
+
+    def _unwatch(self, path):
+        wd = self._paths.pop(path)
+        del self._watches[wd]
+        self._inotify.rm_watch(wd)
@@ -15,47 +15,21 @@
 #
 
 """
-Called by ZoneMinder whenever an alert is generated. It find the most important frame
- and posts it to Slack.
+Called by ZoneMinder whenever an alert is generated. It find the most important frame(s)
+ and posts them to Slack.
 """
 
 import argparse
 import logging
 import sys
-import os
 
 from configparser import ConfigParser
-from slackclient import SlackClient
 import zonebot
-from zonebot.zoneminder.zoneminder import ZoneMinder
+from zonebot.alerts import AlertPipeline
 
 LOGGER = logging.getLogger("zonebot")
 
 
-def _parse_directory_name(dirname):
-    elements = zonebot.split_os_path(dirname)
-
-    # Array will contain a variable number of leading elements
-    # but always ends with:
-    #   monitor/yy/mm/d/hh/mm/ss
-    # we split that to
-    #   monitor id
-    # and
-    #   yyyy-mm-dd hh:mm:ss
-
-    idx = -7
-    if elements[-1] == '':
-        # Just in case the path ends with a '/'
-        idx = -8
-
-    monitor = elements[idx]
-    timestamp = "20" + elements[idx + 1] + "-" + elements[idx + 2] + "-" + elements[idx + 3] + \
-                " " + \
-                elements[idx + 4] + ":" + elements[idx + 5] + ":" + elements[idx + 6]
-
-    return monitor, timestamp
-
-
 def zonebot_alert_main():
     """
     Main method for the zonebot-alert script
@@ -96,61 +70,9 @@ def zonebot_alert_main():
     # Reconfigure logging with config values
     zonebot.init_logging(config)
 
-    (monitor, timestamp) = _parse_directory_name(args.event_dir)
-    LOGGER.info("Sending alert about event at %s on monitor %s", timestamp, monitor)
-
-    zone_minder = ZoneMinder(config)
-    zone_minder.login()
-
-    data = zone_minder.load_event(monitor, timestamp)
-    data = zone_minder.parse_event(data)
-
-    if 'image_filename' not in data:
-        LOGGER.error("Could not which still frame to upload")
-
-    image_filename = os.path.join(args.event_dir, data['image_filename'])
-    if not os.path.isfile(image_filename):
-        LOGGER.error("Expect image still file %s could not be read", image_filename)
+    pipeline = AlertPipeline(config)
 
-    comment = 'Detected {0} on monitor {1}. {2}/index.php?view=event&eid={3}'.format(
-        data['cause'],
-        data['source'],
-        config['ZoneMinder']['url'],
-        data['id']
-    )
-
-    filename = '{0}_Event_{1}.jpeg'.format(data['source'], data['id'])
-
-    # And off it goes ...
-    slack = SlackClient(config['Slack']['api_token'])
-
-    result = slack.api_call('files.upload',
-                            initial_comment=comment,
-                            filename=filename,
-                            channels=config['Slack']['channels'],
-                            # Note: this is broken in slackclient 1.0.1 and earlier
-                            file=open(image_filename, 'rb'))
-
-    if not result:
-        LOGGER.error("Could not complete Slack API call")
+    if not pipeline.send_event_dir(args.event_dir):
         sys.exit(1)
 
-    if not result['ok']:
-        error = "Error: "
-        if 'error' in result:
-            error = result['error']
-        elif 'warning' in result:
-            error = result['warning']
-
-        LOGGER.error("Could not upload image: %s", error)
-        sys.exit(1)
-
-    if 'permalink_public' in result['file']:
-        link = result['file']['permalink_public']
-    elif 'permalink' in result['file']:
-        link = result['file']['permalink']
-    else:
-        link = 'unknown'
-
-    LOGGER.info('Image posted to %s as %s', config['Slack']['channels'], link)
     sys.exit(0)
@@ -0,0 +1,119 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Helpers for working with the individual frames that make up a ZoneMinder event.
+"""
+
+import heapq
+
+import numpy
+
+
+def capture_filename(frame_id):
+    """
+    The name of the file ZoneMinder stores the captured image for a frame in.
+
+    :param frame_id: The frame number within the event (`FrameId`, not `Id`)
+    :type frame_id: str|int
+    :return: the file name, relative to the event directory
+    :rtype: str
+    """
+
+    return str(frame_id).zfill(5) + '-capture.jpg'
+
+
+def select_key_frames(frames, count=1, spacing=0):
+    """
+    Selects up to `count` of the highest scoring frames from an event. Frames with no
+    score are never selected. When scores tie, the earlier frame wins.
+
+    Once a frame has been chosen, no other frame within `spacing` frames of it will be
+    chosen, so that a short spike in the score does not fill every slot with nearly
+    identical images.
+
+    :param frames: The `Frame` rows of an event, as returned by the ZoneMinder API
+    :type frames: list[dict]
+    :param count: The maximum number of frames to select
+    :type count: int
+    :param spacing: The minimum distance (in frames) between any two selected frames
+    :type spacing: int
+    :return: The selected frames, highest score first
+    :rtype: list[dict]
+    """
+
+    # The position is included so that ties are broken by order and the frame
+    # dictionaries themselves are never compared.
+    heap = [(-int(frame['Score']), position, frame)
+            for position, frame in enumerate(frames)
+            if int(frame['Score']) > 0]
+    heapq.heapify(heap)
+
+    selected = []
+    selected_ids = []
+
+    while heap and len(selected) < count:
+        _, _, frame = heapq.heappop(heap)
+        frame_id = int(frame['FrameId'])
+
+        if any(abs(frame_id - other) < spacing for other in selected_ids):
+            continue
+
+        selected.append(frame)
+        selected_ids.append(frame_id)
+
+    return selected
+
+
+def score_statistics(frames, threshold=0, length=None):
+    """
+    Summarizes the scores of all the frames in an event. The work is done with
+    vectorized NumPy operations so that long events (thousands of frames) cost
+    little more than short ones.
+
+    The time each frame covers is the difference between its `Delta` (seconds since
+    the start of the event) and that of the next frame. The last frame runs until the
+    end of the event.
+
+    :param frames: The `Frame` rows of an event, as returned by the ZoneMinder API
+    :type frames: list[dict]
+    :param threshold: Frames with a score above this are counted in 'above'
+    :type threshold: int
+    :param length: The length of the event, in seconds
+    :type length: float
+    :return: A dictionary with 'peak' (highest score), 'mean' (average score of the
+             frames that have one), 'above' (seconds with a score above the threshold)
+             and 'scores' (every score, in order). `None` if there are no frames.
+    :rtype: dict
+    """
+
+    if not frames:
+        return None
+
+    scores = numpy.array([frame['Score'] for frame in frames], dtype=numpy.float64)
+    deltas = numpy.array([frame.get('Delta', 0) for frame in frames], dtype=numpy.float64)
+
+    end = max(float(length or 0), deltas[-1])
+    durations = numpy.diff(numpy.append(deltas, end))
+
+    alarmed = scores > 0
+
+    return {
+        'peak': int(scores.max()),
+        'mean': float(scores[alarmed].mean()) if alarmed.any() else 0.0,
+        'above': float(durations[scores > threshold].sum()),
+        'scores': scores
+    }
@@ -0,0 +1,246 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+A local (SQLite) index of ZoneMinder event metadata, so that questions about past
+events can be answered without querying ZoneMinder each time.
+"""
+
+import logging
+import sqlite3
+from contextlib import contextmanager
+import threading
+import time
+
+LOGGER = logging.getLogger("zoneminder")
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    monitor_id INTEGER NOT NULL,
+    monitor TEXT COLLATE NOCASE,
+    start_time TEXT NOT NULL,
+    end_time TEXT,
+    length REAL,
+    cause TEXT,
+    max_score INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_monitor_time ON events (monitor, start_time);
+CREATE INDEX IF NOT EXISTS events_time ON events (start_time);
+CREATE INDEX IF NOT EXISTS events_score ON events (max_score);
+'''
+
+_COLUMNS = ['id', 'monitor_id', 'monitor', 'start_time', 'end_time', 'length', 'cause',
+            'max_score']
+
+
+class EventIndex(object):
+    """
+    The event index. Each method opens its own connection so the index can be used from
+    any thread.
+    """
+
+    def __init__(self, path, history=1000):
+        """
+        :param path: The SQLite database file, created if it does not exist
+        :type path: str
+        :param history: The number of past events to add to an empty index
+        :type history: int
+        """
+
+        self.path = path
+        self.history = history
+        self.last_refresh = 0
+
+        self._refresh_lock = threading.Lock()
+
+        with self._connect() as connection:
+            columns = [x[1] for x in connection.execute('PRAGMA table_info(events)')]
+            if columns and 'end_time' not in columns:
+                # Index created before end times were kept
+                connection.execute('ALTER TABLE events ADD COLUMN end_time TEXT')
+
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """
+        A connection that commits (or rolls back) and is closed when done with.
+        """
+
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def last_id(self):
+        """
+        :return: The ID of the newest event in the index, 0 if it is empty
+        :rtype: int
+        """
+
+        with self._connect() as connection:
+            row = connection.execute('SELECT MAX(id) FROM events').fetchone()
+
+        return row[0] or 0
+
+    def add(self, events, monitor_names):
+        """
+        Adds (or updates) events in the index.
+
+        :param events: The `Event` dictionaries from the ZoneMinder API
+        :type events: list[dict]
+        :param monitor_names: Monitor name by monitor ID
+        :type monitor_names: dict
+        :return: The number of events added
+        :rtype: int
+        """
+
+        rows = [(int(event['Id']),
+                 int(event['MonitorId']),
+                 monitor_names.get(str(event['MonitorId'])),
+                 event['StartTime'],
+                 event.get('EndTime'),
+                 float(event.get('Length') or 0),
+                 event.get('Cause'),
+                 int(event.get('MaxScore') or 0)) for event in events]
+
+        with self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO events ({0}) VALUES ({1})'
+                                   .format(', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+                                   rows)
+
+        return len(rows)
+
+    def refresh(self, zone_minder, page_size=100):
+        """
+        Adds every event newer than those already in the index, fetched from ZoneMinder
+        a page at a time. Events that were still being recorded when they were added
+        (with no end time yet) are fetched again, so their length and score are kept
+        up to date. An empty index is filled with the last `history` events only.
+
+        :param zone_minder: The (logged in) ZoneMinder connection to use
+        :type zone_minder: zonebot.zoneminder.zoneminder.ZoneMinder
+        :param page_size: The number of events to fetch, and add, at a time
+        :type page_size: int
+        :return: The number of events added (or updated)
+        :rtype: int
+        """
+
+        with self._refresh_lock:
+            monitors = zone_minder.get_monitors()
+            monitors.load()
+            names = dict((str(monitor.id), monitor.name)
+                         for monitor in monitors.monitors.values())
+
+            start = self._refresh_start()
+            if start is None:
+                start = max(0, zone_minder.latest_event_id() - self.history)
+
+            added = 0
+            batch = []
+            for event in zone_minder.iter_events(start, page_size=page_size):
+                batch.append(event)
+                if len(batch) >= page_size:
+                    added += self.add(batch, names)
+                    batch = []
+
+            if batch:
+                added += self.add(batch, names)
+
+            self.last_refresh = time.time()
+
+        if added:
+            LOGGER.debug("Added %d events to the event index", added)
+
+        return added
+
+    def _refresh_start(self):
+        """
+        :return: The ID after which to fetch events, `None` if the index is empty
+        :rtype: int
+        """
+
+        with self._connect() as connection:
+            # Events still open a day after the newest one started were never closed
+            # (ZoneMinder was restarted, etc) and are not waited for.
+            row = connection.execute(
+                "SELECT MIN(id), (SELECT MAX(id) FROM events) FROM events "
+                "WHERE end_time IS NULL "
+                "AND start_time >= (SELECT datetime(MAX(start_time), '-1 day') FROM events)"
+            ).fetchone()
+
+        if row[0] is not None:
+            return row[0] - 1
+
+        return row[1]
+
+    def recent(self, monitor=None, since=None, limit=10):
+        """
+        The most recent events, newest first.
+
+        :param monitor: Only events from this monitor (name, not case sensitive)
+        :type monitor: str
+        :param since: Only events that started at or after this time ('yyyy-mm-dd hh:mm:ss')
+        :type since: str
+        :param limit: The maximum number of events to return
+        :type limit: int
+        :return: The events, as dictionaries
+        :rtype: list[dict]
+        """
+
+        return self._query('start_time DESC', monitor, since, limit)
+
+    def top(self, monitor=None, since=None, limit=10):
+        """
+        The events with the highest score, highest first.
+
+        :param monitor: Only events from this monitor (name, not case sensitive)
+        :type monitor: str
+        :param since: Only events that started at or after this time ('yyyy-mm-dd hh:mm:ss')
+        :type since: str
+        :param limit: The maximum number of events to return
+        :type limit: int
+        :return: The events, as dictionaries
+        :rtype: list[dict]
+        """
+
+        return self._query('max_score DESC, start_time DESC', monitor, since, limit)
+
+    def _query(self, order, monitor, since, limit):
+        clauses = []
+        params = []
+
+        if monitor:
+            clauses.append('monitor = ?')
+            params.append(monitor)
+
+        if since:
+            clauses.append('start_time >= ?')
+            params.append(since)
+
+        sql = 'SELECT {0} FROM events'.format(', '.join(_COLUMNS))
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY {0} LIMIT ?'.format(order)
+        params.append(limit)
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        return [dict(zip(_COLUMNS, row)) for row in rows]
@@ -0,0 +1,166 @@
+#
+# Copyright 2016 Robert Clark (clark@exiter.com)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+"""
+Reads events straight from the ZoneMinder events directory, for when the bot runs on
+the same host as ZoneMinder. This avoids the API calls otherwise needed to find out
+about an event.
+
+The directory layout is the ZoneMinder "deep storage" one:
+
+    events/
+        Front Door -> 3            (symlink from monitor name to monitor ID)
+        3/
+            16/10/01/
+                .1234 -> 14/05/59  (symlink from event ID to event directory)
+                14/05/59/
+                    .1234          (event ID marker, in some ZoneMinder versions)
+                    00001-capture.jpg
+                    00001-analyse.jpg  (only for alarmed frames)
+                    ...
+"""
+
+import logging
+import os
+import re
+
+LOGGER = logging.getLogger("zoneminder")
+
+_ID_FILE = re.compile(r'^\.(\d+)$')
+_FRAME_FILE = re.compile(r'^(\d+)-(capture|analyse)\.jpg$')
+
+
+def load_local_event(event_dir, monitor_id):
+    """
+    Reads an event from its directory. The result has the same layout as
+    :meth:`zonebot.zoneminder.zoneminder.ZoneMinder.load_event` so that it can be passed
+    to `parse_event`, with these differences:
+
+     * the score of each frame is not stored on disk. Frames that have an analysis
+       image (i.e. alarmed frames) are given a score of 1 and all others 0.
+     * the cause of the event is not stored on disk and is `None`
+     * the monitor name is `None` if it can not be found from the events directory
+     * `data['local']` is `True`
+
+    :param event_dir: The directory in which the event files are stored
+    :type event_dir: str
+    :param monitor_id: ID of the monitor that created the event
+    :type monitor_id: str
+    :return: The event data or `None` if the directory does not contain enough information
+    :rtype: dict
+    """
+
+    try:
+        names = os.listdir(event_dir)
+    except OSError as e:
+        LOGGER.warning("Could not read event directory %s: %s", event_dir, str(e))
+        return None
+
+    event_id = _find_event_id(event_dir, names)
+    if not event_id:
+        LOGGER.debug("No event ID found in %s", event_dir)
+        return None
+
+    captures = {}
+    alarmed = set()
+    for name in names:
+        match = _FRAME_FILE.match(name)
+        if not match:
+            continue
+
+        if 'capture' == match.group(2):
+            captures[int(match.group(1))] = name
+        else:
+            alarmed.add(int(match.group(1)))
+
+    if not captures:
+        LOGGER.debug("No captured frames found in %s", event_dir)
+        return None
+
+    frame_ids = sorted(captures)
+    times = [os.path.getmtime(os.path.join(event_dir, captures[x])) for x in frame_ids]
+
+    frames = [{
+        'Id': str(frame_id),
+        'FrameId': str(frame_id),
+        'Delta': '{0:.2f}'.format(times[index] - times[0]),
+        'Score': '1' if frame_id in alarmed else '0'
+    } for index, frame_id in enumerate(frame_ids)]
+
+    return {
+        'local': True,
+        'event': {
+            'Monitor': {
+                'Id': monitor_id,
+                'Name': _find_monitor_name(event_dir, monitor_id)
+            },
+            'Event': {
+                'Id': event_id,
+                'Name': 'Event-' + event_id,
+                'Cause': None,
+                'Length': '{0:.2f}'.format(times[-1] - times[0])
+            },
+            'Frame': frames
+        }
+    }
+
+
+def _find_event_id(event_dir, names):
+    """
+    Finds the ID of the event stored in a directory, either from the marker file inside
+    the directory or from the symlink in the directory for the day.
+    """
+
+    for name in names:
+        match = _ID_FILE.match(name)
+        if match:
+            return match.group(1)
+
+    day_dir = os.path.normpath(os.path.join(event_dir, '..', '..', '..'))
+    real_event_dir = os.path.realpath(event_dir)
+
+    try:
+        day_names = os.listdir(day_dir)
+    except OSError:
+        return None
+
+    for name in day_names:
+        match = _ID_FILE.match(name)
+        if match and os.path.realpath(os.path.join(day_dir, name)) == real_event_dir:
+            return match.group(1)
+
+    return None
+
+
+def _find_monitor_name(event_dir, monitor_id):
+    """
+    Finds the name of a monitor from the name -> ID symlinks in the top of the events
+    directory.
+    """
+
+    events_root = os.path.normpath(os.path.join(event_dir, *(['..'] * 7)))
+
+    try:
+        names = os.listdir(events_root)
+    except OSError:
+        return None
+
+    for name in names:
+        path = os.path.join(events_root, name)
+        if os.path.islink(path) and os.path.basename(os.readlink(path)) == str(monitor_id):
+            return name
+
+    return None
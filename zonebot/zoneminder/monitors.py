@@ -20,17 +20,80 @@ The monitors attached to a ZoneMinder system
 
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 LOGGER = logging.getLogger("zoneminder")
 
 
+class Monitor(object):
+    """
+    The parts of a ZoneMinder monitor that zonebot uses, converted from the strings
+    in the API.
+    """
+
+    __slots__ = ('id', 'name', 'function', 'enabled', 'capture_fps')
+
+    # ZoneMinder field names, as used by `Monitors.get_value`, and the matching attribute
+    FIELDS = {'Id': 'id', 'Name': 'name', 'Function': 'function', 'Enabled': 'enabled'}
+
+    def __init__(self, monitor_id, name, function, enabled, capture_fps=None):
+        """
+        :param monitor_id: The ID of the monitor
+        :type monitor_id: int
+        :param name: The name of the monitor
+        :type name: str
+        :param function: What the monitor does ('Modect', 'Record', 'None' ...)
+        :type function: str
+        :param enabled: Whether the monitor is enabled
+        :type enabled: bool
+        :param capture_fps: Frames captured per second, if ZoneMinder says
+        :type capture_fps: float
+        """
+
+        self.id = monitor_id
+        self.name = name
+        self.function = function
+        self.enabled = enabled
+        self.capture_fps = capture_fps
+
+    @classmethod
+    def from_json(cls, data, status=None):
+        """
+        :param data: A `Monitor` from the ZoneMinder API
+        :type data: dict
+        :param status: Its `Monitor_Status`, sent by ZoneMinder 1.32 and later
+        :type status: dict
+        :rtype: Monitor
+        """
+
+        capture_fps = None
+        if status and status.get('CaptureFPS') is not None:
+            try:
+                capture_fps = float(status['CaptureFPS'])
+            except ValueError:
+                pass
+
+        return cls(int(data['Id']),
+                   data['Name'],
+                   data.get('Function') or 'None',
+                   '1' == str(data.get('Enabled')),
+                   capture_fps)
+
+    def __repr__(self):
+        return 'Monitor({0}, {1!r}, {2!r}, {3})'.format(self.id, self.name,
+                                                       self.function, self.enabled)
+
+
 class Monitors(object):
     """
     Manages the monitors associated with a ZoneMinder system. This assumes that a session
     has already been created and a login successfully completed.
+
+    The monitors are kept in `monitors`, keyed by lower case name, and indexed by ID
+    and by function and state.
     """
 
-    def __init__(self, session, url):
+    def __init__(self, session, url, workers=4):
         """
         Initializes the list of monitors.
 
@@ -38,11 +101,16 @@ class Monitors(object):
         :type session: requests.session
         :param url: base URL for the ZoneMinder system
         :type url: str
+        :param workers: The most monitors changed at the same time by `set_states`
+        :type workers: int
         """
 
         self.session = session
         self.url = url
+        self.workers = max(1, workers)
         self.monitors = {}
+        self.by_id = {}
+        self.by_state = {}
 
     def load(self):
         """
@@ -56,31 +124,96 @@ class Monitors(object):
             raise Exception("Could not obtain list of monitors. " +
                             "Response code " + str(monitor_data.status_code))
 
-        monitor_list = json.loads(monitor_data.text)
+        monitor_list = monitor_data.json()
         if 'monitors' not in monitor_list:
             raise Exception("Could not obtain list of monitors. Unknown error")
 
-        self.monitors = {}
+        self.update([Monitor.from_json(x['Monitor'], x.get('Monitor_Status'))
+                     for x in monitor_list['monitors']])
+
+    def update(self, monitors):
+        """
+        Replaces the monitors, and rebuilds the indexes.
+
+        :param monitors: The monitors
+        :type monitors: list[Monitor]
+        """
+
+        by_name = {}
+        by_id = {}
+        by_state = {}
+        for monitor in monitors:
+            by_name[monitor.name.lower()] = monitor
+            by_id[monitor.id] = monitor
+            by_state.setdefault((monitor.function, monitor.enabled), []).append(monitor)
+
+        # Swapped in whole, so other threads see either the old or the new monitors
+        self.monitors, self.by_id, self.by_state = by_name, by_id, by_state
+
+    def get(self, monitor_name):
+        """
+        :param monitor_name: The name of the monitor to look for (case-insensitive)
+        :type monitor_name: str
+        :return: The monitor or None if there is no monitor with that name
+        :rtype: Monitor
+        """
+
+        if not monitor_name:
+            return None
+
+        return self.monitors.get(monitor_name.lower())
+
+    def get_by_id(self, monitor_id):
+        """
+        :param monitor_id: The ID of the monitor, as a number or a string
+        :type monitor_id: int
+        :return: The monitor or None if there is no monitor with that ID
+        :rtype: Monitor
+        """
+
+        try:
+            return self.by_id.get(int(monitor_id))
+        except (TypeError, ValueError):
+            return None
+
+    def select(self, function=None, enabled=None):
+        """
+        Lists the monitors with a function and/or state.
+
+        :param function: Only monitors with this function ('Modect', 'Record' ...), or
+                         None for any
+        :type function: str
+        :param enabled: Only enabled (True) or disabled (False) monitors, or None for any
+        :type enabled: bool
+        :return: The monitors, in ID order
+        :rtype: list[Monitor]
+        """
+
+        found = []
+        for (monitor_function, monitor_enabled), monitors in self.by_state.items():
+            if function is not None and function.lower() != monitor_function.lower():
+                continue
+            if enabled is not None and enabled != monitor_enabled:
+                continue
+            found.extend(monitors)
 
-        for monitor in monitor_list['monitors']:
-            m = monitor['Monitor']
-            self.monitors[m['Name'].lower()] = m
+        return sorted(found, key=lambda x: x.id)
 
     def get_value(self, monitor_name, value_name):
         """
         Returns the named value from the named monitor. Assumes `load` has already been called.
 
         :param monitor_name: The name (not ID) of the monitor
-        :param value_name: The value to get from the monitor
+        :param value_name: The value to get from the monitor ('Id', 'Name', 'Function'
+                           or 'Enabled')
         :return: The named value or None
-        :rtype: str
         """
 
-        monitor = self.__get_monitor(monitor_name)
+        monitor = self.get(monitor_name)
         if not monitor:
             return None
 
-        return monitor[value_name]
+        return getattr(monitor, Monitor.FIELDS[value_name])
 
     def is_enabled(self, monitor_name):
         """
@@ -93,7 +226,8 @@ class Monitors(object):
         :rtype: bool
         """
 
-        return '1' == self.get_value(monitor_name, 'Enabled')
+        monitor = self.get(monitor_name)
+        return monitor is not None and monitor.enabled
 
     def set_state(self, monitor_name, state):
         """
@@ -105,50 +239,91 @@ class Monitors(object):
         :return: Message describing the status of the operation
         """
 
-        # Load to get the initial state and list
-        self.load()
-
-        monitor = self.__get_monitor(monitor_name)
-        if not monitor:
+        if not monitor_name:
             return 'not found'
 
-        url = '{0}/api/monitors/{1}.json'.format(self.url, monitor['Id'])
+        return self.set_states([monitor_name], state)[monitor_name.lower()]
 
-        params = {
-            'Monitor[Enabled]': '1' if state else '0'
-        }
+    def set_states(self, monitor_names, state):
+        """
+        Enables or disables several monitors. The list is loaded once, the monitors not
+        already in the state are changed (`workers` at a time) and the list is loaded
+        once more to check the result.
 
-        result = self.session.post(url=url, data=params)
-        if result.status_code != 200:
-            return "not changed. Response code " + str(result.status_code)
+        :param monitor_names: The names of the monitors (case-insensitive), or None for
+                              every monitor
+        :type monitor_names: list[str]
+        :param state: True if enabled, False if disabled
+        :type state: bool
+        :return: Message describing what happened to each monitor, by lower case name
+        :rtype: dict
+        """
 
-        result = json.loads(result.text)
-        if result['message'] != 'Saved':
-            return "not changed: {0}".format(result['Message'])
+        # Load to get the initial state and list
+        self.load()
+        if monitor_names is None:
+            monitor_names = [x.name for x in self.select()]
+
+        results = {}
+        changing = []
+        for name in [x.lower() for x in monitor_names]:
+            monitor = self.get(name)
+            if not monitor:
+                results[name] = 'not found'
+            elif monitor.enabled == state:
+                results[name] = 'already ' + ('enabled' if state else 'disabled')
+            elif monitor not in changing:
+                changing.append(monitor)
+
+        if not changing:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(changing))) as executor:
+            errors = list(executor.map(lambda x: self.__post_state(x, state), changing))
 
         # Reload to get the new monitor state
         self.load()
-        enabled = self.get_value(monitor_name, 'Enabled')
-        if enabled is None:
-            return 'no longer available'
+        for monitor, error in zip(changing, errors):
+            name = monitor.name.lower()
+            if error:
+                results[name] = error
+                continue
 
-        return 'changed to ' + ('enabled' if enabled == '1' else 'disabled')
+            monitor = self.get(name)
+            if monitor is None:
+                results[name] = 'no longer available'
+            else:
+                results[name] = 'changed to ' + ('enabled' if monitor.enabled else 'disabled')
 
-    def __get_monitor(self, monitor_name):
-        """
-        Gets the monitor with the provided name.
+        return results
 
-        :param monitor_name: The name of the monitor to look for (case-insensitive)
-        :type monitor_name: str
-        :return: The named monitor `json` object or None if the monitor was not found
+    def __post_state(self, monitor, state):
+        """
+        :param monitor: The monitor to change
+        :type monitor: Monitor
+        :param state: True if enabled, False if disabled
+        :type state: bool
+        :return: Why the monitor was not changed, or None if it was
+        :rtype: str
         """
 
-        if not monitor_name:
-            return None
+        url = '{0}/api/monitors/{1}.json'.format(self.url, monitor.id)
 
-        name = monitor_name.lower()
+        params = {
+            'Monitor[Enabled]': '1' if state else '0'
+        }
 
-        if name not in self.monitors:
-            return None
+        try:
+            result = self.session.post(url=url, data=params)
+        except Exception as e:
+            LOGGER.error("Could not change monitor %s: %s", monitor.name, str(e))
+            return "not changed: {0}".format(str(e))
+
+        if result.status_code != 200:
+            return "not changed. Response code " + str(result.status_code)
+
+        result = json.loads(result.text)
+        if result.get('message') != 'Saved':
+            return "not changed: {0}".format(result.get('message'))
 
-        return self.monitors[name]
+        return None
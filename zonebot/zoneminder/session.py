@@ -16,27 +16,120 @@
 
 """
 Wraps a Python `requests.session` and imposes a timeout on it.
+
+Answers to GET requests for mostly static endpoints (the version, the list of
+monitors) are cached. A cached answer is used as is for the endpoint's time to live,
+and after that revalidated with `If-None-Match`/`If-Modified-Since` if ZoneMinder
+sent an `ETag` or `Last-Modified` header, or fetched again if it did not. The parsed
+JSON is kept with the answer, so a cache hit or a 304 does not parse it again.
 """
 
+import json
 import logging
+import re
+import threading
 import time
+from collections import OrderedDict
+
 import requests
 
 LOGGER = logging.getLogger("zoneminder")
 
+# Seconds an answer is used for without asking ZoneMinder, by the end of the URL
+DEFAULT_TTLS = {
+    'getVersion.json': 3600,
+    'monitors.json': 5
+}
+
+# The most answers kept
+_MAX_ENTRIES = 128
+
+
+def cache_ttls(config):
+    """
+    Reads the time to live of cached answers from the ``cache seconds`` option of the
+    ``[ZoneMinder]`` section, a comma separated list of ``end of URL: seconds``.
+
+    :param config: The configuration for the bot.
+    :type config: configparser.ConfigParser
+    :return: Seconds by the end of the URL
+    :rtype: dict
+    """
+
+    ttls = dict(DEFAULT_TTLS)
+
+    text = config.get('ZoneMinder', 'cache seconds', fallback='')
+    for item in [x.strip() for x in text.split(',') if x.strip()]:
+        match = re.match(r'^(\S+)\s*:\s*(\d+(\.\d*)?)$', item)
+        if not match:
+            LOGGER.error("Ignoring cache seconds '%s', expected 'end of URL: seconds'", item)
+            continue
+        ttls[match.group(1)] = float(match.group(2))
+
+    return ttls
+
+
+class CachedResponse(object):
+    """
+    The parts of a `requests.Response` kept in the cache. `json` parses the body once.
+    """
+
+    def __init__(self, response):
+        """
+        :param response: A successful response
+        :type response: requests.Response
+        """
+
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.text = response.text
+        self.url = response.url
+
+        self._json = None
+        self._parsed = False
+
+    def json(self):
+        """
+        :return: The body, parsed as JSON
+        """
+
+        if not self._parsed:
+            self._json = json.loads(self.text)
+            self._parsed = True
+
+        return self._json
+
+
+class _Entry(object):
+    """
+    A cached answer and when it has to be revalidated.
+    """
+
+    __slots__ = ('response', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, response, etag, last_modified, expires):
+        self.response = response
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
 
 class Session(object):
     """
     Make sure that we have a hard timeout on sessions and can force a re-login when needed.
     """
 
-    def __init__(self, username, password, url, timeout=30*60):
+    def __init__(self, username, password, url, timeout=30*60, ttls=None):
         """
 
         :param username: User name to use when login in
         :param password:  Password to user (cached)
         :param url: Base URL for logins
         :param timeout: When a session times out and a login is force. Defaults to 30 minutes.
+        :param ttls: Seconds answers are cached for, by the end of the URL. Defaults to
+                     `DEFAULT_TTLS`
+        :type ttls: dict
         """
 
         self.__username = username
@@ -47,14 +140,26 @@ class Session(object):
         self.session = None
         self.last_login = 0
 
+        # Sessions are shared by threads (the event watcher's workers, etc), only one of
+        # them may log in at a time
+        self._login_lock = threading.RLock()
+
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
     def login(self):
         """
         Creates a new session by logging into the ZoneMinder system
         """
 
+        with self._login_lock:
+            self._login()
+
+    def _login(self):
         LOGGER.info("Logging into %s", self.__url)
 
-        self.session = requests.Session()
+        session = requests.Session()
 
         params = {
             "username": self.__username,
@@ -66,27 +171,99 @@ class Session(object):
         # If successful, a cookie will be added to the session (called ZMSESSID)
         # which we can use for a limited time to provide to the server that we have
         # already logged in.
-        login_request = self.session.post(self.__url + '/', data=params)
+        login_request = session.post(self.__url + '/', data=params)
 
         if login_request.status_code != 200:
             raise Exception("Could not log into %s response code %d" %
                             (self.__url, login_request.status_code))
 
+        # Only replaced once logged in, so other threads never see a new session
+        # without the login cookie
+        self.session = session
         self.last_login = time.time()
 
     def get(self, url, **kwargs):
         """Sends a GET request. Returns :class:`Response` object.
 
+        Answers from endpoints with a time to live, or with an `ETag` or `Last-Modified`
+        header, are cached, see the module description. Those are returned as a
+        :class:`CachedResponse`.
+
         :param url: URL for the new :class:`Request` object.
         :param \*\*kwargs: Optional arguments that ``request`` takes.
         :rtype: requests.Response
         """
 
-        if self._login_expired():
-            self.login()
+        if kwargs.get('stream'):
+            return self._get(url, **kwargs)
+
+        key = (url, tuple(sorted((kwargs.get('params') or {}).items())))
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry:
+                self._cache.move_to_end(key)
+
+        now = time.monotonic()
+        if entry and now < entry.expires:
+            return entry.response
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+        result = self._get(url, headers=headers, **kwargs)
+
+        if entry and result.status_code == 304:
+            entry.expires = now + self._ttl(url)
+            return entry.response
+
+        if result.status_code != 200:
+            return result
+
+        etag = result.headers.get('ETag')
+        last_modified = result.headers.get('Last-Modified')
+        ttl = self._ttl(url)
+        if not ttl and not etag and not last_modified:
+            return result
+
+        response = CachedResponse(result)
+        with self._cache_lock:
+            self._cache[key] = _Entry(response, etag, last_modified, now + ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > _MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+        return response
+
+    def invalidate(self):
+        """
+        Forgets every cached answer.
+        """
+
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _ttl(self, url):
+        """
+        :param url: The URL, without parameters
+        :type url: str
+        :return: Seconds an answer from the URL is cached for, 0 for not at all
+        :rtype: float
+        """
+
+        for ending, ttl in self.ttls.items():
+            if url.lower().endswith(ending.lower()):
+                return ttl
+
+        return 0
+
+    def _get(self, url, **kwargs):
+        self._check_login()
 
         result = self.session.get(url, **kwargs)
-        if result and result.status_code == 200:
+        if result is not None and result.status_code in (200, 304):
             # We have refreshed the session.
             self.last_login = time.time()
 
@@ -103,17 +280,33 @@ class Session(object):
         :rtype: requests.Response
         """
 
-        if self._login_expired():
-            self.login()
+        self._check_login()
 
         result = self.session.post(url, data, json, **kwargs)
 
+        # Whatever was changed may be in any of the cached answers
+        self.invalidate()
+
         if result and result.status_code == 200:
             # We have refreshed the session.
             self.last_login = time.time()
 
         return result
 
+    def _check_login(self):
+        """
+        Logs in again if the session has expired. Threads that find the session expired
+        at the same time wait for a single login.
+        """
+
+        if not self._login_expired():
+            return
+
+        with self._login_lock:
+            # Someone else may have logged in while we waited
+            if self._login_expired():
+                self._login()
+
     def _login_expired(self):
         """
         Checks to sees if this session is expired
@@ -22,11 +22,15 @@ import json
 import logging
 import time
 import hashlib
+import os
 from io import BytesIO
 
 import requests
+import zonebot
+from zonebot.zoneminder.frames import capture_filename, score_statistics, select_key_frames
+from zonebot.zoneminder.index import EventIndex
 from zonebot.zoneminder.monitors import Monitors
-from zonebot.zoneminder.session import Session
+from zonebot.zoneminder.session import Session, cache_ttls
 
 LOGGER = logging.getLogger("zoneminder")
 
@@ -69,6 +73,9 @@ class ZoneMinder(object):
         self.session = None
         self.monitors = None
 
+        # Created when first needed
+        self.event_index = None
+
     def login(self):
         """
         Creates a new session by logging into the ZoneMinder system
@@ -77,16 +84,22 @@ class ZoneMinder(object):
         self.session = Session(self.config.get('ZoneMinder', 'username', fallback=''),
                                self.config.get('ZoneMinder', 'password', fallback=''),
                                self.url,
-                               self.__default_session_timeout)
+                               self.__default_session_timeout,
+                               ttls=cache_ttls(self.config))
 
         # extra classes for the various components of ZoneMinder
-        self.monitors = Monitors(self.session, self.url)
+        self.monitors = Monitors(self.session, self.url,
+                                 workers=self.config.getint('ZoneMinder', 'concurrent changes',
+                                                            fallback=4))
 
-    def get_status(self):
+    def get_status(self, progress=None):
         """
         Obtains general status information about this install
 
-        :return: daemon state, process load, disk used
+        :param progress: Called with what is known so far, as each part is found
+        :type progress: callable
+        :return: version, daemon state ('daemon' as text, 'running' as a bool), process
+                 load ('load' as text, 'load values' as numbers), disk used
         :rtype: dict
         """
 
@@ -101,9 +114,12 @@ class ZoneMinder(object):
             status['version'] = 'Could not obtain ZoneMinder version. Response code {0}' \
                 .format(response.status_code)
         else:
-            data = json.loads(response.text)
+            data = response.json()
             status['version'] = data['version']
 
+        if progress:
+            progress(status)
+
         #
         # Daemon status
         #
@@ -113,8 +129,12 @@ class ZoneMinder(object):
             status['daemon'] = 'Could not obtain daemon status. Response code {0}'\
                 .format(response.status_code)
         else:
-            data = json.loads(response.text)
-            status['daemon'] = 'Running' if 1 == data['result'] else '*Not Running*'
+            data = response.json()
+            status['running'] = 1 == data['result']
+            status['daemon'] = 'Running' if status['running'] else '*Not Running*'
+
+        if progress:
+            progress(status)
 
         #
         # Load average
@@ -125,8 +145,9 @@ class ZoneMinder(object):
             status['load'] = 'Could not obtain process load status. Response code {0}' \
                 .format(response.status_code)
         else:
-            data = json.loads(response.text)
+            data = response.json()
             status['load'] = '/'.join(map(str, data['load']))
+            status['load values'] = [float(x) for x in data['load']]
 
         #
         # Disk usage. This very, ***VERY*** often times out and is currently disabled.
@@ -138,7 +159,7 @@ class ZoneMinder(object):
         #     status['usage'] = 'Could not obtain disk usage status. Response code {0}' \
         #         .format(response.status_code)
         # else:
-        #     data = json.loads(response.text)
+        #     data = response.json()
         #     for u in data['usage']:
         #         if 'Total' == u:
         #             continue
@@ -149,6 +170,27 @@ class ZoneMinder(object):
 
         return status
 
+    def get_disk_usage(self):
+        """
+        Obtains the disk space used by events. This can take a long time on systems
+        with many events.
+
+        :return: Gigabytes used by the events of all monitors
+        :rtype: float
+        """
+
+        url = "{0}/api/host/getDiskPercent.json".format(self.url)
+        response = self.session.get(url=url)
+        if response.status_code != 200:
+            raise Exception("Could not obtain disk usage, response code " +
+                            str(response.status_code))
+
+        usage = response.json()['usage']
+        if 'Total' in usage:
+            return float(usage['Total']['space'])
+
+        return sum(float(x['space']) for x in usage.values())
+
     def get_monitors(self):
         """
         Obtains the list of monitors connected to ZoneMinder. You must call `login` first.
@@ -158,6 +200,27 @@ class ZoneMinder(object):
 
         return self.monitors
 
+    def get_event_index(self):
+        """
+        Obtains the local index of events. The index file is the `index file` of the
+        `[Events]` section, or ``events.sqlite`` in the bot's state directory.
+
+        :return: The event index
+        :rtype: zonebot.zoneminder.index.EventIndex
+        """
+
+        if not self.event_index:
+            path = self.config.get('Events', 'index file', fallback=None)
+            if path:
+                path = os.path.expanduser(path)
+            else:
+                path = zonebot.state_path(self.config, 'events.sqlite')
+
+            self.event_index = EventIndex(
+                path, history=self.config.getint('Events', 'history', fallback=1000))
+
+        return self.event_index
+
     def load_event(self, monitor, timestamp):
         """
         Queries the server for the event with the provided starting timestamp and monitor
@@ -169,6 +232,22 @@ class ZoneMinder(object):
         :return: A JSON object containing the loaded event
         """
 
+        # Make a query for just this ID
+        return self.get_event(self.find_event(monitor, timestamp)['Id'])
+
+    def find_event(self, monitor, timestamp):
+        """
+        Queries the server for the summary (without frames) of the event with the
+        provided starting timestamp and monitor
+
+        :param monitor: The monitor from the which the event was generated
+        :type monitor: str
+        :param timestamp: The timestamp ('yyyy-mm-dd hh:mm:ss') at which the event started
+        :type timestamp: str
+        :return: The `Event` dictionary of the event
+        :rtype: dict
+        """
+
         url = "{0}/api/events/index/MonitorId:{1}/StartTime =:{2}.json".format(
             self.url,
             monitor,
@@ -185,23 +264,98 @@ class ZoneMinder(object):
         # we only ever refer to the first item.
         data = json.loads(timestamp_request.text)
 
-        # Now we should have the event ID in the returned data.
-        event_id = data['events'][0]["Event"]["Id"]
+        # Now we should have the event in the returned data.
+        return data['events'][0]["Event"]
+
+    def get_event(self, event_id):
+        """
+        Queries the server for the event (including all its frames) with the provided ID
+
+        :param event_id: The ID of the event
+        :type event_id: str
+        :return: A JSON object containing the loaded event
+        """
 
-        # Make a query for just this ID
         url = "{0}/api/events/{1}.json".format(self.url, event_id)
         LOGGER.debug("Loading event from %s", url)
 
         event_request = self.session.get(url=url)
         if event_request.status_code != 200:
             raise Exception("Could not obtain data for event " +
-                            event_id + " response code " + str(event_request.status_code))
+                            str(event_id) + " response code " + str(event_request.status_code))
 
         data = json.loads(event_request.text)
         return data
 
+    def iter_events(self, after_id, page_size=100):
+        """
+        Queries the server for every event with an ID greater than `after_id`, oldest
+        first. The events are fetched a page (of up to `page_size` events) at a time.
+
+        The events do not include their frames, see `get_event` for that.
+
+        :param after_id: Only events with an ID greater than this are returned
+        :type after_id: int
+        :param page_size: The number of events to ask for in each request
+        :type page_size: int
+        :return: A generator of the `Event` dictionary of each event
+        """
+
+        page = 1
+        while True:
+            url = "{0}/api/events/index/Id >:{1}.json".format(self.url, after_id)
+            params = {
+                'sort': 'Id',
+                'direction': 'asc',
+                'limit': page_size,
+                'page': page
+            }
+
+            LOGGER.debug("Loading page %d of events after %s", page, after_id)
+
+            response = self.session.get(url=url, params=params)
+            if response.status_code != 200:
+                raise Exception("Could not obtain events after " +
+                                str(after_id) + " response code " + str(response.status_code))
+
+            data = json.loads(response.text)
+            for event in data.get('events', []):
+                yield event['Event']
+
+            pagination = data.get('pagination', {})
+            if not data.get('events') or not pagination.get('nextPage'):
+                return
+
+            page += 1
+
+    def latest_event_id(self):
+        """
+        Queries the server for the ID of the most recent event
+
+        :return: The highest event ID, or 0 if there are no events at all
+        :rtype: int
+        """
+
+        url = "{0}/api/events/index.json".format(self.url)
+        params = {
+            'sort': 'Id',
+            'direction': 'desc',
+            'limit': 1
+        }
+
+        response = self.session.get(url=url, params=params)
+        if response.status_code != 200:
+            raise Exception("Could not obtain the latest event, response code " +
+                            str(response.status_code))
+
+        data = json.loads(response.text)
+        if not data.get('events'):
+            return 0
+
+        return int(data['events'][0]['Event']['Id'])
+
     @staticmethod
-    def parse_event(data):
+    def parse_event(data, count=1, spacing=0, threshold=0):
         """
         Parses the provided event data to extract a dictionary with:
 
@@ -211,9 +365,23 @@ class ZoneMinder(object):
          * 'duration' - event length, in seconds
          * 'id' - Number ID of the event
          * 'key_frame' - index number of the image in the event with the highest score.
+         * 'image_filename' - name of the image file for the key frame
+         * 'key_frames' - up to `count` of the highest scoring frames, in the order they
+           were captured. Each is a dictionary with 'id', 'frame_id', 'score' and
+           'image_filename'.
+         * 'local' - `True` if the event was read from the events directory rather
+           than the API. See :func:`zonebot.zoneminder.local.load_local_event`
+         * 'statistics' - the peak and mean score, and how long the score was above
+           `threshold`. See :func:`zonebot.zoneminder.frames.score_statistics`
 
         :param data: the JSON data representing the event
         :type data: dict
+        :param count: the number of key frames to select
+        :type count: int
+        :param spacing: the minimum number of frames between any two key frames
+        :type spacing: int
+        :param threshold: the score above which a frame counts as active in the statistics
+        :type threshold: int
         :return: a dictionary with the parsed event data.
         :rtype: dict
         """
@@ -223,26 +391,56 @@ class ZoneMinder(object):
                   'event': data['event']['Event']['Name'],
                   'cause': data['event']['Event']['Cause'],
                   'duration': data['event']['Event']['Length'],
-                  'id': data['event']['Event']['Id']
+                  'id': data['event']['Event']['Id'],
+                  'local': data.get('local', False)
                   }
 
-        score = 0
+        frames = select_key_frames(data['event']['Frame'], count=count, spacing=spacing)
 
-        key_frame = None
-        key_frame_id = None
+        result['key_frame'] = None
+        if frames:
+            result['key_frame'] = frames[0]['Id']
+            result['image_filename'] = capture_filename(frames[0]['FrameId'])
 
-        for frame in data['event']['Frame']:
-            if int(frame['Score']) > score:
-                key_frame = frame['Id']
-                key_frame_id = frame['FrameId']
-                score = int(frame['Score'])
+        result['key_frames'] = [{
+            'id': frame['Id'],
+            'frame_id': frame['FrameId'],
+            'score': int(frame['Score']),
+            'image_filename': capture_filename(frame['FrameId'])
+        } for frame in sorted(frames, key=lambda f: int(f['FrameId']))]
 
-        result['key_frame'] = key_frame
-        if key_frame_id:
-            result['image_filename'] = key_frame_id.zfill(5) + '-capture.jpg'
+        result['statistics'] = score_statistics(data['event']['Frame'],
+                                                threshold=threshold,
+                                                length=result['duration'])
 
         return result
 
+    def get_event_image(self, event_id, frame_id):
+        """
+        Returns the captured image of a single frame of an event.
+
+        :param event_id: The ID of the event
+        :type event_id: str
+        :param frame_id: The frame number within the event (`FrameId`, not `Id`)
+        :type frame_id: str
+        :return: The image and an error message. Only one of the two will be set.
+        """
+
+        url = '{0}/index.php'.format(self.url)
+        params = {
+            'view': 'image',
+            'eid': event_id,
+            'fid': frame_id
+        }
+
+        LOGGER.debug('Requesting frame %s of event %s', frame_id, event_id)
+
+        response = self.session.get(url, params=params, stream=True)
+        if response.status_code != 200:
+            return None, 'Could not download image. Response code {0}'.format(response.status_code)
+
+        return BytesIO(response.content), None
+
     def get_still_image(self, monitor):
         """
         Returns a single still image from the monitor.